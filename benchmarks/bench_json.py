@@ -0,0 +1,116 @@
+"""
+Neptune Exporter JSON Codec Benchmark.
+
+Compares decode and encode time and peak memory of the stdlib json module and orjson
+(when installed) on a synthetic 365-day Apex ilog, the largest payload the exporter handles.
+
+The stdlib decode timings include its bytes to str step; orjson parses the bytes directly.
+Both write 2-space indented export files. They differ only on NaN and infinities, which
+orjson encodes as null and the stdlib as NaN / Infinity.
+
+Usage:
+    python benchmarks/bench_json.py [runs]
+"""
+import gc
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from neptune_modules import neptune_json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def ilog_fixture(days=365, inputs=24, step_seconds=600):
+    """
+    Builds an ilog document shaped like /rest/ilog?days=365.
+
+    Args:
+        days (int, optional): Days of records. Defaults to 365.
+        inputs (int, optional): Inputs per record. Defaults to 24.
+        step_seconds (int, optional): Seconds between records. Defaults to 600 (the Apex default).
+
+    Returns:
+        dict: The ilog document.
+    """
+    start = 1700000000
+    input_types = ["Temp", "pH", "ORP", "Cond", "Amps", "pwr", "volts", "alk"]
+    records = []
+    for index in range(days * 86400 // step_seconds):
+        records.append({
+            "date": start + index * step_seconds,
+            "data": [{"did": "base_{}".format(input_index), "type": input_types[input_index % len(input_types)],
+                      "name": "Input{}".format(input_index), "value": round(70 + (index * 7 + input_index) % 113 / 10, 2)}
+                     for input_index in range(inputs)]
+        })
+    return {"ilog": {"hostname": "tank", "software": "5.12_CA25", "hardware": "1.0", "serial": "AC5:12345",
+                     "type": "AC5", "timezone": "-5.00", "record": records}}
+
+
+def measure(function, runs):
+    """
+    Times a function and records its peak traced allocation.
+
+    Args:
+        function (callable): The function to measure.
+        runs (int): Timed runs.
+
+    Returns:
+        tuple: (median seconds, peak bytes)
+    """
+    timings = []
+    for _ in range(runs):
+        gc.collect()
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    gc.collect()
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return statistics.median(timings), peak
+
+
+def main(runs=5):
+    document = ilog_fixture()
+    payload = json.dumps(document).encode()
+    print("365-day ilog fixture: {:,} records, {:.1f} MB".format(len(document["ilog"]["record"]), len(payload) / 1e6))
+    print("neptune_json backend: {}\n".format(neptune_json.backend))
+
+    cases = [
+        ("json.loads(text) (response.json())", lambda: json.loads(payload.decode())),
+        ("json.loads(bytes)", lambda: json.loads(payload)),
+        ("json.dumps indent=4 sort_keys", lambda: json.dumps(document, indent=4, sort_keys=True).encode()),
+        ("json.dumps compact sort_keys", lambda: json.dumps(document, separators=(",", ":"), sort_keys=True).encode()),
+    ]
+    if orjson is not None:
+        cases += [
+            ("orjson.loads(bytes)", lambda: orjson.loads(payload)),
+            ("orjson.dumps indent=2 sort_keys", lambda: orjson.dumps(document, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS)),
+            ("orjson.dumps compact sort_keys", lambda: orjson.dumps(document, option=orjson.OPT_SORT_KEYS)),
+        ]
+    else:
+        print("orjson is not installed. pip install orjson to compare.\n")
+    cases += [
+        ("neptune_json.loads", lambda: neptune_json.loads(payload)),
+        ("neptune_json.dumps pretty (default export)", lambda: neptune_json.dumps(document, pretty=True)),
+        ("neptune_json.dumps compact (compact=true export)", lambda: neptune_json.dumps(document)),
+    ]
+
+    print("{:<48} {:>10} {:>12}".format("case", "median ms", "peak MB"))
+    for name, function in cases:
+        median, peak = measure(function, runs)
+        print("{:<48} {:>10.1f} {:>12.1f}".format(name, median * 1000, peak / 1e6))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,81 @@
+"""
+Neptune Exporter Startup Benchmark.
+
+Measures the cold import time of neptune_exporter (what systemd pays on every restart)
+and of each backend module, and reports whether Selenium is loaded at startup.
+
+Usage:
+    python benchmarks/bench_startup.py [runs]
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+repository_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+IMPORT_TARGETS = [
+    "neptune_exporter",
+    "neptune_modules.neptune_apex",
+    "neptune_modules.neptune_fusion"
+]
+
+
+def cold_import(module_name):
+    """
+    Imports a module in a fresh interpreter.
+
+    Args:
+        module_name (str): The module to import.
+
+    Returns:
+        tuple: (wall seconds, True if selenium was imported)
+    """
+    code = "import sys, {0}; print('selenium' in sys.modules)".format(module_name)
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", code], cwd=repository_directory,
+                            capture_output=True, text=True, check=True)
+    elapsed = time.perf_counter() - started
+    return elapsed, result.stdout.strip().endswith("True")
+
+
+def import_time_breakdown(module_name, top=10):
+    """
+    Runs python -X importtime and returns the slowest cumulative imports.
+
+    Args:
+        module_name (str): The module to import.
+        top (int, optional): Number of entries to return. Defaults to 10.
+
+    Returns:
+        list: (cumulative microseconds, imported module name) tuples.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import {}".format(module_name)],
+                            cwd=repository_directory, capture_output=True, text=True, check=True)
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, imported = line[len("import time:"):].split("|")
+        entries.append((int(cumulative), imported.strip()))
+    return sorted(entries, reverse=True)[:top]
+
+
+def main(runs=5):
+    for module_name in IMPORT_TARGETS:
+        timings = []
+        selenium_loaded = False
+        for _ in range(runs):
+            elapsed, selenium_loaded = cold_import(module_name)
+            timings.append(elapsed)
+        print("{:<34} median {:7.1f} ms  min {:7.1f} ms  selenium loaded: {}".format(
+            module_name, statistics.median(timings) * 1000, min(timings) * 1000, selenium_loaded))
+
+    print("\nSlowest imports for neptune_exporter (cumulative):")
+    for cumulative, imported in import_time_breakdown("neptune_exporter"):
+        print("  {:8.1f} ms  {}".format(cumulative / 1000, imported))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -1,21 +1,41 @@
 """
 Neptune Apex Exporter for Prometheus.
 """
-import json
+import asyncio
+import hmac
 import socket
 import os
 import glob
 from pathlib import Path
+from typing import Optional
 import uvicorn
-from fastapi import FastAPI, Response, status, HTTPException
-from fastapi.responses import PlainTextResponse, RedirectResponse
+from fastapi import FastAPI, Request, Response, status, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse, RedirectResponse, StreamingResponse
 from starlette.responses import FileResponse
 import yaml
-from neptune_modules import neptune_apex
-from neptune_modules import neptune_fusion
+from neptune_modules import neptune_admission
+from neptune_modules import neptune_aggregates
+from neptune_modules import neptune_backfill
+from neptune_modules import neptune_cache
+from neptune_modules import neptune_config
+from neptune_modules import neptune_history
+from neptune_modules import neptune_json
+from neptune_modules import neptune_logs
+from neptune_modules import neptune_mlog
+from neptune_modules import neptune_profiling
+from neptune_modules import neptune_remote_write
+from neptune_modules import neptune_sharding
+from neptune_modules import neptune_snapshots
+from neptune_modules import neptune_warmup
+from neptune_modules import prometheus_metrics
+import functools
+import importlib
+import multiprocessing
+import threading
 import logging.config
 import shutil
 import datetime
+import time
 
 def setup_logger(name, log_file, level=logging.INFO):
     """
@@ -47,6 +67,126 @@ except:
     application_logger.error('Configuration File Load Failed')
     exit()
 
+neptune_admission.admission_controller.configure(configuration.get("apex_admission"))
+neptune_cache.payload_cache.configure(configuration.get("payload_cache"))
+neptune_mlog.mlog_store.configure(configuration.get("mlog_cache"))
+neptune_aggregates.aggregate_store.configure(configuration.get("rolling_aggregates"))
+
+# Backends are imported on first use so an Apex-only deployment never loads Selenium.
+backend_modules = {}
+
+def backend_enabled(backend_name):
+    """
+    Checks exporter.yml for a per-deployment backend switch.
+
+    A missing or empty apex_module / fusion_module section leaves the backend enabled.
+
+    Args:
+        backend_name (str): The backend name, "apex" or "fusion".
+
+    Returns:
+        bool: True if the backend is enabled.
+    """
+    backend_settings = configuration.get("{}_module".format(backend_name)) or {}
+    return bool(backend_settings.get("enabled", True))
+
+def load_backend(backend_name):
+    """
+    Imports a backend module and loads its configuration on first use.
+
+    Args:
+        backend_name (str): The backend name, "apex" or "fusion".
+
+    Returns:
+        module: The neptune_modules.neptune_<backend_name> module.
+
+    Raises:
+        HTTPException: 404 if the backend is disabled, 503 if it can not be loaded.
+    """
+    if backend_name in backend_modules:
+        return backend_modules[backend_name]
+    if not backend_enabled(backend_name):
+        raise HTTPException(status_code=404, detail="The {} module is disabled in exporter.yml.".format(backend_name))
+    try:
+        backend_module = importlib.import_module("neptune_modules.neptune_{}".format(backend_name))
+        backend_module.load_configuration()
+        reload_interval = configuration.get("config_reload_interval", 5)
+        if reload_interval:
+            backend_module.configuration_store.watch(reload_interval)
+    except Exception as e:
+        application_logger.error('{} Module Load Failed: {}'.format(backend_name.capitalize(), e))
+        raise HTTPException(status_code=503, detail="The {} module could not be loaded.".format(backend_name))
+    backend_modules[backend_name] = backend_module
+    return backend_module
+
+def require_valid_sharding():
+    """
+    Rejects requests while sharding.yml exists but has never loaded.
+
+    Raises:
+        HTTPException: 503 until sharding.yml is fixed.
+    """
+    if neptune_sharding.sharding_invalid():
+        raise HTTPException(status_code=503, detail="sharding.yml is invalid. This node serves no targets until it loads.")
+
+def require_owner(kind, target):
+    """
+    Rejects requests for targets that belong to another exporter node.
+
+    Args:
+        kind (str): "apex" or "fusion".
+        target (str): The Apex IP address or Fusion Apex ID.
+
+    Raises:
+        HTTPException: 421 naming the owning node when sharding.yml assigns the target elsewhere,
+            503 while sharding.yml is invalid.
+    """
+    require_valid_sharding()
+    if not neptune_sharding.owns(kind, target):
+        raise HTTPException(status_code=421, detail="{} is collected by {}. Use /sd/{} for service discovery.".format(
+            target, neptune_sharding.owner(kind, target), kind))
+
+history_store = neptune_history.HistoryStore(configuration.get("history_directory") or neptune_history.history_directory)
+
+def server_settings():
+    """
+    Returns:
+        dict: The server section of exporter.yml.
+    """
+    return configuration.get("server") or {}
+
+def serving_from_snapshots():
+    """
+    Checks if this process is a multi-worker server that serves metrics from the snapshot store.
+
+    Returns:
+        bool: True when exporter.yml server.workers is above 1.
+    """
+    return int(server_settings().get("workers", 1)) > 1
+
+# Set in the multi-worker collector process, the only process that talks to the Apex and Fusion.
+snapshot_collector_process = False
+
+def require_upstream_access():
+    """
+    Refuses routes that connect to an Apex or Fusion in multi-worker workers.
+
+    In multi-worker mode only the collector process holds Apex sessions and Fusion browsers.
+    Exports, history syncs and profiles need a single-worker exporter.
+
+    Raises:
+        HTTPException: 501 when this process is a multi-worker worker.
+    """
+    if serving_from_snapshots() and not snapshot_collector_process:
+        raise HTTPException(status_code=501, detail="Not available when server.workers is above 1. Only the collector "
+                                                    "process connects to the Apex and Fusion. Use a single-worker exporter.")
+snapshot_store = None
+if serving_from_snapshots():
+    snapshot_store = neptune_snapshots.SnapshotStore(server_settings().get("snapshot_directory")
+                                                     or neptune_snapshots.snapshot_directory)
+# Workers gzip snapshot bodies themselves, keyed by the collector's ETag.
+snapshot_gzip_cache = prometheus_metrics.ExpositionCache()
+
 app = FastAPI(
     title="Neptune Exporter",
     summary="Prometheus Exporter for the Neptune Apex.",
@@ -69,6 +209,10 @@ app = FastAPI(
             "name": "Fusion",
             "description": "Get Fusion Metrics in Prometheus Format",
         },
+        {
+            "name": "Exporter",
+            "description": "Get the Neptune Exporter's own metrics in Prometheus Format",
+        },
         {
             "name": "Export Logs",
             "description": "Download Neptune Exporter Log data.",
@@ -80,27 +224,42 @@ app = FastAPI(
         {
             "name": "Export Fusion JSON Files",
             "description": "Download Fusion JSON data.",
+        },
+        {
+            "name": "History",
+            "description": "Query Apex ilog and Fusion mlog history stored by the exporter.",
+        },
+        {
+            "name": "Health",
+            "description": "Readiness of the exporter after startup.",
+        },
+        {
+            "name": "Service Discovery",
+            "description": "Prometheus http_sd target lists mapping each target to the exporter node that owns it.",
+        },
+        {
+            "name": "Debug",
+            "description": "Token-protected CPU and memory profiles of live /metrics and /export requests.",
         }
     ]
 )
 
 def clean_workspace():
     """
-    Cleans the workspace directory by removing all files and directories within it.
+    Cleans the workspace directory by removing all files and directories within it, except the lock file.
+    Call with the workspace lock held.
     Returns:
-        bool: True if the workspace is successfully cleaned, False if the workspace is locked.
+        bool: True once the workspace is cleaned.
     """
 
     # Defining Work Space
     workspace_directory = os.path.join(os.path.dirname(__file__), "workspace")
 
-    # Check Workspace Lock / Lock Workspace
-    if os.path.isfile(workspace_directory + "WORKSPACE_LOCKED") == True:
-        return False
-
-    # Cleaning Work Space
+    # Cleaning Work Space. The lock file belongs to the export that called this.
     files = glob.glob('{}/*'.format(workspace_directory))
     for f in files:
+        if os.path.basename(f) == "WORKSPACE_LOCKED":
+            continue
         if os.path.isfile(f):
             os.remove(f)
         if os.path.isdir(f):
@@ -126,35 +285,199 @@ def is_file_older_than(file, delta):
         return True
     return False
 
+# Held for the whole of an export. The lock file extends it to the other uvicorn workers.
+workspace_lock = threading.Lock()
+
+def lock_workspace(workspace_directory):
+    """
+    Takes the export workspace lock without waiting.
+
+    The lock file is created with O_CREAT | O_EXCL, so only one process can hold it.
+    A lock file older than 5 minutes was left by a crashed export and is replaced.
+
+    Args:
+        workspace_directory (str): The workspace directory.
+
+    Returns:
+        bool: True if the lock was taken. Release it with unlock_workspace().
+    """
+    if not workspace_lock.acquire(blocking=False):
+        return False
+    lock_path = os.path.join(workspace_directory, "WORKSPACE_LOCKED")
+    try:
+        os.makedirs(workspace_directory, exist_ok=True)
+        if os.path.isfile(lock_path) and is_file_older_than(lock_path, datetime.timedelta(seconds=300)):
+            os.remove(lock_path)
+        os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        return True
+    except OSError:
+        workspace_lock.release()
+        return False
+
+def unlock_workspace(workspace_directory):
+    """
+    Releases the export workspace lock taken by lock_workspace().
+
+    Args:
+        workspace_directory (str): The workspace directory.
+    """
+    try:
+        os.remove(os.path.join(workspace_directory, "WORKSPACE_LOCKED"))
+    except FileNotFoundError:
+        pass
+    workspace_lock.release()
+
+def snapshot_renderer(source, target):
+    """
+    Builds a metrics_response() render function that reads the collector's snapshot of a target.
+
+    Args:
+        source (str): "apex" or "fusion".
+        target (str): The Apex IP address or Fusion Apex ID.
+
+    Returns:
+        callable: render(exposition_format) returning (body bytes, ETag string).
+    """
+    max_age = 3 * int(server_settings().get("collect_interval", 60))
+
+    def render(exposition_format):
+        snapshot = snapshot_store.read(source, target, exposition_format)
+        if snapshot is None:
+            raise HTTPException(status_code=503, detail="{} has not been collected yet. Only apex.yml apex_targets and "
+                                                        "fusion.yml apex_systems are collected in multi-worker mode.".format(target))
+        if snapshot.age() > max_age:
+            raise HTTPException(status_code=503, detail="The last snapshot of {} is {} seconds old.".format(
+                target, int(snapshot.age())))
+        return snapshot.body, snapshot.etag
+    return render
+
+def metrics_response(request, render, exposition_cache, cache_key):
+    """
+    Builds a metrics response negotiated from the request headers.
+
+    The exposition format comes from Accept (Prometheus text 0.0.4 or OpenMetrics 1.0.0)
+    and bodies of at least gzip_min_size bytes are gzipped when Accept-Encoding allows it.
+
+    Args:
+        request (Request): The incoming request.
+        render (callable): render(exposition_format) returning (body bytes, ETag string).
+        exposition_cache (ExpositionCache): The cache render() stored its output in.
+        cache_key (str): The cache target render() used, without the format.
+
+    Returns:
+        Response: The metrics response, or 304 Not Modified for a matching If-None-Match.
+    """
+    exposition_format = prometheus_metrics.negotiate_format(request.headers.get("accept"))
+    metrics_body, metrics_etag = render(exposition_format)
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    gzip_min_size = configuration.get("gzip_min_size", 1024)
+    if gzip_min_size is not None and len(metrics_body) >= gzip_min_size \
+            and prometheus_metrics.accepts_gzip(request.headers.get("accept-encoding")):
+        metrics_body = exposition_cache.gzip_body((cache_key, exposition_format), metrics_etag, metrics_body)
+        metrics_etag = metrics_etag + "-gzip"
+        headers["Content-Encoding"] = "gzip"
+    headers["ETag"] = '"{}"'.format(metrics_etag)
+    if prometheus_metrics.matches_etag(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers={"ETag": headers["ETag"], "Vary": headers["Vary"]})
+    return Response(metrics_body, media_type=prometheus_metrics.CONTENT_TYPES[exposition_format], headers=headers)
+
+def admission_rejected_response(request, error):
+    """
+    Answers a request that Apex admission control shed.
+
+    Args:
+        request (Request): The incoming request.
+        error (neptune_admission.AdmissionRejected): The rejection.
+
+    Returns:
+        PlainTextResponse: 503 with Retry-After.
+    """
+    return PlainTextResponse(str(error), status_code=503, headers={"Retry-After": "10"})
+
+app.add_exception_handler(neptune_admission.AdmissionRejected, admission_rejected_response)
+
 @app.get("/metrics/apex", response_class=PlainTextResponse, tags=["Apex"])
-async def apex_prometheus_metrics(target, auth_module):
+def apex_prometheus_metrics(request: Request, target, auth_module):
     """
     Get Apex metrics in Prometheus format.
 
+    Send "Accept: application/openmetrics-text" for OpenMetrics and "Accept-Encoding: gzip"
+    for compression. The response carries an ETag of the rendered metrics. A client sending
+    a matching If-None-Match header gets 304 Not Modified.
+
+    In multi-worker mode the collector process's snapshot is served and auth_module is the
+    one set for the target in apex.yml apex_targets.
+
     Args:
         target (str): The IP address of the Apex device.
         auth_module (str): The authentication module.
 
     Returns:
-        str: The Prometheus metrics.
+        Response: The Prometheus metrics.
+    """
+    require_owner("apex", target)
+    if serving_from_snapshots():
+        return metrics_response(request, snapshot_renderer("apex", target), snapshot_gzip_cache, ("apex", target))
+    apex_module = load_backend("apex")
+    apex_direct = apex_module.APEX(apex_ip=target, auth_module=auth_module)
+    return metrics_response(request, apex_direct.prometheus_exposition, apex_module.exposition_cache, target)
+
+def exporter_exposition():
+    """
+    Returns:
+        str: This process's admission control, payload cache and mlog cache metrics in Prometheus text format.
+    """
+    return (neptune_admission.admission_controller.exposition() + neptune_cache.payload_cache.exposition()
+            + neptune_mlog.mlog_store.exposition())
+
+@app.get("/metrics/exporter", response_class=PlainTextResponse, tags=["Exporter"])
+async def exporter_prometheus_metrics():
+    """
+    Get the exporter's own metrics in Prometheus format.
+
+    Includes Apex admission control queue waits, rejections and requests in flight,
+    the payload cache hit ratio and size, and the Fusion mlog cache refreshes.
+    In multi-worker mode these are the collector process's counters as of its last collection.
+
+    Returns:
+        PlainTextResponse: The Prometheus metrics.
     """
-    apex_direct = neptune_apex.APEX(apex_ip=target, auth_module=auth_module)
-    return apex_direct.prometheus_metrics()
+    if serving_from_snapshots():
+        snapshot = snapshot_store.read("exporter", "collector", prometheus_metrics.TEXT_FORMAT)
+        exporter_metrics = snapshot.body.decode() if snapshot is not None else ""
+    else:
+        exporter_metrics = exporter_exposition()
+    return PlainTextResponse(exporter_metrics, media_type=prometheus_metrics.CONTENT_TYPES[prometheus_metrics.TEXT_FORMAT])
 
 @app.get("/metrics/fusion", response_class=PlainTextResponse, tags=["Fusion"])
-async def fusion_prometheus_metrics(data_max_age, fusion_apex_id):
+def fusion_prometheus_metrics(request: Request, data_max_age, fusion_apex_id):
     """
     Get Fusion metrics in Prometheus format.
 
+    Supports the same Accept / Accept-Encoding negotiation as /metrics/apex.
+    In multi-worker mode the collector process's snapshot is served, collected with
+    server.fusion_data_max_age.
+
     Args:
         data_max_age (int): The maximum age of the data.
         fusion_apex_id (str): The ID of the Fusion Apex.
 
     Returns:
-        str: The Prometheus metrics.
+        Response: The Prometheus metrics.
     """
-    apex_fusion = neptune_fusion.FUSION(fusion_apex_id, data_max_age)
-    return apex_fusion.prometheus_metrics()
+    require_owner("fusion", fusion_apex_id)
+    if serving_from_snapshots():
+        return metrics_response(request, snapshot_renderer("fusion", str(fusion_apex_id)), snapshot_gzip_cache,
+                                ("fusion", str(fusion_apex_id)))
+    fusion_module = load_backend("fusion")
+    apex_fusion = fusion_module.FUSION(fusion_apex_id, data_max_age)
+    try:
+        return metrics_response(request, apex_fusion.prometheus_exposition, fusion_module.exposition_cache,
+                                str(fusion_apex_id))
+    except Exception:
+        # The pooled browser may have been logged out. Start fresh on the next scrape.
+        fusion_module.close_browser_session(fusion_apex_id)
+        raise
 
 @app.get("/export/logs/", response_class=PlainTextResponse, tags=["Export Log Data"])
 async def apex_exporter_logs():
@@ -170,148 +493,835 @@ async def apex_exporter_logs():
     workspace_directory = os.path.join(os.path.dirname(__file__), 'workspace')
     
     # Check Workspace Lock / Lock Workspace
-    if is_file_older_than(workspace_directory + "/WORKSPACE_LOCKED", datetime.timedelta(seconds=300)) == False or os.path.isfile(workspace_directory + "WORKSPACE_LOCKED") == True:
+    if not lock_workspace(workspace_directory):
         return "Export Workspace Locked. Please run 1 export at a time.\nIf an error occurred and the lock is still in place. Wait 5 minutes and try again."
     
-    # Cleaning Work Space
-    clean_workspace()
+    try:
+        # Cleaning Work Space
+        clean_workspace()
 
-    # Locking Workspace
-    with open(os.path.join(workspace_directory, "WORKSPACE_LOCKED"), "w") as lock_file:
-        lock_file.close()
+        # Compress files in workspace/temp_files. Zip is located in workspace
+        file_name_ts = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        file_name = f"neptune_exporter-logs.{file_name_ts}"
+        shutil.make_archive(os.path.join(workspace_directory, file_name), format='zip', root_dir=log_directory)
 
-    # Compress files in workspace/temp_files. Zip is located in workspace
-    file_name_ts = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
-    file_name = f"neptune_exporter-logs.{file_name_ts}"
-    shutil.make_archive(os.path.join(workspace_directory, file_name), format='zip', root_dir=log_directory)
+        # Provide Download
+        return FileResponse(os.path.join(workspace_directory, f"{file_name}.zip"), media_type='application/octet-stream', filename=f"{file_name}.zip")
+    finally:
+        unlock_workspace(workspace_directory)
+
+@app.get("/export/logs/range/", tags=["Export Log Data"])
+async def apex_exporter_log_range(logger: str = "neptune_exporter", level: str = "DEBUG",
+                                  start: Optional[str] = None, end: Optional[str] = None, compress: bool = False):
+    """
+    Stream the log records of one logger inside a time range.
 
-    # Remove Workspace Lock and Provide Download
-    os.remove(workspace_directory + "/WORKSPACE_LOCKED")
-    return FileResponse(os.path.join(workspace_directory, f"{file_name}.zip"), media_type='application/octet-stream', filename=f"{file_name}.zip")
+    Unlike /export/logs/ this does not archive the logs directory. Only the current and
+    rotated log files overlapping the range are read, starting at the first matching record.
+
+    Args:
+        logger (str): The logger name (neptune_exporter, neptune_apex or neptune_fusion).
+        level (str): The minimum log level to include.
+        start (str): Range start as ISO 8601 or epoch seconds. Defaults to 1 hour before end.
+        end (str): Range end as ISO 8601 or epoch seconds. Defaults to now.
+        compress (bool): Gzip the streamed file.
+
+    Returns:
+        StreamingResponse: The matching log records.
+    """
+    if logger not in neptune_logs.LOG_FILES:
+        raise HTTPException(status_code=400, detail="Unknown logger. Use one of: {}".format(", ".join(neptune_logs.LOG_FILES)))
+    try:
+        range_end = neptune_logs.parse_time(end, datetime.datetime.now())
+        range_start = neptune_logs.parse_time(start, range_end - datetime.timedelta(hours=1))
+        log_stream = neptune_logs.export_log_range(logger, range_start, range_end, level=level, compress=compress)
+        first_chunk = next(log_stream, b"")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    def log_chunks():
+        yield first_chunk
+        yield from log_stream
+
+    file_name_ts = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    file_name = f"{logger}.{file_name_ts}.log"
+    media_type = "text/plain"
+    if compress:
+        file_name = f"{file_name}.gz"
+        media_type = "application/gzip"
+    return StreamingResponse(log_chunks(), media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{file_name}"'})
 
 @app.get("/export/apex/", response_class=PlainTextResponse, tags=["Export Apex JSON Files"])
-async def export_apex_json(target, auth_module):
+def export_apex_json(target, auth_module, compact: bool = False):
     """
     Export Apex JSON data from Neptune Apex device.
     Args:
         target (str): The IP address of the Neptune Apex device.
         auth_module (str): The authentication module to be used.
+        compact (bool): Write the JSON files without indentation. Much smaller for the 365 day ilog.
     Returns:
         FileResponse: The response containing the exported JSON data in a zip file.
     Raises:
         FileNotFoundError: If the workspace directory or any required files are not found.
         Exception: If the workspace is locked or an error occurs during the export process.
     """
+    require_upstream_access()
+    require_owner("apex", target)
 
     # Defining Work Space
     workspace_directory = os.path.join(os.path.dirname(__file__), "workspace")
 
     # Check Workspace Lock / Lock Workspace
-    if is_file_older_than(workspace_directory + "/WORKSPACE_LOCKED", datetime.timedelta(seconds=300)) == False or os.path.isfile(workspace_directory + "WORKSPACE_LOCKED") == True:
+    if not lock_workspace(workspace_directory):
         return "Export Workspace Locked. Please run 1 export at a time.\nIf an error occurred and the lock is still in place. Wait 5 minutes and try again."
 
-    # Cleaning Work Space
-    clean_workspace()
+    try:
+        # Cleaning Work Space
+        clean_workspace()
 
-    # Locking Workspace
-    with open(os.path.join(workspace_directory, "WORKSPACE_LOCKED"), "w") as lock_file:
-        lock_file.close()
+        # Creating JSON Folder
+        temp_files_folder = os.path.join(workspace_directory, "temp_files")
+        if os.path.isdir(temp_files_folder) == False:
+            os.mkdir(temp_files_folder)
 
-    # Creating JSON Folder
-    temp_files_folder = os.path.join(workspace_directory, "temp_files")
-    if os.path.isdir(temp_files_folder) == False:
-        os.mkdir(temp_files_folder)
-
-    # Setting up Neptune Apex Class in Debug Mode
-    apex_direct = neptune_apex.APEX(apex_ip=target, auth_module=auth_module, apex_debug = True)
+        # Setting up Neptune Apex Class in Debug Mode
+        apex_direct = load_backend("apex").APEX(apex_ip=target, auth_module=auth_module, apex_debug = True)
     
-    # Status JSON
-    with open(os.path.join(temp_files_folder, "status.json"), "w") as data_file:
-        json.dump(apex_direct.status(), data_file, indent=4, sort_keys=True)
-        data_file.close()
+        # Status JSON
+        neptune_json.dump_file(apex_direct.status(), os.path.join(temp_files_folder, "status.json"), compact)
     
-    # ILOG JSON
-    with open(os.path.join(temp_files_folder, "ilog.json"), "w") as data_file:
-        json.dump(apex_direct.internal_log(), data_file, indent=4, sort_keys=True)
-        data_file.close()
-
-    # DOS JSON
-    with open(os.path.join(temp_files_folder, "dlog.json"), "w") as data_file:
-        json.dump(apex_direct.dos_log(), data_file, indent=4, sort_keys=True)
-        data_file.close()
-
-    # Trident JSON
-    with open(os.path.join(temp_files_folder, "tlog.json"), "w") as data_file:
-        json.dump(apex_direct.trident_log(), data_file, indent=4, sort_keys=True)
-        data_file.close()
-
-    # Config JSON
-    with open(os.path.join(temp_files_folder, "config.json"), "w") as data_file:
-        json.dump(apex_direct.trident_log(), data_file, indent=4, sort_keys=True)
-        data_file.close()
-
-    # Compress files in workspace/temp_files. Zip is located in workspace
-    file_name_ts = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
-    file_name = f"neptune_apex-json.{file_name_ts}"
-    shutil.make_archive(os.path.join(workspace_directory, file_name), format='zip', root_dir=temp_files_folder)
+        # ILOG JSON
+        ilog_data = apex_direct.internal_log()
+        neptune_json.dump_file(ilog_data, os.path.join(temp_files_folder, "ilog.json"), compact)
+        if ilog_data is not None:
+            neptune_history.store_series(history_store, "apex", target, neptune_history.apex_ilog_series(ilog_data))
 
-    # Remove Workspace Lock and Provide Download
-    os.remove(workspace_directory + "/WORKSPACE_LOCKED")
-    return FileResponse(os.path.join(workspace_directory, f"{file_name}.zip"), media_type='application/octet-stream', filename=f"{file_name}.zip")
+        # DOS JSON
+        neptune_json.dump_file(apex_direct.dos_log(), os.path.join(temp_files_folder, "dlog.json"), compact)
+
+        # Trident JSON
+        neptune_json.dump_file(apex_direct.trident_log(), os.path.join(temp_files_folder, "tlog.json"), compact)
+
+        # Config JSON
+        neptune_json.dump_file(apex_direct.trident_log(), os.path.join(temp_files_folder, "config.json"), compact)
+
+        # Compress files in workspace/temp_files. Zip is located in workspace
+        file_name_ts = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        file_name = f"neptune_apex-json.{file_name_ts}"
+        shutil.make_archive(os.path.join(workspace_directory, file_name), format='zip', root_dir=temp_files_folder)
+
+        # Provide Download
+        return FileResponse(os.path.join(workspace_directory, f"{file_name}.zip"), media_type='application/octet-stream', filename=f"{file_name}.zip")
+    finally:
+        unlock_workspace(workspace_directory)
 
 @app.get("/export/fusion/", response_class=PlainTextResponse, tags=["Export Fusion JSON Files"])
-async def export_fusion_json(fusion_apex_id):
+def export_fusion_json(fusion_apex_id, compact: bool = False):
     """
     Export Fusion JSON data.
     Args:
         fusion_apex_id (str): The ID of the Fusion Apex.
+        compact (bool): Write the JSON files without indentation.
     Returns:
         FileResponse: The response containing the exported JSON data in a zip file.
     Raises:
         FileNotFoundError: If the workspace directory or any required files are not found.
         Exception: If the workspace is locked or an error occurs during the export process.
     """
+    require_upstream_access()
+    require_owner("fusion", fusion_apex_id)
 
     # Defining Work Space
     workspace_directory = os.path.join(os.path.dirname(__file__), "workspace")
 
     # Check Workspace Lock / Lock Workspace
-    if is_file_older_than(workspace_directory + "/WORKSPACE_LOCKED", datetime.timedelta(seconds=300)) == False or os.path.isfile(workspace_directory + "WORKSPACE_LOCKED") == True:
+    if not lock_workspace(workspace_directory):
         return "Export Workspace Locked. Please run 1 export at a time.\nIf an error occurred and the lock is still in place. Wait 5 minutes and try again."
 
-    # Cleaning Work Space
-    clean_workspace()
+    try:
+        # Cleaning Work Space
+        clean_workspace()
+
+        # Creating JSON Folder
+        temp_files_folder = os.path.join(workspace_directory, "temp_files")
+        if os.path.isdir(temp_files_folder) == False:
+            os.mkdir(temp_files_folder)
+
+        # Setting up Neptune Fusion Class in Debug Mode
+        fusion_module = load_backend("fusion")
+        neptune_fusion_direct = fusion_module.FUSION(fusion_apex_id, 31536000, fusion_debug=True)
+
+        # Measurement Log JSON
+        neptune_json.dump_file(neptune_fusion_direct.get_measurement_log(), os.path.join(temp_files_folder, "mlog.json"), compact)
+
+        # Status JSON
+        neptune_json.dump_file(neptune_fusion_direct.get_status(), os.path.join(temp_files_folder, "status.json"), compact)
+
+        # Compress files in workspace/temp_files. Zip is located in workspace
+        file_name_ts = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        file_name = f"neptune_fusion-json.{file_name_ts}"
+        shutil.make_archive(os.path.join(workspace_directory, file_name), format='zip', root_dir=workspace_directory)
+
+        # Provide Download
+        return FileResponse(os.path.join(workspace_directory, f"{file_name}.zip"), media_type='application/octet-stream', filename=f"{file_name}.zip")
+    finally:
+        unlock_workspace(workspace_directory)
+
+@app.get("/api/history", tags=["History"])
+async def history_query(source: str, target: str, series: Optional[str] = None, start: Optional[str] = None,
+                        end: Optional[str] = None, step: Optional[int] = None, aggregate: str = "mean"):
+    """
+    Query stored Apex ilog / Fusion mlog history.
+
+    Reads only the local history store. Use /api/history/sync/apex or /api/history/sync/fusion
+    to pull new records from the device.
+
+    Args:
+        source (str): "apex" or "fusion".
+        target (str): The Apex IP address or Fusion Apex ID.
+        series (str): The series ID. Omit to list the target's series.
+        start (str): Range start as ISO 8601 or epoch seconds. Defaults to 1 day before end.
+        end (str): Range end as ISO 8601 or epoch seconds. Defaults to now.
+        step (int): Downsample into buckets of this many seconds.
+        aggregate (str): Bucket reduction: mean, min, max or last.
+
+    Returns:
+        dict: The series list, or the series metadata and [epoch milliseconds, value] points.
+    """
+    if source not in ("apex", "fusion"):
+        raise HTTPException(status_code=400, detail="source must be apex or fusion.")
+    require_owner(source, target)
+    if series is None:
+        return {"source": source, "target": target, "series": history_store.list_series(source, target)}
+    metadata = history_store.metadata(source, target, series)
+    if metadata is None:
+        raise HTTPException(status_code=404, detail="Unknown series: {}".format(series))
+    try:
+        range_end = neptune_logs.parse_time(end, datetime.datetime.now())
+        range_start = neptune_logs.parse_time(start, range_end - datetime.timedelta(days=1))
+        points = history_store.query(source, target, series, int(range_start.timestamp() * 1000),
+                                     int(range_end.timestamp() * 1000), step * 1000 if step else None, aggregate)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"source": source, "target": target, "series": series, "metadata": metadata, "points": points}
+
+@app.get("/api/history/sync/apex", tags=["History"])
+def history_sync_apex(target, auth_module):
+    """
+    Pull new Apex ilog records into the history store.
+
+    The first sync of a target pulls history_cold_start_days of ilog. Later syncs pull the days since
+    its newest stored record, so missed syncs are caught up.
+
+    Args:
+        target (str): The IP address of the Apex device.
+        auth_module (str): The authentication module.
+
+    Returns:
+        dict: The number of points written.
+    """
+    require_upstream_access()
+    require_owner("apex", target)
+    apex_direct = load_backend("apex").APEX(apex_ip=target, auth_module=auth_module, priority="sync")
+    appended = neptune_history.sync_apex(history_store, apex_direct, configuration.get("history_cold_start_days", 365))
+    return {"source": "apex", "target": target, "appended": appended}
 
-    # Locking Workspace
-    with open(os.path.join(workspace_directory, "WORKSPACE_LOCKED"), "w") as lock_file:
-        lock_file.close()
+@app.get("/api/history/sync/fusion", tags=["History"])
+def history_sync_fusion(fusion_apex_id):
+    """
+    Pull new Fusion mlog entries into the history store.
 
-    # Creating JSON Folder
-    temp_files_folder = os.path.join(workspace_directory, "temp_files")
-    if os.path.isdir(temp_files_folder) == False:
-        os.mkdir(temp_files_folder)
+    Args:
+        fusion_apex_id (str): The ID of the Fusion Apex.
 
-    # Setting up Neptune Fusion Class in Debug Mode
-    neptune_fusion_direct = neptune_fusion.FUSION(fusion_apex_id, 31536000, fusion_debug=True)
+    Returns:
+        dict: The number of points written.
+    """
+    require_upstream_access()
+    require_owner("fusion", fusion_apex_id)
+    fusion_module = load_backend("fusion")
+    apex_fusion = fusion_module.FUSION(fusion_apex_id, 0)
+    try:
+        appended = neptune_history.sync_fusion(history_store, apex_fusion, configuration.get("history_cold_start_days", 365))
+    except Exception:
+        fusion_module.close_browser_session(fusion_apex_id)
+        raise
+    return {"source": "fusion", "target": fusion_apex_id, "appended": appended}
 
-    # Measurement Log JSON
-    with open(os.path.join(temp_files_folder, "mlog.json"), "w") as data_file:
-        json.dump(neptune_fusion_direct.get_measurement_log(), data_file, indent=4, sort_keys=True)
-        data_file.close()
+def openmetrics_backfill_response(source, target, days):
+    """
+    Streams a target's stored history as an OpenMetrics backfill file.
 
-    # Status JSON
-    with open(os.path.join(temp_files_folder, "status.json"), "w") as data_file:
-        json.dump(neptune_fusion_direct.get_status(), data_file, indent=4, sort_keys=True)
-        data_file.close()
+    The store is append-only, so a target first synced with fewer days than requested can not be
+    extended backwards. The range the file covers is sent in X-History-Covered-Start / -End (epoch
+    seconds), and X-History-Complete is false when the store starts more than a day after the
+    requested start, so a short file is not mistaken for a full one.
 
-    # Compress files in workspace/temp_files. Zip is located in workspace
+    Args:
+        source (str): "apex" or "fusion".
+        target (str): The Apex IP address or Fusion Apex ID.
+        days (int): Days of history to include.
+
+    Returns:
+        StreamingResponse: The OpenMetrics file.
+    """
+    end = int(datetime.datetime.now().timestamp() * 1000)
+    start = end - int(days) * 86400 * 1000
     file_name_ts = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
-    file_name = f"neptune_fusion-json.{file_name_ts}"
-    shutil.make_archive(os.path.join(workspace_directory, file_name), format='zip', root_dir=workspace_directory)
+    file_name = "neptune_{}-backfill.{}.om".format(source, file_name_ts)
+    headers = {"Content-Disposition": f'attachment; filename="{file_name}"'}
+    stored_range = history_store.time_range(source, target)
+    if stored_range is None or stored_range[1] < start:
+        headers["X-History-Complete"] = "false"
+    else:
+        headers["X-History-Covered-Start"] = str(max(start, stored_range[0]) // 1000)
+        headers["X-History-Covered-End"] = str(min(end, stored_range[1]) // 1000)
+        headers["X-History-Complete"] = "true" if stored_range[0] <= start + 86400 * 1000 else "false"
+    if headers["X-History-Complete"] == "false":
+        application_logger.warning('OpenMetrics Backfill Incomplete: {} {} has no history before {}'.format(
+            source, target, headers.get("X-History-Covered-Start", "now")))
+    return StreamingResponse(neptune_backfill.openmetrics_backfill(history_store, source, target, start, end),
+                             media_type=prometheus_metrics.CONTENT_TYPES[prometheus_metrics.OPENMETRICS_FORMAT],
+                             headers=headers)
+
+@app.get("/export/openmetrics/apex", tags=["History"])
+def export_apex_openmetrics(target, auth_module, days: int = 365):
+    """
+    Download Apex ilog history as an OpenMetrics backfill file.
+
+    New ilog records are synced into the history store first. The file uses the metric names and
+    labels of /metrics/apex and can be loaded with "promtool tsdb create-blocks-from openmetrics".
+
+    Args:
+        target (str): The IP address of the Apex device.
+        auth_module (str): The authentication module.
+        days (int): Days of history to include.
+
+    Returns:
+        StreamingResponse: The OpenMetrics file.
+    """
+    require_upstream_access()
+    require_owner("apex", target)
+    apex_direct = load_backend("apex").APEX(apex_ip=target, auth_module=auth_module, priority="export")
+    neptune_history.sync_apex(history_store, apex_direct, max(days, 1))
+    return openmetrics_backfill_response("apex", target, days)
+
+@app.get("/export/openmetrics/fusion", tags=["History"])
+def export_fusion_openmetrics(fusion_apex_id, days: int = 365):
+    """
+    Download Fusion mlog history as an OpenMetrics backfill file.
+
+    New mlog entries are synced into the history store first. The file uses the metric names and
+    labels of /metrics/fusion.
+
+    Args:
+        fusion_apex_id (str): The ID of the Fusion Apex.
+        days (int): Days of history to include.
+
+    Returns:
+        StreamingResponse: The OpenMetrics file.
+    """
+    require_upstream_access()
+    require_owner("fusion", fusion_apex_id)
+    fusion_module = load_backend("fusion")
+    apex_fusion = fusion_module.FUSION(fusion_apex_id, 0)
+    try:
+        neptune_history.sync_fusion(history_store, apex_fusion, max(days, 1))
+    except Exception:
+        fusion_module.close_browser_session(fusion_apex_id)
+        raise
+    return openmetrics_backfill_response("fusion", fusion_apex_id, days)
+
+def collection_targets(backend_name, error_label):
+    """
+    Loads a backend and lists the targets a collection loop runs over.
+
+    A backend that fails to import or to load its configuration is logged and has no
+    targets, so the other backend is still collected.
+
+    Args:
+        backend_name (str): "apex" or "fusion".
+        error_label (str): Prefix for error log messages. Ex: "Remote Write".
+
+    Returns:
+        tuple: (backend module or None, apex_targets or fusion_systems list)
+    """
+    if not backend_enabled(backend_name):
+        return None, []
+    try:
+        backend_module = load_backend(backend_name)
+        backend_configuration = backend_module.load_configuration()
+        if backend_name == "apex":
+            return backend_module, list(backend_configuration.apex_targets)
+        return backend_module, list(backend_configuration.fusion_systems)
+    except Exception as e:
+        application_logger.error('{} {} Setup Failed: {}'.format(error_label, backend_name.capitalize(), e))
+        return None, []
+
+def collect_push_series():
+    """
+    Collects every Apex in apex.yml apex_targets and every Fusion ID in fusion.yml for remote write.
+
+    With sharding.yml in place only the targets this node owns are collected.
+
+    Series get job and instance labels matching the scrape jobs in prometheus_example.yml.
+    A failing target is logged and skipped.
+
+    Returns:
+        list: (labels dict, [(epoch milliseconds, value)]) tuples.
+    """
+    series = []
+    timestamp = int(datetime.datetime.now().timestamp() * 1000)
+    apex_module, apex_targets = collection_targets("apex", "Remote Write")
+    for target, auth_module in apex_targets:
+        if not neptune_sharding.owns("apex", target):
+            continue
+        try:
+            apex_direct = apex_module.APEX(apex_ip=target, auth_module=auth_module)
+            apex_status = apex_direct.status()
+            metric_samples = [(metric_name, metric_labels, metric_value) for (metric_name, metric_labels), metric_value
+                              in zip(apex_direct.metric_sample_keys(apex_status), apex_direct.metric_values(apex_status))]
+            # The rolling aggregates /metrics/apex exports, so push-mode users can alert on them too.
+            metric_samples += neptune_aggregates.aggregate_store.samples(
+                target, lambda days, apex_direct=apex_direct: apex_direct.internal_log(days=days))
+            series += neptune_remote_write.samples_to_series(metric_samples, timestamp,
+                                                             {"job": "neptune_apex", "instance": target})
+        except Exception as e:
+            application_logger.error('Remote Write Apex Collection Failed: {} {}'.format(target, e))
+    fusion_module, fusion_systems = collection_targets("fusion", "Remote Write")
+    for fusion_apex_id in fusion_systems:
+        if not neptune_sharding.owns("fusion", fusion_apex_id):
+            continue
+        try:
+            apex_fusion = fusion_module.FUSION(fusion_apex_id, remote_write_settings().get("interval", 300))
+            series += neptune_remote_write.samples_to_series(apex_fusion.metric_samples(), timestamp,
+                                                             {"job": "neptune_fusion", "instance": fusion_apex_id})
+        except Exception as e:
+            fusion_module.close_browser_session(fusion_apex_id)
+            application_logger.error('Remote Write Fusion Collection Failed: {} {}'.format(fusion_apex_id, e))
+    return series
+
+def remote_write_settings():
+    """
+    Returns:
+        dict: The remote_write section of exporter.yml.
+    """
+    return configuration.get("remote_write") or {}
+
+def start_remote_write():
+    """
+    Starts push mode when remote_write is enabled in exporter.yml.
+    """
+    settings = remote_write_settings()
+    if not settings.get("enabled", False):
+        return
+    if serving_from_snapshots() and not snapshot_collector_process:
+        # Only the collector process talks to the Apex and Fusion.
+        return
+    wal = neptune_remote_write.WriteAheadLog(settings.get("wal_directory") or neptune_remote_write.wal_directory,
+                                             int(settings.get("wal_max_bytes", 64 * 1024 * 1024)))
+    remote_writer = neptune_remote_write.RemoteWriter(settings["url"], collect_push_series,
+                                                      interval=int(settings.get("interval", 300)), wal=wal,
+                                                      headers=settings.get("headers"))
+    remote_writer.start()
+    application_logger.info('Remote Write Started: {}'.format(settings["url"]))
+
+app.add_event_handler("startup", start_remote_write)
+
+def release_unowned_sessions(old_snapshot=None, new_snapshot=None):
+    """
+    Logs out the Apex sessions and quits the Fusion browsers of targets this node no longer owns.
+
+    Runs after every sharding.yml reload, so adding a node only drops the sessions that moved to it.
+    """
+    apex_module = backend_modules.get("apex")
+    if apex_module is not None:
+        with apex_module.session_lock:
+            for session_key in list(apex_module.session_cookies):
+                if not neptune_sharding.owns("apex", session_key[0]):
+                    apex_module.session_cookies.pop(session_key, None)
+    fusion_module = backend_modules.get("fusion")
+    if fusion_module is not None:
+        # Requests add and replace browsers concurrently. close_browser_session takes the lock itself.
+        with fusion_module.browser_lock:
+            fusion_apex_ids = list(fusion_module.browser_sessions)
+        for fusion_apex_id in fusion_apex_ids:
+            if not neptune_sharding.owns("fusion", fusion_apex_id):
+                fusion_module.close_browser_session(fusion_apex_id)
+
+def start_sharding():
+    """
+    Loads sharding.yml if present and watches it for node changes.
+    """
+    sharding = neptune_sharding.current_sharding()
+    if sharding is not None:
+        application_logger.info('Sharding Enabled: {} of {}'.format(sharding.self_node, ", ".join(sharding.ring.nodes)))
+    elif neptune_sharding.sharding_invalid():
+        application_logger.error('Sharding Configuration Invalid: serving no targets until {} loads'.format(
+            neptune_sharding.configuration_store.path))
+    neptune_sharding.configuration_store.on_change(release_unowned_sessions)
+    reload_interval = configuration.get("config_reload_interval", 5)
+    if reload_interval:
+        neptune_sharding.configuration_store.watch(reload_interval)
+
+app.add_event_handler("startup", start_sharding)
+
+warmup = None
+
+def warmup_settings():
+    """
+    Returns:
+        dict: The warmup section of exporter.yml.
+    """
+    return configuration.get("warmup") or {}
+
+def warm_apex(apex_module, target, auth_module):
+    """
+    Logs into an Apex unless a pooled session cookie already exists.
+
+    Args:
+        apex_module (module): The loaded neptune_apex module.
+        target (str): The IP address of the Apex device.
+        auth_module (str): The authentication module.
+
+    Returns:
+        bool: True if the Apex has a session.
+    """
+    apex_direct = apex_module.APEX(apex_ip=target, auth_module=auth_module)
+    if apex_direct.session_cookie:
+        return True
+    return apex_direct.authentication()["authentication"] == "successful"
+
+def warm_fusion(fusion_apex_id):
+    """
+    Launches the pooled Chrome of a Fusion ID and logs into Fusion.
+
+    The Fusion backend (and Selenium) is imported by the first Fusion warm-up task, not when the warm-up is built.
+
+    Args:
+        fusion_apex_id (str): The ID of the Fusion Apex.
+    """
+    fusion_module = load_backend("fusion")
+    try:
+        fusion_module.FUSION(fusion_apex_id, 0)
+    except Exception:
+        fusion_module.close_browser_session(fusion_apex_id)
+        raise
+
+def configured_fusion_systems():
+    """
+    Lists the Fusion IDs in fusion.yml without importing the Fusion backend.
+
+    Once the backend is loaded its active snapshot is used instead of reading the file.
+
+    Returns:
+        dict: fusion_apex_id -> Credentials.
+
+    Raises:
+        neptune_config.ConfigurationError: If fusion.yml can not be read or is invalid.
+    """
+    if "fusion" in backend_modules:
+        return backend_modules["fusion"].load_configuration().fusion_systems
+    return neptune_config.ConfigStore('fusion.yml', neptune_config.compile_fusion_configuration).load().fusion_systems
+
+def build_warmup(on_progress=None):
+    """
+    Builds the warm-up of every owned Apex in apex.yml apex_targets and Fusion ID in fusion.yml.
+
+    No tasks are added when warmup.enabled is false, so the warm-up finishes immediately.
+
+    Args:
+        on_progress (callable, optional): Called with the progress after every state change.
+
+    Returns:
+        neptune_warmup.WarmUp: The warm-up, not started.
+    """
+    settings = warmup_settings()
+    warmup_tasks = neptune_warmup.WarmUp({"apex": settings.get("apex_concurrency", 8),
+                                          "fusion": settings.get("fusion_concurrency", 2)}, on_progress)
+    if not settings.get("enabled", True):
+        return warmup_tasks
+    if backend_enabled("apex"):
+        try:
+            apex_module = load_backend("apex")
+        except HTTPException:
+            apex_module = None
+        if apex_module is not None:
+            for target, auth_module in apex_module.load_configuration().apex_targets:
+                if neptune_sharding.owns("apex", target):
+                    warmup_tasks.add("apex", target, functools.partial(warm_apex, apex_module, target, auth_module))
+    if backend_enabled("fusion"):
+        try:
+            fusion_systems = configured_fusion_systems()
+        except neptune_config.ConfigurationError as e:
+            application_logger.error('Fusion Warm-Up Skipped: {}'.format(e))
+            fusion_systems = {}
+        for fusion_apex_id in fusion_systems:
+            if neptune_sharding.owns("fusion", fusion_apex_id):
+                warmup_tasks.add("fusion", fusion_apex_id, functools.partial(warm_fusion, fusion_apex_id))
+    return warmup_tasks
+
+def start_warmup():
+    """
+    Starts the warm-up in the background. Multi-worker workers leave it to the collector process.
+    """
+    global warmup
+    if serving_from_snapshots():
+        return
+    warmup = build_warmup()
+    warmup.start()
+
+app.add_event_handler("startup", start_warmup)
+
+@app.get("/ready", tags=["Health"])
+async def readiness():
+    """
+    Readiness check for load balancers and Prometheus.
+
+    Returns 503 until the startup warm-up has logged into every configured target,
+    with per-target progress in the body. Targets that failed to log in do not block readiness.
+
+    Returns:
+        JSONResponse: The warm-up progress.
+    """
+    if serving_from_snapshots():
+        progress = snapshot_store.read_status("warmup")
+    else:
+        progress = warmup.progress() if warmup is not None else None
+    if progress is None:
+        progress = {"ready": False, "targets": []}
+    return JSONResponse(progress, status_code=200 if progress["ready"] else 503)
+
+@app.get("/sd/apex", tags=["Service Discovery"])
+async def apex_service_discovery():
+    """
+    Prometheus http_sd targets for every Apex in apex.yml apex_targets.
+
+    Each target group points at the exporter node that owns the Apex and carries the
+    target and auth_module scrape parameters, so every node returns the same list.
+
+    Returns:
+        list: http_sd target groups.
+    """
+    require_valid_sharding()
+    target_groups = []
+    for target, auth_module in load_backend("apex").load_configuration().apex_targets:
+        target_groups.append({
+            "targets": [neptune_sharding.owner("apex", target)],
+            "labels": {"__param_target": target, "__param_auth_module": auth_module, "instance": target}
+        })
+    return target_groups
+
+@app.get("/sd/fusion", tags=["Service Discovery"])
+async def fusion_service_discovery(data_max_age: int = 300):
+    """
+    Prometheus http_sd targets for every Fusion ID in fusion.yml.
+
+    Args:
+        data_max_age (int): The data_max_age scrape parameter. Should match the scrape_interval.
+
+    Returns:
+        list: http_sd target groups.
+    """
+    require_valid_sharding()
+    target_groups = []
+    for fusion_apex_id in load_backend("fusion").load_configuration().fusion_systems:
+        target_groups.append({
+            "targets": [neptune_sharding.owner("fusion", fusion_apex_id)],
+            "labels": {"__param_fusion_apex_id": fusion_apex_id, "__param_data_max_age": str(data_max_age),
+                       "instance": fusion_apex_id}
+        })
+    return target_groups
+
+def collect_snapshots():
+    """
+    Renders every owned Apex in apex.yml apex_targets and Fusion ID in fusion.yml into the snapshot store.
+
+    Each target is fetched once and rendered in both exposition formats. A failing target is
+    logged and skipped, and its previous snapshot ages out.
+    """
+    exposition_formats = (prometheus_metrics.TEXT_FORMAT, prometheus_metrics.OPENMETRICS_FORMAT)
+    apex_module, apex_targets = collection_targets("apex", "Snapshot")
+    for target, auth_module in apex_targets:
+        if not neptune_sharding.owns("apex", target):
+            continue
+        try:
+            apex_direct = apex_module.APEX(apex_ip=target, auth_module=auth_module)
+            apex_status = apex_direct.status()
+            for exposition_format in exposition_formats:
+                metrics_body, metrics_etag = apex_direct.prometheus_exposition(exposition_format, apex_status)
+                snapshot_store.write("apex", target, exposition_format, metrics_body, metrics_etag)
+        except Exception as e:
+            application_logger.error('Snapshot Apex Collection Failed: {} {}'.format(target, e))
+    fusion_module, fusion_systems = collection_targets("fusion", "Snapshot")
+    for fusion_apex_id in fusion_systems:
+        if not neptune_sharding.owns("fusion", fusion_apex_id):
+            continue
+        try:
+            apex_fusion = fusion_module.FUSION(fusion_apex_id, server_settings().get("fusion_data_max_age", 300))
+            metric_samples = apex_fusion.metric_samples()
+            for exposition_format in exposition_formats:
+                metrics_body, metrics_etag = apex_fusion.prometheus_exposition(exposition_format, metric_samples)
+                snapshot_store.write("fusion", fusion_apex_id, exposition_format, metrics_body, metrics_etag)
+        except Exception as e:
+            fusion_module.close_browser_session(fusion_apex_id)
+            application_logger.error('Snapshot Fusion Collection Failed: {} {}'.format(fusion_apex_id, e))
+    snapshot_store.write("exporter", "collector", prometheus_metrics.TEXT_FORMAT,
+                         exporter_exposition().encode(), "")
+
+def run_snapshot_collector():
+    """
+    Entry point of the multi-worker collector process.
+
+    Owns every Apex session and Fusion browser, runs remote write if enabled, and
+    refreshes the snapshot store every server.collect_interval seconds.
+    """
+    global snapshot_collector_process
+    snapshot_collector_process = True
+    start_sharding()
+    start_remote_write()
+    application_logger.info('Snapshot Collector Started: {}'.format(snapshot_store.directory))
+    # Workers report this warm-up on /ready.
+    build_warmup(lambda progress: snapshot_store.write_status("warmup", progress)).run()
+    neptune_snapshots.SnapshotCollector(collect_snapshots, int(server_settings().get("collect_interval", 60))).run()
 
-    # Remove Workspace Lock and Provide Download
-    os.remove(workspace_directory + "/WORKSPACE_LOCKED")
-    return FileResponse(os.path.join(workspace_directory, f"{file_name}.zip"), media_type='application/octet-stream', filename=f"{file_name}.zip")
+def supervise_snapshot_collector(target=run_snapshot_collector, restarts=None):
+    """
+    Runs the multi-worker collector process and starts a new one whenever it exits.
+
+    Without a collector the snapshots go stale and every worker answers 503. Restarts back off
+    from 5 to 60 seconds while the collector keeps exiting within a minute of starting.
+
+    Args:
+        target (callable, optional): The collector entry point. Defaults to run_snapshot_collector.
+        restarts (int, optional): Stop after this many restarts. None restarts forever.
+    """
+    restart_delay = 5
+    restart_count = 0
+    while True:
+        started = time.monotonic()
+        collector = multiprocessing.Process(target=target, name="snapshot-collector", daemon=True)
+        collector.start()
+        collector.join()
+        if restarts is not None and restart_count >= restarts:
+            return
+        restart_count += 1
+        if time.monotonic() - started > 60:
+            restart_delay = 5
+        application_logger.error('Snapshot Collector Exited: exit code {}. Restarting in {}s'.format(
+            collector.exitcode, restart_delay))
+        time.sleep(restart_delay)
+        restart_delay = min(restart_delay * 2, 60)
+
+# One profile window at a time, per worker process.
+profile_lock = threading.Lock()
+
+def check_profile_token(request):
+    """
+    Allows /debug/profile only when enabled in exporter.yml and the request carries its token.
+
+    Args:
+        request (Request): The incoming request.
+
+    Raises:
+        HTTPException: 404 if profiling is disabled or has no token, 401 if the token does not match.
+    """
+    settings = configuration.get("debug_profiling") or {}
+    token = str(settings.get("token") or "")
+    if not settings.get("enabled", False) or not token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest(request.headers.get("authorization", ""), "Bearer {}".format(token)):
+        raise HTTPException(status_code=401, detail="A valid Authorization: Bearer token is required.")
+
+def profile_window(seconds):
+    """
+    Clamps a requested profile window to debug_profiling.max_seconds.
+
+    Args:
+        seconds (float): The requested window.
+
+    Returns:
+        float: The window in seconds.
+    """
+    max_seconds = float((configuration.get("debug_profiling") or {}).get("max_seconds", 300))
+    return min(max(float(seconds), 1.0), max_seconds)
+
+def profiled_code():
+    """
+    Returns:
+        set: Code objects of the /metrics and /export route handlers.
+    """
+    return {route.endpoint.__code__ for route in app.routes
+            if getattr(route, "path", "").startswith(("/metrics/", "/export/"))}
+
+@app.get("/debug/profile/cpu", response_class=PlainTextResponse, tags=["Debug"])
+async def debug_profile_cpu(request: Request, seconds: float = 30, interval_ms: float = 5, all_threads: bool = False):
+    """
+    Sample the CPU stacks of /metrics and /export requests served during a window.
+
+    Requires debug_profiling.enabled and "Authorization: Bearer <debug_profiling.token>".
+    Send scrapes while the window is open. Not available in multi-worker mode, where the
+    workers only serve snapshots and the collector process does the work.
+
+    Args:
+        seconds (float): Length of the window.
+        interval_ms (float): Milliseconds between samples.
+        all_threads (bool): Keep every sampled stack, not only the /metrics and /export handlers.
+
+    Returns:
+        PlainTextResponse: Collapsed stacks for flamegraph.pl, speedscope or inferno.
+    """
+    check_profile_token(request)
+    require_upstream_access()
+    if not profile_lock.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="A profile is already running.")
+    try:
+        window = profile_window(seconds)
+        profiler = neptune_profiling.SamplingProfiler(max(interval_ms, 1) / 1000, None if all_threads else profiled_code())
+        profiler.start()
+        try:
+            await asyncio.sleep(window)
+        finally:
+            profiler.stop()
+    finally:
+        profile_lock.release()
+    application_logger.info('CPU Profile Taken: {}s, {} samples, {} stacks'.format(window, profiler.samples, len(profiler.stacks)))
+    return PlainTextResponse(profiler.collapsed(), headers={
+        "Content-Disposition": 'attachment; filename="{}"'.format(neptune_profiling.profile_filename("cpu")),
+        "X-Profile-Samples": str(profiler.samples)})
+
+@app.get("/debug/profile/memory", response_class=PlainTextResponse, tags=["Debug"])
+async def debug_profile_memory(request: Request, seconds: float = 30, top: int = 25):
+    """
+    Trace memory allocations with tracemalloc during a window and report the largest sites.
+
+    Requires debug_profiling.enabled and "Authorization: Bearer <debug_profiling.token>".
+    Requests run slower while the window is open.
+
+    Args:
+        seconds (float): Length of the window.
+        top (int): Allocation sites listed.
+
+    Returns:
+        PlainTextResponse: The top allocations report.
+    """
+    check_profile_token(request)
+    require_upstream_access()
+    if neptune_profiling.memory_tracing() or not profile_lock.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="A profile is already running.")
+    try:
+        window = profile_window(seconds)
+        neptune_profiling.start_memory_trace()
+        try:
+            await asyncio.sleep(window)
+        finally:
+            report = neptune_profiling.stop_memory_trace(top, window)
+    finally:
+        profile_lock.release()
+    application_logger.info('Memory Profile Taken: {}s'.format(window))
+    return PlainTextResponse(report, headers={
+        "Content-Disposition": 'attachment; filename="{}"'.format(neptune_profiling.profile_filename("memory"))})
 
 @app.get("/", include_in_schema=False)
 async def documentation_home_page():
@@ -326,4 +1336,7 @@ async def documentation_home_page():
 if __name__ == "__main__":
     server_hostname = socket.gethostname()
     app_name = Path(__file__).stem
-    uvicorn.run("{}:app".format(app_name), host=server_hostname, port=5006, log_level="info")
+    server_workers = int(server_settings().get("workers", 1))
+    if server_workers > 1:
+        threading.Thread(target=supervise_snapshot_collector, name="snapshot-collector-supervisor", daemon=True).start()
+    uvicorn.run("{}:app".format(app_name), host=server_hostname, port=5006, log_level="info", workers=server_workers)
@@ -0,0 +1,288 @@
+"""
+Neptune Apex Admission Control Module.
+
+The Apex web server stops answering when too many requests reach it at once. Every
+APEX upstream call passes through a per-Apex gate: a token bucket limits the request
+rate, a concurrency limit caps requests in flight, and waiting requests are admitted
+by priority class so metrics scrapes go ahead of history syncs and bulk exports.
+Requests that would wait too long, or that do not fit in the queue, are shed.
+
+Gates live in process memory, so the limits apply per exporter process. In multi-worker
+mode only the collector process sends requests to the Apex and the workers never admit any.
+"""
+import contextlib
+import heapq
+import itertools
+import threading
+import time
+
+# Highest priority first.
+PRIORITY_CLASSES = ("metrics", "sync", "export")
+
+WAIT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+DEFAULT_SETTINGS = {
+    "enabled": True,
+    "rate": 2.0,
+    "burst": 5,
+    "concurrency": 2,
+    "max_queue": 20,
+    "max_wait": {"metrics": 10, "sync": 60, "export": 120}
+}
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised when a request to an Apex is shed instead of being sent.
+    """
+    def __init__(self, target, priority, reason):
+        """
+        Args:
+            target (str): The Apex IP address.
+            priority (str): The request's priority class.
+            reason (str): "queue_full", "timeout" or "preempted".
+        """
+        super().__init__("Apex {} is busy: {} request rejected ({})".format(target, priority, reason))
+        self.target = target
+        self.priority = priority
+        self.reason = reason
+
+
+class TargetGate:
+    """
+    Token bucket, concurrency limit and priority queue of one Apex.
+    """
+    def __init__(self, target, rate, burst, concurrency, max_queue, max_wait):
+        """
+        Args:
+            target (str): The Apex IP address.
+            rate (float): Requests per second the bucket refills. 0 disables the rate limit.
+            burst (int): Bucket size.
+            concurrency (int): Requests in flight at once.
+            max_queue (int): Requests allowed to wait. Lower classes are shed first when it is full.
+            max_wait (dict): priority class -> seconds a request may wait before it is shed.
+        """
+        self.target = target
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+        self.concurrency = max(1, int(concurrency))
+        self.max_queue = max(0, int(max_queue))
+        self.max_wait = max_wait
+        self.condition = threading.Condition()
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.in_flight = 0
+        # Entries are [class rank, arrival sequence, rejection reason], so the heap head is the
+        # oldest request of the highest waiting class.
+        self.waiting = []
+        self.sequence = itertools.count()
+        self.admitted = {priority: 0 for priority in PRIORITY_CLASSES}
+        self.rejected = {}
+        self.wait_counts = {priority: [0] * len(WAIT_BUCKETS) for priority in PRIORITY_CLASSES}
+        self.wait_sums = {priority: 0.0 for priority in PRIORITY_CLASSES}
+
+    def refill(self, now):
+        if self.rate > 0:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def has_token(self):
+        return self.rate <= 0 or self.tokens >= 1
+
+    def remove_waiting(self, entry):
+        self.waiting.remove(entry)
+        heapq.heapify(self.waiting)
+
+    def reject(self, priority, reason):
+        self.rejected[(priority, reason)] = self.rejected.get((priority, reason), 0) + 1
+        return AdmissionRejected(self.target, priority, reason)
+
+    def acquire(self, priority):
+        """
+        Waits until the request may be sent.
+
+        Args:
+            priority (str): One of PRIORITY_CLASSES.
+
+        Raises:
+            AdmissionRejected: If the request was shed.
+        """
+        rank = PRIORITY_CLASSES.index(priority)
+        started = time.monotonic()
+        deadline = started + float(self.max_wait.get(priority, DEFAULT_SETTINGS["max_wait"][priority]))
+        with self.condition:
+            self.refill(started)
+            immediate = not self.waiting and self.in_flight < self.concurrency and self.has_token()
+            if not immediate and len(self.waiting) >= self.max_queue:
+                lowest = max(self.waiting) if self.waiting else None
+                if lowest is None or lowest[0] <= rank:
+                    raise self.reject(priority, "queue_full")
+                # Make room by shedding the newest request of the lowest waiting class.
+                lowest[2] = "preempted"
+                self.remove_waiting(lowest)
+                self.condition.notify_all()
+            entry = [rank, next(self.sequence), None]
+            heapq.heappush(self.waiting, entry)
+            while True:
+                if entry[2] is not None:
+                    raise self.reject(priority, entry[2])
+                now = time.monotonic()
+                self.refill(now)
+                if self.waiting[0] is entry and self.in_flight < self.concurrency and self.has_token():
+                    heapq.heappop(self.waiting)
+                    if self.rate > 0:
+                        self.tokens -= 1
+                    self.in_flight += 1
+                    break
+                remaining = deadline - now
+                if remaining <= 0:
+                    self.remove_waiting(entry)
+                    self.condition.notify_all()
+                    raise self.reject(priority, "timeout")
+                if not self.has_token():
+                    remaining = min(remaining, (1 - self.tokens) / self.rate)
+                self.condition.wait(remaining)
+            waited = time.monotonic() - started
+            self.admitted[priority] += 1
+            self.wait_sums[priority] += waited
+            for index, bucket in enumerate(WAIT_BUCKETS):
+                if waited <= bucket:
+                    self.wait_counts[priority][index] += 1
+            # The next waiter may be admittable right away.
+            self.condition.notify_all()
+
+    def release(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    @contextlib.contextmanager
+    def admit(self, priority):
+        self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class AdmissionController:
+    """
+    The per-Apex gates, created on first use from the apex_admission section of exporter.yml.
+    """
+    def __init__(self, settings=None):
+        """
+        Args:
+            settings (dict, optional): Overrides of DEFAULT_SETTINGS.
+        """
+        self.gates = {}
+        self.gates_lock = threading.Lock()
+        self.configure(settings)
+
+    def configure(self, settings):
+        """
+        Applies new settings. Gates are rebuilt on their next use.
+
+        Args:
+            settings (dict): Overrides of DEFAULT_SETTINGS.
+        """
+        merged = dict(DEFAULT_SETTINGS)
+        merged.update({key: value for key, value in (settings or {}).items() if value is not None})
+        merged["max_wait"] = dict(DEFAULT_SETTINGS["max_wait"], **(merged.get("max_wait") or {}))
+        with self.gates_lock:
+            self.settings = merged
+            self.gates = {}
+
+    def gate(self, target):
+        """
+        Args:
+            target (str): The Apex IP address.
+
+        Returns:
+            TargetGate: The Apex's gate.
+        """
+        with self.gates_lock:
+            gate = self.gates.get(target)
+            if gate is None:
+                gate = TargetGate(target, self.settings["rate"], self.settings["burst"], self.settings["concurrency"],
+                                  self.settings["max_queue"], self.settings["max_wait"])
+                self.gates[target] = gate
+            return gate
+
+    def max_wait(self, priority):
+        """
+        Args:
+            priority (str): One of PRIORITY_CLASSES.
+
+        Returns:
+            float or None: Seconds a request of the class may wait for admission. None when admission control is disabled.
+        """
+        if not self.settings["enabled"]:
+            return None
+        return float(self.settings["max_wait"].get(priority, DEFAULT_SETTINGS["max_wait"][priority]))
+
+    def admit(self, target, priority):
+        """
+        Context manager around one upstream request.
+
+        Args:
+            target (str): The Apex IP address.
+            priority (str): One of PRIORITY_CLASSES.
+
+        Raises:
+            AdmissionRejected: If the request was shed.
+        """
+        if not self.settings["enabled"]:
+            return contextlib.nullcontext()
+        return self.gate(target).admit(priority)
+
+    def exposition(self):
+        """
+        Renders the queue-wait histograms, admission / rejection counters, queue gauges and this process's limits.
+
+        Returns:
+            str: Prometheus text exposition.
+        """
+        with self.gates_lock:
+            gates = sorted(self.gates.items())
+        lines = ["# HELP neptune_exporter_apex_admission_wait_seconds Time Apex requests waited for admission.",
+                 "# TYPE neptune_exporter_apex_admission_wait_seconds histogram"]
+        for target, gate in gates:
+            with gate.condition:
+                for priority in PRIORITY_CLASSES:
+                    labels = 'target="{}",class="{}"'.format(target, priority)
+                    for bucket, count in zip(WAIT_BUCKETS, gate.wait_counts[priority]):
+                        lines.append('neptune_exporter_apex_admission_wait_seconds_bucket{{{},le="{}"}} {}'.format(
+                            labels, bucket, count))
+                    lines.append('neptune_exporter_apex_admission_wait_seconds_bucket{{{},le="+Inf"}} {}'.format(
+                        labels, gate.admitted[priority]))
+                    lines.append('neptune_exporter_apex_admission_wait_seconds_sum{{{}}} {}'.format(
+                        labels, round(gate.wait_sums[priority], 6)))
+                    lines.append('neptune_exporter_apex_admission_wait_seconds_count{{{}}} {}'.format(
+                        labels, gate.admitted[priority]))
+        lines += ["# HELP neptune_exporter_apex_admission_rejected_total Apex requests shed by admission control.",
+                  "# TYPE neptune_exporter_apex_admission_rejected_total counter"]
+        for target, gate in gates:
+            with gate.condition:
+                for (priority, reason), count in sorted(gate.rejected.items()):
+                    lines.append('neptune_exporter_apex_admission_rejected_total{{target="{}",class="{}",reason="{}"}} {}'.format(
+                        target, priority, reason, count))
+        for metric_name, metric_help, value_function in (
+                ("neptune_exporter_apex_admission_in_flight", "Apex requests in flight.", lambda gate: gate.in_flight),
+                ("neptune_exporter_apex_admission_queued", "Apex requests waiting for admission.", lambda gate: len(gate.waiting))):
+            lines += ["# HELP {} {}".format(metric_name, metric_help), "# TYPE {} gauge".format(metric_name)]
+            for target, gate in gates:
+                lines.append('{}{{target="{}"}} {}'.format(metric_name, target, value_function(gate)))
+        lines += ["# HELP neptune_exporter_apex_admission_limit Admission limits per Apex, enforced by this process alone.",
+                  "# TYPE neptune_exporter_apex_admission_limit gauge"]
+        if self.settings["enabled"]:
+            for setting in ("rate", "burst", "concurrency", "max_queue"):
+                lines.append('neptune_exporter_apex_admission_limit{{setting="{}"}} {}'.format(
+                    setting, float(self.settings[setting])))
+        return "\n".join(lines) + "\n"
+
+
+admission_controller = AdmissionController()
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,251 @@
+"""
+Neptune Apex Rolling Aggregates Module.
+
+/rest/status only carries the instantaneous value of every probe. The internal log (ilog)
+has every reading of the day, so this module keeps the recent readings of every Apex
+input in fixed-size ring buffers of doubles and reports min / max / mean / stddev over
+the configured windows (1h and 24h by default) next to the /metrics/apex samples.
+
+The ilog is loaded once with enough days to cover the longest window, then refreshed
+with days=1 at most every refresh_interval seconds. Only records newer than the last
+one merged are appended. Windows end at the newest ilog record, so the Apex clock and
+timezone do not shift them.
+"""
+import array
+import bisect
+import logging
+import math
+import operator
+import threading
+import time
+
+application_logger = logging.getLogger('neptune_exporter')
+
+DEFAULT_SETTINGS = {
+    "enabled": True,
+    "refresh_interval": 300,
+    "windows": {"1h": 3600, "24h": 86400}
+}
+
+# Shortest ilog interval an Apex can be set to. Sizes the ring buffers of the longest window.
+MIN_LOG_INTERVAL = 60
+
+AGGREGATE_FAMILIES = ("min", "max", "mean", "stddev")
+
+
+class RingBuffer:
+    """
+    The last capacity (timestamp, value) readings of one input, in two arrays of doubles.
+    """
+    def __init__(self, capacity):
+        """
+        Args:
+            capacity (int): Readings kept. The oldest is overwritten once full.
+        """
+        self.capacity = max(1, int(capacity))
+        self.timestamps = array.array('d', bytes(8 * self.capacity))
+        self.values = array.array('d', bytes(8 * self.capacity))
+        self.head = 0
+        self.count = 0
+
+    def append(self, timestamp, value):
+        self.timestamps[self.head] = timestamp
+        self.values[self.head] = value
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def ordered(self):
+        """
+        Returns:
+            tuple: (timestamps, values) arrays, oldest first.
+        """
+        if self.count < self.capacity:
+            return self.timestamps[:self.count], self.values[:self.count]
+        return (self.timestamps[self.head:] + self.timestamps[:self.head],
+                self.values[self.head:] + self.values[:self.head])
+
+
+def window_statistics(timestamps, values, window_end, windows):
+    """
+    Computes the aggregates of every window from one ordered copy of a buffer.
+
+    The reductions run over array slices with the min / max / math.fsum builtins. The
+    variance takes a second pass over the window's deviations from the mean.
+
+    Args:
+        timestamps (array.array): Reading timestamps, oldest first.
+        values (array.array): Reading values, in the same order.
+        window_end (float): Epoch seconds the windows end at.
+        windows (dict): window label -> seconds.
+
+    Returns:
+        dict: window label -> (count, min, max, mean, stddev). Empty windows are left out.
+    """
+    statistics = {}
+    for window_label, window_seconds in windows.items():
+        start = bisect.bisect_right(timestamps, window_end - float(window_seconds))
+        window = values[start:]
+        count = len(window)
+        if count == 0:
+            continue
+        mean = math.fsum(window) / count
+        # Two passes: subtracting the mean first keeps the precision that E[x²] - mean² loses on
+        # large, nearly constant readings such as ORP.
+        deviations = [value - mean for value in window]
+        variance = math.fsum(map(operator.mul, deviations, deviations)) / count
+        statistics[window_label] = (count, min(window), max(window), mean, math.sqrt(variance))
+    return statistics
+
+
+class InputAggregates:
+    """
+    Ring buffers of one Apex, keyed by input did.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        # did -> (input labels, RingBuffer)
+        self.inputs = {}
+        self.last_record = None
+        self.covered_days = 0
+        self.refreshed = None
+
+    def merge(self, ilog_payload, capacity):
+        """
+        Appends the ilog records newer than the last record merged.
+
+        Args:
+            ilog_payload (dict): The response of APEX.internal_log().
+            capacity (int): Size of new ring buffers.
+
+        Returns:
+            int: The number of records appended.
+        """
+        ilog = ilog_payload.get("ilog", ilog_payload)
+        base_label_values = [
+            'apex_serial="{}"'.format(ilog.get("serial", "")),
+            'apex_hostname="{}"'.format(ilog.get("hostname", ""))
+        ]
+        appended = 0
+        for record in ilog.get("record", []):
+            record_timestamp = float(record["date"])
+            if self.last_record is not None and record_timestamp <= self.last_record:
+                continue
+            for apex_input in record.get("data", []):
+                try:
+                    input_value = float(apex_input["value"])
+                except (TypeError, ValueError):
+                    continue
+                entry = self.inputs.get(apex_input["did"])
+                if entry is None:
+                    input_labels = base_label_values + [
+                        'input_did="{}"'.format(apex_input["did"]),
+                        'input_type="{}"'.format(apex_input["type"]),
+                        'input_name="{}"'.format(apex_input["name"])
+                    ]
+                    entry = self.inputs[apex_input["did"]] = (input_labels, RingBuffer(capacity))
+                entry[1].append(record_timestamp, input_value)
+            self.last_record = record_timestamp
+            appended += 1
+        return appended
+
+    def samples(self, windows):
+        """
+        Builds the aggregate samples, grouped by family. Inputs with no reading in any window are dropped.
+
+        Args:
+            windows (dict): window label -> seconds.
+
+        Returns:
+            list: (metric_name, metric_labels, metric_value) tuples.
+        """
+        if self.last_record is None:
+            return []
+        families = {aggregate: [] for aggregate in ("samples",) + AGGREGATE_FAMILIES}
+        for did in sorted(self.inputs):
+            input_labels, ring_buffer = self.inputs[did]
+            statistics = window_statistics(*ring_buffer.ordered(), self.last_record, windows)
+            if not statistics:
+                del self.inputs[did]
+                continue
+            for window_label, window_values in statistics.items():
+                labels = input_labels + ['window="{}"'.format(window_label)]
+                for aggregate, value in zip(("samples",) + AGGREGATE_FAMILIES, window_values):
+                    families[aggregate].append(("input_window_{}".format(aggregate), labels, round(value, 6)))
+        return [sample for family_samples in families.values() for sample in family_samples]
+
+
+class AggregateStore:
+    """
+    The ring buffers of every Apex, configured from the rolling_aggregates section of exporter.yml.
+    """
+    def __init__(self, settings=None):
+        """
+        Args:
+            settings (dict, optional): Overrides of DEFAULT_SETTINGS.
+        """
+        self.apex_systems = {}
+        self.apex_systems_lock = threading.Lock()
+        self.configure(settings)
+
+    def configure(self, settings):
+        """
+        Applies new settings and drops every buffer.
+
+        Args:
+            settings (dict): Overrides of DEFAULT_SETTINGS.
+        """
+        merged = dict(DEFAULT_SETTINGS)
+        merged.update({key: value for key, value in (settings or {}).items() if value is not None})
+        with self.apex_systems_lock:
+            self.settings = merged
+            self.windows = {str(label): float(seconds) for label, seconds in (merged["windows"] or {}).items()}
+            longest_window = max(self.windows.values()) if self.windows else 0
+            self.capacity = int(longest_window // MIN_LOG_INTERVAL) + 1
+            self.cold_start_days = max(1, int(math.ceil(longest_window / 86400)))
+            self.apex_systems = {}
+
+    def aggregates(self, apex_ip):
+        with self.apex_systems_lock:
+            apex_aggregates = self.apex_systems.get(apex_ip)
+            if apex_aggregates is None:
+                apex_aggregates = self.apex_systems[apex_ip] = InputAggregates()
+            return apex_aggregates
+
+    def samples(self, apex_ip, fetch_function):
+        """
+        Returns the rolling aggregates of an Apex, refreshing its buffers from the ilog when due.
+
+        A failed refresh is logged and the aggregates of the readings already merged are returned.
+
+        Args:
+            apex_ip (str): The IP address of the Apex.
+            fetch_function (callable): Takes the ilog days parameter and returns the ilog payload.
+
+        Returns:
+            list: (metric_name, metric_labels, metric_value) tuples, grouped by family.
+        """
+        if not self.settings["enabled"] or not self.windows:
+            return []
+        apex_aggregates = self.aggregates(apex_ip)
+        with apex_aggregates.lock:
+            now = time.monotonic()
+            if apex_aggregates.refreshed is None or now - apex_aggregates.refreshed >= float(self.settings["refresh_interval"]):
+                # Failed refreshes are retried on the same interval, so a slow Apex is not asked on every scrape.
+                apex_aggregates.refreshed = now
+                days = self.cold_start_days if apex_aggregates.covered_days < self.cold_start_days else 1
+                try:
+                    ilog_payload = fetch_function(days)
+                except Exception as e:
+                    ilog_payload = None
+                    application_logger.error('Rolling Aggregates ilog Refresh Failed: {} {}'.format(apex_ip, e))
+                if ilog_payload is not None:
+                    apex_aggregates.merge(ilog_payload, self.capacity)
+                    apex_aggregates.covered_days = max(apex_aggregates.covered_days, days)
+            return apex_aggregates.samples(self.windows)
+
+
+aggregate_store = AggregateStore()
+
+
+if __name__ == "__main__":
+    pass
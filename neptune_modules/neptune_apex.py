@@ -1,15 +1,19 @@
 """
 Neptune Apex API Module.
 """
-import json
 import time
 import math
 import os
 import logging.config
+import threading
 import requests
-import yaml
 import logging
-import os
+from neptune_modules import neptune_admission
+from neptune_modules import neptune_aggregates
+from neptune_modules import neptune_cache
+from neptune_modules import neptune_config
+from neptune_modules import neptune_json
+from neptune_modules import prometheus_metrics
 
 def setup_logger(name, log_file, level=logging.INFO):
     """
@@ -34,21 +38,54 @@ def setup_logger(name, log_file, level=logging.INFO):
 log_file = os.path.join(os.path.dirname(__file__), '..', 'logs', 'apex.log')
 application_logger = setup_logger('neptune_apex', log_file)
 
-try:
-    loaded_cfg_file = os.path.join(os.path.dirname(__file__), '..', 'configuration', 'apex.yml')
-    with open(loaded_cfg_file, 'r') as config_file:
-        configuration = yaml.load(config_file, Loader=yaml.Loader)
-except Exception as e:
-    application_logger.error('Configuration File Load Failed: {}'.format(e))
-    exit()
+configuration_store = neptune_config.ConfigStore('apex.yml', neptune_config.compile_apex_configuration)
+
+# (apex_ip, auth_module) -> (Credentials, session cookie). Reused across requests until
+# the Apex rejects the cookie or the auth module's credentials change in apex.yml.
+session_cookies = {}
+session_lock = threading.Lock()
+
+def load_configuration():
+    """
+    Returns the active apex.yml snapshot, loading the file on first use.
+
+    Returns:
+        neptune_config.ConfigSnapshot: The Apex configuration.
+
+    Raises:
+        neptune_config.ConfigurationError: If the configuration file can not be read or is invalid.
+    """
+    return configuration_store.snapshot()
+
+def invalidate_sessions(old_snapshot, new_snapshot):
+    """
+    Drops cached session cookies of auth modules whose credentials changed in apex.yml.
+
+    Args:
+        old_snapshot (neptune_config.ConfigSnapshot): The previous configuration.
+        new_snapshot (neptune_config.ConfigSnapshot): The reloaded configuration.
+    """
+    changed_auth_modules = neptune_config.changed_credentials(old_snapshot.apex_auths, new_snapshot.apex_auths)
+    with session_lock:
+        for session_key in [key for key in session_cookies if key[1] in changed_auth_modules]:
+            del session_cookies[session_key]
+    if changed_auth_modules:
+        application_logger.info('Apex Sessions Invalidated: {}'.format(", ".join(sorted(changed_auth_modules))))
+
+configuration_store.on_change(invalidate_sessions)
+
+# Rendered /metrics/apex output per Apex, keyed by the status payload fingerprint.
+exposition_cache = prometheus_metrics.ExpositionCache()
 
 class APEX:
-    def __init__(self, apex_ip, auth_module, apex_debug=False):
+    def __init__(self, apex_ip, auth_module, apex_debug=False, priority=None):
         """
         Initializes the APEX class.
         Parameters:
             - apex_ip (str): The IP address of the APEX device.
             - auth_module (str): The authentication module to use for APEX.
+            - priority (str, optional): Admission class of this client's requests ("metrics", "sync" or "export").
+              Defaults to "export" in debug mode, otherwise "metrics".
 
             Attributes:
             - epoch_current (int): The current epoch time.
@@ -67,10 +104,17 @@ class APEX:
         self.epoch_past = math.ceil(time.time()) - (60 * 5)
         self.apex_ip = apex_ip
         self.auth_module = auth_module
-        self.apex_user = str(configuration["apex_auths"][auth_module]["username"])
-        self.apex_password = str(configuration["apex_auths"][auth_module]["password"])
-        self.session_cookie = ""
+        self.credentials = load_configuration().apex_auths[auth_module]
+        self.apex_user = self.credentials.username
+        self.apex_password = self.credentials.password
+        with session_lock:
+            cached_session = session_cookies.get((apex_ip, auth_module))
+        if cached_session is not None and cached_session[0] == self.credentials:
+            self.session_cookie = cached_session[1]
+        else:
+            self.session_cookie = ""
         self.apex_debug = apex_debug
+        self.priority = priority or ("export" if apex_debug else "metrics")
 
 
     def authentication(self):
@@ -82,7 +126,7 @@ class APEX:
                 - "authentication": The authentication result, which can be "successful", "unsuccessful", or "error".
         """
         url = "http://{}/rest/login".format(self.apex_ip)
-        payload = json.dumps({
+        payload = neptune_json.dumps({
             "login": self.apex_user,
             "password": self.apex_password,
             "remember_me": False
@@ -91,19 +135,90 @@ class APEX:
             'Content-Type': 'application/json'
         }
         try:
-            response = requests.post(url, headers=headers, data=payload, timeout=15)
-            response_dict = response.json()
+            with neptune_admission.admission_controller.admit(self.apex_ip, self.priority):
+                response = requests.post(url, headers=headers, data=payload, timeout=15)
+            response_dict = neptune_json.loads(response.content)
             if response.status_code == 200:
                 self.session_cookie = response_dict['connect.sid']
+                with session_lock:
+                    session_cookies[(self.apex_ip, self.auth_module)] = (self.credentials, self.session_cookie)
                 return {"authentication": "successful"}
             else:
+                with session_lock:
+                    session_cookies.pop((self.apex_ip, self.auth_module), None)
                 application_logger.error('Apex Authentication Unsuccessful: {}'.format(self.apex_ip))
                 application_logger.error('url_response: {}'.format(response))
                 return {"authentication": "unsuccessful"}
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, ValueError) as e:
             application_logger.error('Apex Authentication Error: {}'.format(e))
             return {"authentication": "error"}
 
+    def rest_get(self, url, error_label, endpoint=None, window=None):
+        """
+        Gets Neptune Apex REST data through the shared payload cache.
+
+        Args:
+            url (str): The REST URL.
+            error_label (str): Prefix for error log messages. Ex: "Apex Status".
+            endpoint (str, optional): Cache endpoint name. Ex: "status". None bypasses the cache.
+            window (str or int, optional): The query window the URL asks for. Ex: 365 (days).
+
+        Returns:
+            dict or None: The response data if the request is successful, otherwise None.
+        """
+        if endpoint is None:
+            return self.rest_fetch(url, error_label)[0]
+        # A scrape waits for a concurrent fetch of the same payload no longer than it would wait for admission.
+        return neptune_cache.payload_cache.fetch((self.apex_ip, endpoint, window),
+                                                 lambda: self.rest_fetch(url, error_label),
+                                                 rank=neptune_admission.PRIORITY_CLASSES.index(self.priority),
+                                                 max_wait=neptune_admission.admission_controller.max_wait(self.priority))
+
+    def rest_fetch(self, url, error_label):
+        """
+        Sends an authenticated GET request to the Neptune Apex REST API.
+
+        A reused session cookie may have expired on the Apex, so a 401/403 response
+        triggers one re-authentication and retry.
+
+        Args:
+            url (str): The REST URL.
+            error_label (str): Prefix for error log messages. Ex: "Apex Status".
+
+        Returns:
+            tuple: (response data or None if the request failed, response size in bytes)
+
+        Raises:
+            neptune_admission.AdmissionRejected: If admission control shed the request.
+        """
+        if self.session_cookie == "":
+            try:
+                self.authentication()
+            except neptune_admission.AdmissionRejected:
+                raise
+            except Exception as auth_error:
+                application_logger.error('Apex Authentication Error: {}'.format(auth_error))
+        for attempt in range(2):
+            headers = {
+                'Content-Type': 'application/json',
+                'Cookie': 'connect.sid={}'.format(self.session_cookie)
+            }
+            try:
+                with neptune_admission.admission_controller.admit(self.apex_ip, self.priority):
+                    response = requests.get(url, headers=headers, data={}, timeout=15)
+                if response.status_code in (401, 403) and attempt == 0:
+                    self.authentication()
+                    continue
+                response_dict = neptune_json.loads(response.content)
+                if response.status_code == 200:
+                    return response_dict, len(response.content)
+                else:
+                    application_logger.error('{} Error: {}'.format(error_label, response_dict))
+                    return None, 0
+            except (requests.exceptions.RequestException, ValueError) as e:
+                application_logger.error('{} Error: {}'.format(error_label, e))
+                return None, 0
+
     def status(self):
         """
         Gets status data from the Neptune Apex.
@@ -115,30 +230,16 @@ class APEX:
         Raises:
             requests.exceptions.RequestException: If there is an error in making the request.
         """
-        if self.session_cookie == "":
-            self.authentication()
         url = "http://{}/rest/status".format(self.apex_ip)
-        payload = {}
-        headers = {
-            'Content-Type': 'application/json',
-            'Cookie': 'connect.sid={}'.format(self.session_cookie)
-        }
-        try:
-            response = requests.get(url, headers=headers, data=payload, timeout=15)
-            response_dict = response.json()
-            if response.status_code == 200:
-                return response_dict
-            else:
-                application_logger.error('Apex Status Error: {}'.format(response_dict))
-                return None
-        except requests.exceptions.RequestException as e:
-            application_logger.error('Apex Status Error: {}'.format(e))
-            return None
+        return self.rest_get(url, 'Apex Status', "status")
     
-    def internal_log(self):
+    def internal_log(self, days=None):
         """
         Gets log data for sensors onboard the Neptune Apex.
 
+        Args:
+            days (int, optional): Days of log data to request. Defaults to 365 in debug mode, otherwise 1.
+
         Returns:
             dict: A dictionary containing the log data.
 
@@ -146,31 +247,15 @@ class APEX:
             Exception: If there is an authentication error.
             requests.exceptions.RequestException: If there is an error making the request.
         """
-        if self.session_cookie == "":
-            try:
-                self.authentication()
-            except Exception as auth_error:
-                application_logger.error('Apex Authentication Error: {}'.format(auth_error))
-        if self.apex_debug == True:
+        if days is not None:
+            url = "http://{}/rest/ilog?days={}&sdate=0&_={}".format(self.apex_ip, int(days), self.epoch_current)
+        elif self.apex_debug == True:
+            days = 365
             url = "http://{}/rest/ilog?days=365".format(self.apex_ip)
         else:
+            days = 1
             url = "http://{}/rest/ilog?days=1&sdate=0&_={}".format(self.apex_ip, self.epoch_current)
-        payload = {}
-        headers = {
-            'Content-Type': 'application/json',
-            'Cookie': 'connect.sid={}'.format(self.session_cookie)
-        }
-        try:
-            response = requests.get(url, headers=headers, data=payload, timeout=15)
-            response_dict = response.json()
-            if response.status_code == 200:
-                return response_dict
-            else:
-                application_logger.error('Apex Internal Log Error: {}'.format(response_dict))
-                return None
-        except requests.exceptions.RequestException as e:
-            application_logger.error('Apex Internal Log Error: {}'.format(e))
-            return None
+        return self.rest_get(url, 'Apex Internal Log', "ilog", int(days))
     
     def dos_log(self):
         """
@@ -183,31 +268,13 @@ class APEX:
             Exception: If there is an authentication error during the process.
             requests.exceptions.RequestException: If there is an error while making the HTTP request.
         """
-        if self.session_cookie == "":
-            try:
-                self.authentication()
-            except Exception as auth_error:
-                application_logger.error('Apex Authentication Error: {}'.format(auth_error))
         if self.apex_debug == True:
             url = "http://{}/rest/dlog?sdate={}&".format(self.apex_ip, self.date_string)
+            window = "sdate={}".format(self.date_string)
         else:
             url = "http://{}/rest/dlog?days=1&sdate=0&_={}".format(self.apex_ip, self.epoch_current)
-        payload = {}
-        headers = {
-            'Content-Type': 'application/json',
-            'Cookie': 'connect.sid={}'.format(self.session_cookie)
-        }
-        try:
-            response = requests.get(url, headers=headers, data=payload, timeout=15)
-            response_dict = response.json()
-            if response.status_code == 200:
-                return response_dict
-            else:
-                application_logger.error('Apex DOS Log Error: {}'.format(response_dict))
-                return None
-        except requests.exceptions.RequestException as e:
-            application_logger.error('Apex DOS Log Error: {}'.format(e))
-            return None
+            window = 1
+        return self.rest_get(url, 'Apex DOS Log', "dlog", window)
     
     def trident_log(self):
         """
@@ -223,31 +290,13 @@ class APEX:
             requests.exceptions.RequestException: If there is an error during the HTTP request.
 
         """
-        if self.session_cookie == "":
-            try:
-                self.authentication()
-            except Exception as auth_error:
-                application_logger.error('Apex Authentication Error: {}'.format(auth_error))
         if self.apex_debug == True:
             url = "http://{}/rest/tlog?days=7&sdate={}".format(self.apex_ip, self.date_string)
+            window = "days=7&sdate={}".format(self.date_string)
         else:
             url = "http://{}/rest/tlog?days=1&sdate=0&_={}".format(self.apex_ip, self.epoch_current)
-        payload = {}
-        headers = {
-            'Content-Type': 'application/json',
-            'Cookie': 'connect.sid={}'.format(self.session_cookie)
-        }
-        try:
-            response = requests.get(url, headers=headers, data=payload, timeout=15)
-            response_dict = response.json()
-            if response.status_code == 200:
-                return response_dict
-            else:
-                application_logger.error('Apex Trident Log Error: {}'.format(response_dict))
-                return None
-        except requests.exceptions.RequestException as e:
-            application_logger.error('Apex Trident Log Error: {}'.format(e))
-            return None
+            window = 1
+        return self.rest_get(url, 'Apex Trident Log', "tlog", window)
     
     def config(self):
         """
@@ -261,28 +310,8 @@ class APEX:
             requests.exceptions.RequestException: If there is an error during the request.
 
         """
-        if self.session_cookie == "":
-            try:
-                self.authentication()
-            except Exception as auth_error:
-                application_logger.error('Apex Authentication Error: {}'.format(auth_error))
         url = "http://{}/rest/config".format(self.apex_ip)
-        payload = {}
-        headers = {
-            'Content-Type': 'application/json',
-            'Cookie': 'connect.sid={}'.format(self.session_cookie)
-        }
-        try:
-            response = requests.get(url, headers=headers, data=payload, timeout=15)
-            response_dict = response.json()
-            if response.status_code == 200:
-                return response_dict
-            else:
-                application_logger.error('Apex Config Error: {}'.format(response_dict))
-                return None
-        except requests.exceptions.RequestException as e:
-            application_logger.error('Apex Config Error: {}'.format(e))
-            return None
+        return self.rest_get(url, 'Apex Config', "config")
 
     def prom_metric_string(self, metric_name, metric_labels, metric_value):
         """
@@ -301,15 +330,45 @@ class APEX:
         metric_labels = ', '.join(metric_labels)
         return "apex_{}{{{}}} {}".format(metric_name, metric_labels, metric_value)
     
-    def prometheus_metrics(self):
+    def metric_structure(self, apex_status):
         """
-        Generates Prometheus metrics for the Neptune Apex device.
+        Extracts the parts of a status payload that decide metric names and labels.
+
+        Args:
+            apex_status (dict): The status data from the Neptune Apex.
 
         Returns:
-            str: The metrics data in Prometheus format.
+            tuple: The system fields and the (did, type, name) of every input.
         """
-        metric_lines = []
-        apex_status = self.status()
+        system = apex_status["system"]
+        return (
+            (system["hostname"], system["serial"], system["type"], system["software"], system["hardware"]),
+            tuple((apex_input["did"], apex_input["type"], apex_input["name"]) for apex_input in apex_status["inputs"])
+        )
+
+    def metric_values(self, apex_status):
+        """
+        Extracts the sample values of a status payload, in the same order as metric_sample_keys().
+
+        Args:
+            apex_status (dict): The status data from the Neptune Apex.
+
+        Returns:
+            list: The sample values.
+        """
+        return [0] + [apex_input["value"] for apex_input in apex_status["inputs"]]
+
+    def metric_sample_keys(self, apex_status):
+        """
+        Builds the metric name and labels of every sample.
+
+        Args:
+            apex_status (dict): The status data from the Neptune Apex.
+
+        Returns:
+            list: (metric_name, metric_labels) tuples.
+        """
+        sample_keys = []
 
         hostname = apex_status["system"]["hostname"]
         serial = apex_status["system"]["serial"]
@@ -330,7 +389,7 @@ class APEX:
             'apex_serial="{}"'.format(serial),
             'apex_hostname="{}"'.format(hostname)
         ]
-        metric_lines.append(self.prom_metric_string("apex_info_label_values", info_labels, 0))
+        sample_keys.append(("apex_info_label_values", info_labels))
 
         # SENSOR METRICS
         apex_inputs = apex_status["inputs"]
@@ -342,10 +401,45 @@ class APEX:
                 'input_name="{}"'.format(apex_input["name"])
             ]
             combined_labels = base_label_values + input_label_values
-            apex_input_value = apex_input["value"]
-            metric_lines.append(self.prom_metric_string(label_name, combined_labels, apex_input_value))
+            sample_keys.append((label_name, combined_labels))
+
+        return sample_keys
 
-        return "\n".join(metric_lines)
+    def prometheus_exposition(self, exposition_format="text", apex_status=None):
+        """
+        Generates Prometheus metrics for the Neptune Apex device as encoded bytes.
+
+        Renders are cached per Apex and format. When the status payload has not changed the
+        previous bytes are reused, and when only sample values changed only those lines are re-encoded.
+        The rolling ilog aggregates (neptune_aggregates) follow the status samples.
+
+        Args:
+            exposition_format (str, optional): prometheus_metrics.TEXT_FORMAT or OPENMETRICS_FORMAT.
+            apex_status (dict, optional): A status() payload to render. Fetched when omitted.
+
+        Returns:
+            tuple: (metrics data as bytes, ETag string)
+        """
+        if apex_status is None:
+            apex_status = self.status()
+        aggregate_samples = neptune_aggregates.aggregate_store.samples(self.apex_ip,
+                                                                       lambda days: self.internal_log(days=days))
+        aggregate_keys = [(metric_name, metric_labels) for metric_name, metric_labels, _ in aggregate_samples]
+        return exposition_cache.render((self.apex_ip, exposition_format),
+                                       (exposition_format, self.metric_structure(apex_status), aggregate_keys),
+                                       self.metric_values(apex_status) + [value for _, _, value in aggregate_samples],
+                                       lambda: prometheus_metrics.line_prefixes(self.metric_sample_keys(apex_status)
+                                                                                + aggregate_keys, exposition_format),
+                                       prometheus_metrics.exposition_suffix(exposition_format), exposition_format)
+
+    def prometheus_metrics(self):
+        """
+        Generates Prometheus metrics for the Neptune Apex device.
+
+        Returns:
+            str: The metrics data in Prometheus format.
+        """
+        return self.prometheus_exposition()[0].decode()
 
 if __name__ == "__main__":
     pass
\ No newline at end of file
@@ -0,0 +1,153 @@
+"""
+Neptune OpenMetrics Backfill Module.
+
+Converts the history store (Apex ilog / Fusion mlog) into OpenMetrics files for:
+    promtool tsdb create-blocks-from openmetrics <file> <output directory>
+
+Samples are read straight from the store's memory-mapped columns and written in
+fixed-size chunks, so memory use does not grow with the number of days converted.
+
+Usage:
+    python -m neptune_modules.neptune_backfill --source apex --target 192.168.1.50 --days 365 --output backfill/
+"""
+import argparse
+import os
+import sys
+import time
+from neptune_modules import neptune_history
+from neptune_modules import prometheus_metrics
+
+CHUNK_SIZE = 64 * 1024
+
+
+def format_timestamp(timestamp):
+    """
+    Formats epoch milliseconds as OpenMetrics epoch seconds.
+
+    Args:
+        timestamp (int): Epoch milliseconds.
+
+    Returns:
+        str: Ex: "1724112000.250"
+    """
+    return "{}.{:03d}".format(timestamp // 1000, timestamp % 1000)
+
+
+def openmetrics_backfill(store, source, target, start, end):
+    """
+    Streams a target's stored history as one OpenMetrics document.
+
+    Metric names and labels are the ones APEX.prometheus_metrics() / FUSION.prometheus_metrics()
+    expose. Every metric family is written contiguously and each series oldest first, as the
+    OpenMetrics format and promtool require.
+
+    Args:
+        store (neptune_history.HistoryStore): The history store.
+        source (str): "apex" or "fusion".
+        target (str): The Apex IP or Fusion ID.
+        start (int): Epoch milliseconds.
+        end (int): Epoch milliseconds.
+
+    Yields:
+        bytes: Chunks of the OpenMetrics document, ending with "# EOF".
+    """
+    series = store.list_series(source, target)
+    series_ids = sorted(series, key=lambda series_id: (series[series_id]["metric_name"], series_id))
+    sample_keys = [(series[series_id]["metric_name"], series[series_id]["labels"]) for series_id in series_ids]
+    prefixes = prometheus_metrics.line_prefixes(sample_keys, prometheus_metrics.OPENMETRICS_FORMAT)
+
+    # The first prefix of each family carries its TYPE/UNIT lines. Split them off so they are
+    # written before the family's first sample, whichever of its series has data in the range.
+    family_metadata = {}
+    series_prefixes = []
+    for prefix in prefixes:
+        metadata, _, prefix = prefix.rpartition("\n")
+        family = prefix.split("{", 1)[0]
+        if metadata:
+            family_metadata[family] = metadata + "\n"
+        series_prefixes.append((family, prefix))
+
+    buffer = []
+    buffer_size = 0
+    for series_id, (family, prefix) in zip(series_ids, series_prefixes):
+        for timestamp, value in store.read_points(source, target, series_id, start, end):
+            line = "{}{} {}\n".format(prefix, prometheus_metrics.format_value(value), format_timestamp(timestamp))
+            if family in family_metadata:
+                line = family_metadata.pop(family) + line
+            buffer.append(line)
+            buffer_size += len(line)
+            if buffer_size >= CHUNK_SIZE:
+                yield "".join(buffer).encode()
+                buffer = []
+                buffer_size = 0
+    buffer.append("# EOF\n")
+    yield "".join(buffer).encode()
+
+
+def write_backfill_files(store, source, target, start, end, output_directory, block_seconds=86400):
+    """
+    Writes one OpenMetrics file per time block, skipping blocks without samples.
+
+    Args:
+        store (neptune_history.HistoryStore): The history store.
+        source (str): "apex" or "fusion".
+        target (str): The Apex IP or Fusion ID.
+        start (int): Epoch milliseconds.
+        end (int): Epoch milliseconds.
+        output_directory (str): Where the .om files are written.
+        block_seconds (int, optional): Time span of each file. Defaults to 1 day.
+
+    Returns:
+        list: The paths of the files written, oldest block first.
+    """
+    os.makedirs(output_directory, exist_ok=True)
+    written_files = []
+    block_start = start
+    while block_start <= end:
+        block_end = min(end, block_start + block_seconds * 1000 - 1)
+        file_path = os.path.join(output_directory, "{}_{}_{}.om".format(
+            source, neptune_history.safe_name(target), block_start // 1000))
+        bytes_written = 0
+        with open(file_path, 'wb') as backfill_file:
+            for chunk in openmetrics_backfill(store, source, target, block_start, block_end):
+                backfill_file.write(chunk)
+                bytes_written += len(chunk)
+        if bytes_written <= len("# EOF\n"):
+            os.remove(file_path)
+        else:
+            written_files.append(file_path)
+        block_start = block_end + 1
+    return written_files
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write OpenMetrics backfill files from the Neptune Exporter history store.")
+    parser.add_argument("--source", choices=["apex", "fusion"], required=True)
+    parser.add_argument("--target", required=True, help="Apex IP address or Fusion Apex ID.")
+    parser.add_argument("--days", type=int, default=365, help="Days of history to convert.")
+    parser.add_argument("--block-hours", type=int, default=24, help="Time span of each output file.")
+    parser.add_argument("--history-directory", default=neptune_history.history_directory)
+    parser.add_argument("--output", required=True, help="Output directory for the .om files.")
+    parser.add_argument("--auth-module", help="Sync the Apex ilog with this apex.yml auth module first.")
+    arguments = parser.parse_args()
+
+    store = neptune_history.HistoryStore(arguments.history_directory)
+    if arguments.auth_module and arguments.source == "apex":
+        from neptune_modules import neptune_apex
+        apex_direct = neptune_apex.APEX(apex_ip=arguments.target, auth_module=arguments.auth_module)
+        neptune_history.sync_apex(store, apex_direct, arguments.days)
+
+    end = int(time.time() * 1000)
+    start = end - arguments.days * 86400 * 1000
+    stored_range = store.time_range(arguments.source, arguments.target)
+    if stored_range is None or stored_range[0] > start + 86400 * 1000:
+        print("Warning: the history store only covers {} of the requested {} days.".format(
+            "none" if stored_range is None else "{:.1f}".format((end - stored_range[0]) / 86400000.0), arguments.days),
+              file=sys.stderr)
+    for file_path in write_backfill_files(store, arguments.source, arguments.target, start, end,
+                                          arguments.output, arguments.block_hours * 3600):
+        print(file_path)
+
+
+if __name__ == "__main__":
+    main()
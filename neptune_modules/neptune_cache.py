@@ -0,0 +1,189 @@
+"""
+Neptune Exporter Payload Cache Module.
+
+Decoded upstream payloads (Apex REST responses, Fusion pages) shared by every route.
+/metrics/apex, /export/apex/, the history syncs and the collectors all read through it,
+so the same status or log is fetched once per TTL instead of once per route.
+
+Entries are keyed by (target, endpoint, query window), expire after a per-endpoint TTL
+and are evicted least recently used first once the cached payloads exceed max_bytes.
+Concurrent misses for the same key share one upstream fetch, unless the fetch was
+started by a less urgent caller or takes longer than the waiter's own deadline. The
+waiter then fetches for itself, so a metrics scrape never queues behind an export.
+
+Cached payloads are shared objects and must be treated as read-only.
+"""
+import collections
+import threading
+import time
+
+DEFAULT_SETTINGS = {
+    "enabled": True,
+    "max_bytes": 64 * 1024 * 1024,
+    "max_wait": 60,
+    "ttl": {"default": 30, "status": 10, "fusion_status": 10}
+}
+
+
+class PayloadCache:
+    """
+    TTL cache of decoded payloads with LRU eviction by payload size.
+    """
+    def __init__(self, settings=None):
+        """
+        Args:
+            settings (dict, optional): Overrides of DEFAULT_SETTINGS.
+        """
+        self.entries = collections.OrderedDict()
+        self.loading = {}
+        self.lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bypasses = 0
+        self.configure(settings)
+
+    def configure(self, settings):
+        """
+        Applies new settings and empties the cache.
+
+        Args:
+            settings (dict): Overrides of DEFAULT_SETTINGS.
+        """
+        merged = dict(DEFAULT_SETTINGS)
+        merged.update({key: value for key, value in (settings or {}).items() if value is not None})
+        merged["ttl"] = dict(DEFAULT_SETTINGS["ttl"], **(merged.get("ttl") or {}))
+        with self.lock:
+            self.settings = merged
+            self.entries.clear()
+            self.size = 0
+
+    def ttl(self, endpoint):
+        return float(self.settings["ttl"].get(endpoint, self.settings["ttl"]["default"]))
+
+    def lookup(self, key, now):
+        """
+        Returns a fresh entry and marks it recently used. Call with the lock held.
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[2] <= now:
+            self.remove(key)
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def remove(self, key):
+        entry = self.entries.pop(key)
+        self.size -= entry[1]
+
+    def put(self, key, value, size, now):
+        """
+        Stores a payload and evicts least recently used payloads above max_bytes.
+
+        Args:
+            key (tuple): (target, endpoint, window).
+            value (object): The decoded payload.
+            size (int): The payload's size in bytes on the wire.
+            now (float): time.monotonic() of the fetch.
+        """
+        max_bytes = int(self.settings["max_bytes"])
+        if size > max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (value, size, now + self.ttl(key[1]))
+            self.size += size
+            while self.size > max_bytes:
+                self.remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def fetch(self, key, loader, rank=0, max_wait=None):
+        """
+        Returns a cached payload, or loads it once for every concurrent caller.
+
+        Args:
+            key (tuple): (target, endpoint, window). Ex: ("192.168.1.50", "ilog", 365)
+            loader (callable): Fetches the payload and returns (decoded payload, size in bytes).
+                A None payload is returned to the caller but not cached.
+            rank (int, optional): Urgency of the caller, lower first. Ex: the admission class index.
+                A caller never waits for a load started by a less urgent caller. Defaults to 0.
+            max_wait (float, optional): Seconds to wait for another caller's load before loading
+                itself. Defaults to the max_wait setting.
+
+        Returns:
+            object: The decoded payload.
+        """
+        if not self.settings["enabled"]:
+            return loader()[0]
+        if max_wait is None:
+            max_wait = float(self.settings["max_wait"])
+        while True:
+            with self.lock:
+                entry = self.lookup(key, time.monotonic())
+                if entry is not None:
+                    return entry[0]
+                pending = self.loading.get(key)
+                if pending is None:
+                    pending = self.loading[key] = (threading.Event(), rank)
+                    self.misses += 1
+                    break
+            # Another request is fetching this payload. Use its result, or fetch if it failed.
+            loaded, loading_rank = pending
+            if loading_rank > rank or not loaded.wait(max_wait):
+                with self.lock:
+                    self.misses += 1
+                    self.bypasses += 1
+                return self.load(key, loader)
+        try:
+            return self.load(key, loader)
+        finally:
+            with self.lock:
+                del self.loading[key]
+            pending[0].set()
+
+    def load(self, key, loader):
+        value, size = loader()
+        if value is not None:
+            self.put(key, value, size, time.monotonic())
+        return value
+
+    def exposition(self):
+        """
+        Renders the hit ratio, resident size and counters.
+
+        Returns:
+            str: Prometheus text exposition.
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            metrics = [
+                ("neptune_exporter_payload_cache_hit_ratio", "gauge", "Share of payload lookups answered from the cache.",
+                 round(self.hits / lookups, 6) if lookups else 0),
+                ("neptune_exporter_payload_cache_bytes", "gauge", "Wire size of the cached payloads.", self.size),
+                ("neptune_exporter_payload_cache_max_bytes", "gauge", "Configured payload cache size limit.",
+                 int(self.settings["max_bytes"])),
+                ("neptune_exporter_payload_cache_entries", "gauge", "Cached payloads.", len(self.entries)),
+                ("neptune_exporter_payload_cache_hits_total", "counter", "Payload lookups answered from the cache.", self.hits),
+                ("neptune_exporter_payload_cache_misses_total", "counter", "Payload lookups fetched upstream.", self.misses),
+                ("neptune_exporter_payload_cache_evictions_total", "counter", "Payloads evicted to stay under max_bytes.",
+                 self.evictions),
+                ("neptune_exporter_payload_cache_bypasses_total", "counter",
+                 "Fetches made instead of waiting for a slower or less urgent concurrent fetch.", self.bypasses)
+            ]
+        lines = []
+        for metric_name, metric_type, metric_help, metric_value in metrics:
+            lines += ["# HELP {} {}".format(metric_name, metric_help), "# TYPE {} {}".format(metric_name, metric_type),
+                      "{} {}".format(metric_name, metric_value)]
+        return "\n".join(lines) + "\n"
+
+
+payload_cache = PayloadCache()
+
+
+if __name__ == "__main__":
+    pass
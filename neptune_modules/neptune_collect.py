@@ -0,0 +1,296 @@
+"""
+Neptune Exporter One-Shot Collection Module.
+
+Collects every Apex in apex.yml apex_targets and every Fusion ID in fusion.yml once,
+in parallel, and writes one Prometheus text file per target for node_exporter's
+textfile collector. Meant for cron on hosts that do not run the FastAPI service.
+
+Each file is replaced atomically and only when its content changed. A failed target
+keeps its previous file. Per-target timings are printed and also written to
+neptune_collect.prom.
+
+Usage:
+    python -m neptune_modules.neptune_collect --output /var/lib/node_exporter/textfile_collector
+"""
+import argparse
+import concurrent.futures
+import functools
+import logging
+import os
+import sys
+import time
+import yaml
+from neptune_modules import neptune_admission
+from neptune_modules import neptune_aggregates
+from neptune_modules import neptune_cache
+from neptune_modules import neptune_config
+from neptune_modules import neptune_history
+from neptune_modules import neptune_mlog
+from neptune_modules import prometheus_metrics
+
+application_logger = logging.getLogger('neptune_exporter')
+
+exporter_configuration_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'configuration', 'exporter.yml')
+
+SUMMARY_FILE = "neptune_collect.prom"
+
+WRITTEN = "written"
+UNCHANGED = "unchanged"
+FAILED = "failed"
+
+
+def load_exporter_configuration(file_path):
+    """
+    Reads exporter.yml for the backend switches and the admission, cache and aggregate settings.
+
+    Args:
+        file_path (str): The exporter.yml path.
+
+    Returns:
+        dict: The configuration. Empty if the file does not exist.
+    """
+    if not os.path.exists(file_path):
+        return {}
+    with open(file_path, 'r') as config_file:
+        return yaml.safe_load(config_file) or {}
+
+
+def apply_settings(configuration):
+    """
+    Configures the shared modules the same way neptune_exporter.py does.
+
+    Args:
+        configuration (dict): The exporter.yml configuration.
+    """
+    neptune_admission.admission_controller.configure(configuration.get("apex_admission"))
+    neptune_cache.payload_cache.configure(configuration.get("payload_cache"))
+    neptune_mlog.mlog_store.configure(configuration.get("mlog_cache"))
+    neptune_aggregates.aggregate_store.configure(configuration.get("rolling_aggregates"))
+
+
+def output_path(output_directory, source, target):
+    """
+    Args:
+        output_directory (str): The textfile collector directory.
+        source (str): "apex" or "fusion".
+        target (str): The Apex IP address or Fusion Apex ID.
+
+    Returns:
+        str: Ex: <output_directory>/neptune_apex_192.168.1.50.prom
+    """
+    return os.path.join(output_directory, "neptune_{}_{}.prom".format(source, neptune_history.safe_name(target)))
+
+
+def write_if_changed(file_path, body):
+    """
+    Atomically replaces a file unless it already holds body.
+
+    The temporary file does not end in .prom, so the textfile collector never reads a partial file.
+
+    Args:
+        file_path (str): The output file.
+        body (bytes): The new content.
+
+    Returns:
+        bool: True if the file was written, False if it was unchanged.
+    """
+    try:
+        with open(file_path, 'rb') as current_file:
+            if current_file.read() == body:
+                return False
+    except FileNotFoundError:
+        pass
+    temporary_path = "{}.{}.tmp".format(file_path, os.getpid())
+    with open(temporary_path, 'wb') as output_file:
+        output_file.write(body)
+    os.replace(temporary_path, file_path)
+    return True
+
+
+def render_apex(apex_module, target, auth_module):
+    apex_direct = apex_module.APEX(apex_ip=target, auth_module=auth_module)
+    return apex_direct.prometheus_exposition(prometheus_metrics.TEXT_FORMAT)[0]
+
+
+def render_fusion(fusion_module, fusion_apex_id, data_max_age):
+    try:
+        apex_fusion = fusion_module.FUSION(fusion_apex_id, data_max_age)
+        return apex_fusion.prometheus_exposition(prometheus_metrics.TEXT_FORMAT)[0]
+    except Exception:
+        fusion_module.close_browser_session(fusion_apex_id)
+        raise
+
+
+def collection_tasks(sources, data_max_age):
+    """
+    Lists the targets of apex.yml and fusion.yml. Backends are imported only when their source is collected.
+
+    A missing or invalid configuration file is reported on stderr and its source is skipped.
+
+    Args:
+        sources (list): "apex" and / or "fusion".
+        data_max_age (int): data_max_age of the Fusion collections.
+
+    Returns:
+        tuple: ([(source, target, render function)], {source: loaded module})
+    """
+    tasks = []
+    modules = {}
+    for source in sources:
+        try:
+            if source == "apex":
+                from neptune_modules import neptune_apex
+                for target, auth_module in neptune_apex.load_configuration().apex_targets:
+                    tasks.append(("apex", target, functools.partial(render_apex, neptune_apex, target, auth_module)))
+                modules["apex"] = neptune_apex
+            else:
+                from neptune_modules import neptune_fusion
+                for fusion_apex_id in neptune_fusion.load_configuration().fusion_systems:
+                    tasks.append(("fusion", fusion_apex_id,
+                                  functools.partial(render_fusion, neptune_fusion, fusion_apex_id, data_max_age)))
+                modules["fusion"] = neptune_fusion
+        except neptune_config.ConfigurationError as e:
+            print("Skipping {}: {}".format(source, e), file=sys.stderr)
+    return tasks, modules
+
+
+def collect_target(source, target, render, output_directory):
+    """
+    Renders one target and writes its file.
+
+    Args:
+        source (str): "apex" or "fusion".
+        target (str): The Apex IP address or Fusion Apex ID.
+        render (callable): Returns the target's text exposition as bytes.
+        output_directory (str): The textfile collector directory.
+
+    Returns:
+        dict: {"source", "target", "state", "seconds", "error"}
+    """
+    started = time.monotonic()
+    try:
+        state = WRITTEN if write_if_changed(output_path(output_directory, source, target), render()) else UNCHANGED
+        error = None
+    except Exception as e:
+        state = FAILED
+        error = str(e)
+    return {"source": source, "target": target, "state": state,
+            "seconds": round(time.monotonic() - started, 3), "error": error}
+
+
+def run_collection(tasks, concurrency, output_directory):
+    """
+    Collects every target with one thread pool per source and waits for all of them.
+
+    Args:
+        tasks (list): (source, target, render function) tuples.
+        concurrency (dict): source -> targets collected at once.
+        output_directory (str): The textfile collector directory.
+
+    Returns:
+        tuple: (results in task order, wall time in seconds)
+    """
+    started = time.monotonic()
+    executors = {source: concurrent.futures.ThreadPoolExecutor(max_workers=max(1, int(limit)),
+                                                               thread_name_prefix="collect-{}".format(source))
+                 for source, limit in concurrency.items()}
+    try:
+        futures = [executors[source].submit(collect_target, source, target, render, output_directory)
+                   for source, target, render in tasks]
+        results = [future.result() for future in futures]
+    finally:
+        for executor in executors.values():
+            executor.shutdown(wait=True)
+    return results, round(time.monotonic() - started, 3)
+
+
+def summary_exposition(results, wall_seconds, finished_time):
+    """
+    Renders the collection timings for the textfile collector.
+
+    Args:
+        results (list): collect_target() results.
+        wall_seconds (float): Wall time of the whole run.
+        finished_time (float): Epoch seconds the run finished.
+
+    Returns:
+        bytes: Prometheus text exposition.
+    """
+    lines = ["# HELP neptune_collect_target_duration_seconds Time spent collecting and writing the target.",
+             "# TYPE neptune_collect_target_duration_seconds gauge"]
+    lines += ['neptune_collect_target_duration_seconds{{source="{}",target="{}"}} {}'.format(
+        result["source"], result["target"], result["seconds"]) for result in results]
+    lines += ["# HELP neptune_collect_target_success 1 if the target was collected, 0 if its file is stale.",
+              "# TYPE neptune_collect_target_success gauge"]
+    lines += ['neptune_collect_target_success{{source="{}",target="{}"}} {}'.format(
+        result["source"], result["target"], int(result["state"] != FAILED)) for result in results]
+    lines += ["# HELP neptune_collect_duration_seconds Wall time of the last collection run.",
+              "# TYPE neptune_collect_duration_seconds gauge",
+              "neptune_collect_duration_seconds {}".format(wall_seconds),
+              "# HELP neptune_collect_last_run_timestamp_seconds When the last collection run finished.",
+              "# TYPE neptune_collect_last_run_timestamp_seconds gauge",
+              "neptune_collect_last_run_timestamp_seconds {}".format(round(finished_time, 3))]
+    return ("\n".join(lines) + "\n").encode()
+
+
+def report(results, wall_seconds):
+    """
+    Formats the per-target timings and totals.
+
+    Args:
+        results (list): collect_target() results.
+        wall_seconds (float): Wall time of the whole run.
+
+    Returns:
+        str: One line per target, slowest first, and a total line.
+    """
+    lines = []
+    for result in sorted(results, key=lambda result: result["seconds"], reverse=True):
+        line = "{:<7} {:<40} {:>8.3f}s  {}".format(result["source"], result["target"], result["seconds"], result["state"])
+        if result["error"]:
+            line += ": {}".format(result["error"])
+        lines.append(line)
+    counts = {state: sum(1 for result in results if result["state"] == state) for state in (WRITTEN, UNCHANGED, FAILED)}
+    lines.append("Collected {} targets in {:.3f}s: {} written, {} unchanged, {} failed".format(
+        len(results), wall_seconds, counts[WRITTEN], counts[UNCHANGED], counts[FAILED]))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Collect every Apex and Fusion target once and write .prom files "
+                                                 "for the node_exporter textfile collector.")
+    parser.add_argument("--output", required=True, help="Textfile collector directory.")
+    parser.add_argument("--sources", nargs="+", choices=["apex", "fusion"],
+                        help="Sources to collect. Defaults to the modules enabled in exporter.yml.")
+    parser.add_argument("--apex-concurrency", type=int, default=8, help="Apex systems collected at once.")
+    parser.add_argument("--fusion-concurrency", type=int, default=2,
+                        help="Fusion IDs collected at once. Each one runs a Chrome browser.")
+    parser.add_argument("--data-max-age", type=int,
+                        help="Fusion data_max_age in seconds. Defaults to server.fusion_data_max_age, or 300.")
+    parser.add_argument("--config", default=exporter_configuration_file, help="exporter.yml path.")
+    arguments = parser.parse_args()
+
+    configuration = load_exporter_configuration(arguments.config)
+    apply_settings(configuration)
+    sources = arguments.sources or [source for source in ("apex", "fusion")
+                                    if (configuration.get("{}_module".format(source)) or {}).get("enabled", True)]
+    data_max_age = arguments.data_max_age or (configuration.get("server") or {}).get("fusion_data_max_age", 300)
+    os.makedirs(arguments.output, exist_ok=True)
+
+    tasks, modules = collection_tasks(sources, data_max_age)
+    try:
+        results, wall_seconds = run_collection(tasks, {"apex": arguments.apex_concurrency,
+                                                       "fusion": arguments.fusion_concurrency}, arguments.output)
+    finally:
+        # One-shot run: do not leave Chrome processes behind.
+        if "fusion" in modules:
+            for source, target, _ in tasks:
+                if source == "fusion":
+                    modules["fusion"].close_browser_session(target)
+    write_if_changed(os.path.join(arguments.output, SUMMARY_FILE), summary_exposition(results, wall_seconds, time.time()))
+    print(report(results, wall_seconds))
+    return 1 if any(result["state"] == FAILED for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
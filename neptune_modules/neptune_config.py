@@ -0,0 +1,296 @@
+"""
+Neptune Exporter Hot-Reloadable Configuration Module.
+"""
+import collections
+import logging
+import os
+import threading
+import time
+import yaml
+
+application_logger = logging.getLogger('neptune_exporter')
+
+configuration_directory = os.path.join(os.path.dirname(__file__), '..', 'configuration')
+
+Credentials = collections.namedtuple("Credentials", ["username", "password"])
+
+
+class ConfigurationError(Exception):
+    """
+    Raised when a configuration file can not be read or fails validation.
+    """
+
+
+class ConfigSnapshot:
+    """
+    An immutable, validated view of one configuration file.
+
+    Lookup tables are built once per load so requests only do a dict lookup.
+    Requests keep a reference to the snapshot they started with, so a reload
+    never changes the configuration under an in-flight scrape.
+    """
+    def __init__(self, raw, lookup_tables, version, modified_time):
+        """
+        Args:
+            raw (dict): The parsed YAML document.
+            lookup_tables (dict): Precompiled tables, exposed as attributes.
+            version (int): Incremented on every successful load.
+            modified_time (float): The file mtime this snapshot was loaded from.
+        """
+        self.raw = raw
+        self.version = version
+        self.modified_time = modified_time
+        for table_name, table in lookup_tables.items():
+            setattr(self, table_name, table)
+
+    def __getitem__(self, key):
+        return self.raw[key]
+
+
+def validate_credentials(section_name, entries, errors):
+    """
+    Validates a mapping of name -> {username, password} and compiles it.
+
+    Args:
+        section_name (str): The section name, used in error messages.
+        entries (dict): The section from the YAML document.
+        errors (list): Validation errors are appended here.
+
+    Returns:
+        dict: name (str) -> Credentials.
+    """
+    credentials = {}
+    if not isinstance(entries, dict) or len(entries) == 0:
+        errors.append("{} must be a mapping with at least one entry".format(section_name))
+        return credentials
+    for name, entry in entries.items():
+        if not isinstance(entry, dict):
+            errors.append("{}.{} must be a mapping with username and password".format(section_name, name))
+            continue
+        for field in ("username", "password"):
+            if entry.get(field) is None or isinstance(entry.get(field), (dict, list)):
+                errors.append("{}.{}.{} is missing or not a scalar".format(section_name, name, field))
+        credentials[str(name)] = Credentials(str(entry.get("username")), str(entry.get("password")))
+    return credentials
+
+
+def compile_apex_configuration(raw):
+    """
+    Validates apex.yml and builds the auth module and target lookup tables.
+
+    Args:
+        raw (dict): The parsed apex.yml document.
+
+    Returns:
+        dict: {"apex_auths": {auth_module: Credentials}, "apex_targets": [(target, auth_module)]}
+
+    Raises:
+        ConfigurationError: If the document does not match the schema.
+    """
+    errors = []
+    if not isinstance(raw, dict):
+        raise ConfigurationError("apex.yml must be a mapping")
+    apex_auths = validate_credentials("apex_auths", raw.get("apex_auths"), errors)
+    apex_targets = []
+    if not isinstance(raw.get("apex_targets") or [], list):
+        errors.append("apex_targets must be a list")
+    else:
+        for index, entry in enumerate(raw.get("apex_targets") or []):
+            if not isinstance(entry, dict) or entry.get("target") is None:
+                errors.append("apex_targets[{}] must be a mapping with a target".format(index))
+                continue
+            auth_module = str(entry.get("auth_module", "default"))
+            if auth_module not in apex_auths:
+                errors.append("apex_targets[{}].auth_module {} is not in apex_auths".format(index, auth_module))
+            apex_targets.append((str(entry["target"]), auth_module))
+    if errors:
+        raise ConfigurationError("; ".join(errors))
+    return {"apex_auths": apex_auths, "apex_targets": apex_targets}
+
+
+def compile_fusion_configuration(raw):
+    """
+    Validates fusion.yml and builds the Fusion ID lookup table.
+
+    Args:
+        raw (dict): The parsed fusion.yml document.
+
+    Returns:
+        dict: {"fusion_systems": {fusion_apex_id: Credentials}}
+
+    Raises:
+        ConfigurationError: If the document does not match the schema.
+    """
+    errors = []
+    if not isinstance(raw, dict) or not isinstance(raw.get("fusion"), dict):
+        raise ConfigurationError("fusion.yml must contain a fusion mapping")
+    fusion_systems = validate_credentials("fusion.apex_systems", raw["fusion"].get("apex_systems"), errors)
+    if errors:
+        raise ConfigurationError("; ".join(errors))
+    return {"fusion_systems": fusion_systems}
+
+
+class ConfigStore:
+    """
+    Holds the current snapshot of a configuration file and reloads it when the file changes.
+
+    An invalid file is logged and ignored; the previous snapshot stays active.
+    """
+    def __init__(self, file_name, compile_function):
+        """
+        Args:
+            file_name (str): The file name inside the configuration directory.
+            compile_function (callable): Validates the parsed YAML and returns the lookup tables.
+        """
+        self.file_name = file_name
+        self.compile_function = compile_function
+        self.current = None
+        self.rejected_modified_time = None
+        self.listeners = []
+        self.reload_lock = threading.Lock()
+        self.watcher = None
+
+    @property
+    def path(self):
+        return os.path.join(configuration_directory, self.file_name)
+
+    def snapshot(self):
+        """
+        Returns the active snapshot, loading the file on first use.
+
+        Returns:
+            ConfigSnapshot: The active snapshot.
+
+        Raises:
+            ConfigurationError: If the file has never loaded successfully.
+        """
+        current = self.current
+        if current is None:
+            self.reload()
+            current = self.current
+        return current
+
+    def load(self):
+        """
+        Reads, validates and compiles the file without activating it.
+
+        Returns:
+            ConfigSnapshot: The new snapshot.
+
+        Raises:
+            ConfigurationError: If the file can not be read or fails validation.
+        """
+        try:
+            modified_time = os.path.getmtime(self.path)
+            with open(self.path, 'r') as config_file:
+                raw = yaml.safe_load(config_file)
+        except (OSError, yaml.YAMLError) as e:
+            raise ConfigurationError("{}: {}".format(self.file_name, e))
+        lookup_tables = self.compile_function(raw)
+        version = self.current.version + 1 if self.current is not None else 1
+        return ConfigSnapshot(raw, lookup_tables, version, modified_time)
+
+    def reload(self):
+        """
+        Loads the file and atomically swaps in the new snapshot.
+
+        Returns:
+            bool: True if a new snapshot was activated.
+
+        Raises:
+            ConfigurationError: If no snapshot is active yet and the file is invalid.
+        """
+        with self.reload_lock:
+            try:
+                new_snapshot = self.load()
+            except ConfigurationError as e:
+                application_logger.error('Configuration File Load Failed: {}'.format(e))
+                if self.current is None:
+                    raise
+                return False
+            old_snapshot = self.current
+            self.current = new_snapshot
+        if old_snapshot is not None:
+            application_logger.info('Configuration Reloaded: {} (version {})'.format(self.file_name, new_snapshot.version))
+            for listener in self.listeners:
+                try:
+                    listener(old_snapshot, new_snapshot)
+                except Exception as e:
+                    application_logger.error('Configuration Listener Error: {}'.format(e))
+        return True
+
+    def reload_if_changed(self):
+        """
+        Reloads the file if its mtime differs from the active snapshot.
+
+        Unlike snapshot(), a missing or invalid file never raises here.
+
+        Returns:
+            bool: True if a new snapshot was activated.
+        """
+        try:
+            modified_time = os.path.getmtime(self.path)
+        except OSError:
+            return False
+        if modified_time == self.rejected_modified_time:
+            return False
+        if self.current is not None and modified_time == self.current.modified_time:
+            return False
+        try:
+            reloaded = self.reload()
+        except ConfigurationError as e:
+            application_logger.error('Configuration Reload Failed: {} has no valid snapshot yet: {}'.format(
+                self.file_name, e))
+            reloaded = False
+        if not reloaded:
+            # Log an invalid file once, not on every poll.
+            self.rejected_modified_time = modified_time
+        return reloaded
+
+    def on_change(self, listener):
+        """
+        Registers a callback run after a reload as listener(old_snapshot, new_snapshot).
+
+        Args:
+            listener (callable): The callback.
+        """
+        self.listeners.append(listener)
+
+    def watch(self, interval=5):
+        """
+        Starts a daemon thread that polls the file for changes.
+
+        Args:
+            interval (float, optional): Seconds between checks. Defaults to 5.
+        """
+        if self.watcher is not None:
+            return
+
+        def poll():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.reload_if_changed()
+                except Exception as e:
+                    application_logger.error('Configuration Watcher Error: {}'.format(e))
+
+        self.watcher = threading.Thread(target=poll, name="config-watcher-{}".format(self.file_name), daemon=True)
+        self.watcher.start()
+
+
+def changed_credentials(old_table, new_table):
+    """
+    Lists the names whose credentials changed or were removed between two lookup tables.
+
+    Args:
+        old_table (dict): name -> Credentials from the old snapshot.
+        new_table (dict): name -> Credentials from the new snapshot.
+
+    Returns:
+        set: The names whose sessions must be invalidated.
+    """
+    return {name for name, credentials in old_table.items() if new_table.get(name) != credentials}
+
+
+if __name__ == "__main__":
+    pass
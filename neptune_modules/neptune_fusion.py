@@ -1,16 +1,20 @@
 """
 Neptune Fusion Web-Scrape API Module.
 """
-import datetime
-import json
 import logging.config
 import os
-import yaml
+import threading
+import weakref
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions
 from selenium.webdriver.chrome.options import Options
+from neptune_modules import neptune_cache
+from neptune_modules import neptune_config
+from neptune_modules import neptune_json
+from neptune_modules import neptune_mlog
+from neptune_modules import prometheus_metrics
 
 def setup_logger(name, log_file, level=logging.INFO):
     """
@@ -34,13 +38,113 @@ def setup_logger(name, log_file, level=logging.INFO):
 
 application_logger = setup_logger('neptune_fusion', str(os.path.dirname(__file__)) + '/../logs/' + 'neptune.log')
 
-try:
-    loaded_cfg_file = str(os.path.dirname(__file__)) + "/../configuration/" + "fusion.yml"
-    with open(loaded_cfg_file, 'r') as config_file:
-        configuration = yaml.load(config_file, Loader=yaml.Loader)
-except Exception as e:
-    application_logger.error('Configuration File Load Failed: {}'.format(str(e)))
-    exit()
+configuration_store = neptune_config.ConfigStore('fusion.yml', neptune_config.compile_fusion_configuration)
+
+# fusion_apex_id -> BrowserSession. Browsers are kept across requests until the Fusion ID's
+# credentials change in fusion.yml or the session stops working.
+browser_sessions = {}
+browser_lock = threading.Lock()
+
+class BrowserSession:
+    """
+    A pooled, logged in Chrome driver.
+
+    Request handlers, the remote write thread, the warm-up pool and the snapshot collector
+    all use the same driver, so every command sequence runs under its lock. Each FUSION
+    object holds a lease on its session. A retired session is quit once its last lease ends,
+    so scrapes that started before a fusion.yml change finish on the old browser.
+    """
+    def __init__(self, credentials, driver):
+        """
+        Args:
+            credentials (neptune_config.Credentials): The credentials the driver is logged in with.
+            driver (webdriver.Chrome): The Chrome driver.
+        """
+        self.credentials = credentials
+        self.driver = driver
+        # Held while a thread drives the browser.
+        self.lock = threading.Lock()
+        self.state_lock = threading.Lock()
+        self.leases = 0
+        self.retired = False
+        self.closed = False
+
+    def lease(self):
+        with self.state_lock:
+            self.leases += 1
+
+    def release(self):
+        with self.state_lock:
+            self.leases -= 1
+            quit_now = self.retired and self.leases == 0
+        if quit_now:
+            self.quit()
+
+    def retire(self):
+        """
+        Marks the session as out of the pool. The driver is quit now if unused, otherwise when its last lease ends.
+        """
+        with self.state_lock:
+            self.retired = True
+            quit_now = self.leases == 0
+        if quit_now:
+            self.quit()
+
+    def quit(self):
+        with self.state_lock:
+            if self.closed:
+                return
+            self.closed = True
+        # Let a running command sequence finish first.
+        with self.lock:
+            try:
+                self.driver.quit()
+            except Exception as e:
+                application_logger.error('Fusion Browser Quit Error: {}'.format(str(e)))
+
+def load_configuration():
+    """
+    Returns the active fusion.yml snapshot, loading the file on first use.
+
+    Returns:
+        neptune_config.ConfigSnapshot: The Fusion configuration.
+
+    Raises:
+        neptune_config.ConfigurationError: If the configuration file can not be read or is invalid.
+    """
+    return configuration_store.snapshot()
+
+def close_browser_session(fusion_apex_id):
+    """
+    Removes a Fusion ID's browser from the pool. It is quit once no FUSION object uses it.
+
+    Args:
+        fusion_apex_id (str): The ID of the Fusion Apex system.
+    """
+    with browser_lock:
+        browser_session = browser_sessions.pop(str(fusion_apex_id), None)
+    neptune_mlog.mlog_store.forget(fusion_apex_id)
+    if browser_session is not None:
+        browser_session.retire()
+
+def invalidate_sessions(old_snapshot, new_snapshot):
+    """
+    Closes the browsers of Fusion IDs whose credentials changed or were removed in fusion.yml.
+
+    Args:
+        old_snapshot (neptune_config.ConfigSnapshot): The previous configuration.
+        new_snapshot (neptune_config.ConfigSnapshot): The reloaded configuration.
+    """
+    changed_fusion_ids = neptune_config.changed_credentials(old_snapshot.fusion_systems, new_snapshot.fusion_systems)
+    for fusion_apex_id in changed_fusion_ids:
+        close_browser_session(fusion_apex_id)
+    if changed_fusion_ids:
+        application_logger.info('Fusion Sessions Invalidated: {}'.format(", ".join(sorted(changed_fusion_ids))))
+
+configuration_store.on_change(invalidate_sessions)
+
+# Rendered /metrics/fusion output per Fusion ID and exposition format.
+exposition_cache = prometheus_metrics.ExpositionCache()
 
 class FUSION:
     """
@@ -58,12 +162,41 @@ class FUSION:
         # Going forward if a date range is need as a url pram. implement an fusion_debug check.
         # Include at least 1-7 days of data.
         self.fusion_debug = fusion_debug
-        chrome_options = Options()
-        chrome_options.add_argument("--headless=new")
-        self.driver = webdriver.Chrome(options=chrome_options)
-        self.fusion_login(configuration["fusion"]["apex_systems"][fusion_apex_id]["username"], 
-                          configuration["fusion"]["apex_systems"][fusion_apex_id]["password"])
         self.fusion_apex_id = fusion_apex_id
+        self.credentials = load_configuration().fusion_systems[str(fusion_apex_id)]
+        with browser_lock:
+            browser_session = browser_sessions.get(str(fusion_apex_id))
+            if browser_session is not None and browser_session.credentials == self.credentials:
+                browser_session.lease()
+                stale_session = False
+            else:
+                stale_session = browser_session is not None
+        if stale_session:
+            close_browser_session(fusion_apex_id)
+            browser_session = None
+        if browser_session is None:
+            chrome_options = Options()
+            chrome_options.add_argument("--headless=new")
+            browser_session = BrowserSession(self.credentials, webdriver.Chrome(options=chrome_options))
+            browser_session.lease()
+            self.browser_session = browser_session
+            self.driver = browser_session.driver
+            try:
+                self.fusion_login(self.credentials.username, self.credentials.password)
+            except Exception:
+                browser_session.retire()
+                browser_session.release()
+                raise
+            with browser_lock:
+                replaced_session = browser_sessions.get(str(fusion_apex_id))
+                browser_sessions[str(fusion_apex_id)] = browser_session
+            if replaced_session is not None:
+                # Another request logged in at the same time. Its users keep it until they finish.
+                replaced_session.retire()
+        self.browser_session = browser_session
+        self.driver = browser_session.driver
+        # The lease ends with release() or when this object is garbage collected.
+        self.release = weakref.finalize(self, browser_session.release)
         self.max_data_age = int(max_data_age) + 60 # 1m grace period to account for scrape time.
 
     def fusion_login(self, username, password):
@@ -74,61 +207,89 @@ class FUSION:
             username (str): The username for authentication.
             password (str): The password for authentication.
         """
-        self.driver.get('https://apexfusion.com/login')
-        id_box = WebDriverWait(self.driver, 30).until(expected_conditions.presence_of_element_located((By.ID, 'index-login-username')))
-        id_box.send_keys(str(username))
-        pass_box = self.driver.find_element(By.ID, 'index-login-password')
-        pass_box.send_keys(str(password))
-        self.driver.find_element(By.CLASS_NAME, 'af-sign-in').click()
-        self.driver.implicitly_wait(3)
-
-    def get_measurement_log(self):
+        with self.browser_session.lock:
+            self.driver.get('https://apexfusion.com/login')
+            id_box = WebDriverWait(self.driver, 30).until(expected_conditions.presence_of_element_located((By.ID, 'index-login-username')))
+            id_box.send_keys(str(username))
+            pass_box = self.driver.find_element(By.ID, 'index-login-password')
+            pass_box.send_keys(str(password))
+            self.driver.find_element(By.CLASS_NAME, 'af-sign-in').click()
+            self.driver.implicitly_wait(3)
+
+    def get_measurement_log(self, days=None):
         """
         Gets the measurement log from Fusion.
 
+        Args:
+            days (int, optional): Days of log data to request. Defaults to 365 in debug mode, otherwise 1.
+
         Returns:
-            dict: The measurement log data in JSON format.
+            dict: The measurement log data in JSON format. Shared through the payload cache, do not modify.
         """
-        if self.fusion_debug == True:
-            mlog_url = "https://apexfusion.com/api/apex/{}/mlog?days=365".format(str(self.fusion_apex_id))
-        else:
-            mlog_url = "https://apexfusion.com/api/apex/{}/mlog?days=1".format(str(self.fusion_apex_id))
-        self.driver.get(mlog_url)
-        self.driver.implicitly_wait(3)
-        self.driver.refresh()
-        self.driver.implicitly_wait(3)
-        html_content = str(self.driver.page_source)
-        try:
-            html_content = html_content[html_content.index("<pre>") + len("<pre>"):]
-            html_content = html_content[:html_content.index("</pre>") + len("</pre>")]
-        except:
-            self.driver.refresh()
-            self.driver.implicitly_wait(3)
-            html_content = html_content[html_content.index("<pre>") + len("<pre>"):]
-            html_content = html_content[:html_content.index("</pre>") + len("</pre>")]
-        html_content = html_content.replace("<pre>", "")
-        html_content = html_content.replace("</pre>", "")
-        html_to_json = json.loads(html_content)
-        return html_to_json
-    
+        if days is None:
+            days = 365 if self.fusion_debug == True else 1
+        mlog_url = "https://apexfusion.com/api/apex/{}/mlog?days={}".format(str(self.fusion_apex_id), int(days))
+        return neptune_cache.payload_cache.fetch((str(self.fusion_apex_id), "mlog", int(days)),
+                                                 lambda: self.fetch_page_json(mlog_url, retry=True))
+
     def get_status(self):
         """
         Gets the status data from Fusion.
 
         Returns:
-            dict: The status data in JSON format.
+            dict: The status data in JSON format. Shared through the payload cache, do not modify.
+        """
+        status_url = "https://apexfusion.com/api/apex?page=1&per_page=9999"
+        return neptune_cache.payload_cache.fetch((str(self.fusion_apex_id), "fusion_status", None),
+                                                 lambda: self.fetch_page_json(status_url))
+
+    def fetch_page_json(self, url, retry=False):
         """
-        mlog_url = "https://apexfusion.com/api/apex?page=1&per_page=9999"
-        self.driver.get(mlog_url)
-        self.driver.implicitly_wait(3)
-        self.driver.refresh()
-        html_content = str(self.driver.page_source)
-        html_content = html_content[html_content.index("<pre>") + len("<pre>"):]
-        html_content = html_content[:html_content.index("</pre>") + len("</pre>")]
-        html_content = html_content.replace("<pre>", "")
-        html_content = html_content.replace("</pre>", "")
-        html_to_json = json.loads(html_content)
-        return html_to_json
+        Loads a Fusion API URL in the browser and decodes its JSON document.
+
+        Args:
+            url (str): The Fusion API URL.
+            retry (bool, optional): Refresh once more if the page has no valid JSON yet. Defaults to False.
+
+        Returns:
+            tuple: (decoded JSON document, document size in characters)
+
+        Raises:
+            ValueError: If the page has no <pre> block or it is not valid JSON.
+        """
+        with self.browser_session.lock:
+            self.driver.get(url)
+            self.driver.implicitly_wait(3)
+            self.driver.refresh()
+            if not retry:
+                return self.page_json()
+            self.driver.implicitly_wait(3)
+            try:
+                return self.page_json()
+            except ValueError:
+                self.driver.refresh()
+                self.driver.implicitly_wait(3)
+                return self.page_json()
+
+    def page_json(self):
+        """
+        Decodes the JSON document Chrome shows inside <pre> for a Fusion API URL. Call with the session lock held.
+
+        The document is sliced out of page_source once and handed to the JSON codec as is.
+
+        Returns:
+            tuple: (decoded JSON document, document size in characters)
+
+        Raises:
+            ValueError: If the page has no <pre> block or it is not valid JSON.
+        """
+        page_source = self.driver.page_source
+        document_start = page_source.find("<pre>")
+        document_end = page_source.find("</pre>", document_start)
+        if document_start < 0 or document_end < 0:
+            raise ValueError("No JSON document in the Fusion page")
+        document = page_source[document_start + len("<pre>"):document_end]
+        return neptune_json.loads(document), len(document)
     
     def prom_metric_string(self, metric_name, metric_labels, metric_value):
         """
@@ -172,6 +333,22 @@ class FUSION:
         else:
             return "other"
         
+    def mlog_entry_name(self, log_entry):
+        """
+        Returns the measurement name of a measurement log entry, as used in the name label.
+
+        Args:
+            log_entry (dict): An entry of the measurement log.
+
+        Returns:
+            str or None: The measurement name, or None for entry types that are not exported.
+        """
+        if log_entry["type"] in [1, 2, 3, 4, 5, 6]:
+            return str(str(self.mlog_type_eval(log_entry["type"])).lower()).replace(" ", "_")
+        if log_entry["type"] in [0]:
+            return str(log_entry["name"]).lower().replace(" ", "_")
+        return None
+
     def sensor_type_eval(self, sensor_type):
         """
         Evaluates the sensor type and returns a more proper name.
@@ -192,14 +369,14 @@ class FUSION:
         else:
             return str(sensor_type).lower()
     
-    def prometheus_metrics(self):
+    def metric_samples(self):
         """
-        Generates Prometheus metrics for Fusion.
+        Collects the Fusion status and measurement log as metric samples.
 
         Returns:
-            str: The metrics data in Prometheus format.
+            list: (metric_name, metric_labels, metric_value) tuples.
         """
-        metric_lines = []
+        metric_samples = []
         fusion_status = self.get_status()[0]
         apex_id = fusion_status["_id"]
         apex_type = fusion_status["type"]
@@ -223,7 +400,7 @@ class FUSION:
             'apex_serial="{}"'.format(apex_serial),
             'apex_hostname="{}"'.format(apex_hostname)
         ]
-        metric_lines.append(self.prom_metric_string("info_label_values", info_label_values, 0))
+        metric_samples.append(("info_label_values", info_label_values, 0))
 
         # SD CARD METRICS
         sd_card_data = {
@@ -234,7 +411,7 @@ class FUSION:
             "sd_status_writes": fusion_status["extra"]["sdstat"]["writes"]
         }
         for metric_name, metric_value in sd_card_data.items():
-            metric_lines.append(self.prom_metric_string(metric_name, base_label_values, metric_value))
+            metric_samples.append((metric_name, base_label_values, metric_value))
 
         # SENSOR METRICS
         apex_inputs = fusion_status["status"]["inputs"]
@@ -248,7 +425,7 @@ class FUSION:
             ]
             combined_labels = base_label_values + input_label_values
             apex_input_value = apex_input["value"]
-            metric_lines.append(self.prom_metric_string("measurement", combined_labels, float(apex_input_value)))
+            metric_samples.append(("measurement", combined_labels, float(apex_input_value)))
 
         # ALARM METRICS
         alarm_labels = ['alarm_description="{}"'.format(str(fusion_status["status"]["alarm"]["smnt"])),
@@ -261,7 +438,7 @@ class FUSION:
             alarm_value = 1
         else:
             alarm_value = 2
-        metric_lines.append(self.prom_metric_string("alarm", combined_labels, alarm_value))
+        metric_samples.append(("alarm", combined_labels, alarm_value))
 
         # MODULE METRICS
         apex_modules = fusion_status["status"]["modules"]
@@ -279,93 +456,68 @@ class FUSION:
                 apex_module_status_value = 1
             else:
                 apex_module_status_value = 2
-            metric_lines.append(self.prom_metric_string("module_status", combined_labels, apex_module_status_value))
+            metric_samples.append(("module_status", combined_labels, apex_module_status_value))
 
             if apex_module_present == True:
                 apex_module_present_value = 1
             else:
                 apex_module_present_value = 2
-            metric_lines.append(self.prom_metric_string("module_present", combined_labels, apex_module_present_value))
+            metric_samples.append(("module_present", combined_labels, apex_module_present_value))
 
         # APEX NETWORK
         apex_network_quality = fusion_status["status"]["network"]["quality"]
-        metric_lines.append(self.prom_metric_string("network_quality_pct", base_label_values, apex_network_quality))
+        metric_samples.append(("network_quality_pct", base_label_values, apex_network_quality))
         apex_network_strength = fusion_status["status"]["network"]["strength"]
-        metric_lines.append(self.prom_metric_string("network_strength_pct", base_label_values, apex_network_strength))
+        metric_samples.append(("network_strength_pct", base_label_values, apex_network_strength))
 
         # GET LATEST MEASUREMENTS
-        fusion_measurement_log = self.get_measurement_log()
-        latest_measurements = {}
-        for log_entry in fusion_measurement_log:
-            log_date = log_entry["date"]  # Ex: 2024-08-19T04:20:38.184Z
-            log_type = log_entry["type"]
-            log_name = log_entry["name"]
-            log_value = log_entry["value"]
-
-            try:
-                log_timestamp_utc = datetime.datetime.strptime(str(log_date) + "+0000", "%Y-%m-%dT%H:%M:%S.%fZ%z")
-                current_timestamp_delta_utc = datetime.datetime.now(datetime.UTC) - datetime.timedelta(
-                    seconds=self.max_data_age)
-                if log_timestamp_utc <= current_timestamp_delta_utc:
-                    continue
-            except:
-                log_timestamp_utc = datetime.datetime.strptime(str(log_date), "%Y-%m-%dT%H:%M:%S.%fZ")
-                current_timestamp_delta_utc = datetime.datetime.utcnow() - datetime.timedelta(
-                    seconds=self.max_data_age)
-                if log_timestamp_utc <= current_timestamp_delta_utc:
-                    continue
-
-            if log_type in [1, 2, 3, 4, 5, 6]:
-                log_name = str(str(self.mlog_type_eval(log_type)).lower()).replace(" ", "_")
-                if str(log_name) not in latest_measurements:
-                    latest_measurements[str(log_name)] = {
-                        "date": log_date,
-                        "type": log_type,
-                        "name": log_name,
-                        "value": log_value
-                    }
-                else:
-                    current_ts_string = datetime.datetime.strptime(latest_measurements[str(log_name)]["date"],
-                                                                   "%Y-%m-%dT%H:%M:%S.%fZ")
-                    incoming_ts_string = datetime.datetime.strptime(log_date, "%Y-%m-%dT%H:%M:%S.%fZ")
-                    if current_ts_string < incoming_ts_string:
-                        latest_measurements[str(log_name)] = {
-                            "date": log_date,
-                            "type": log_type,
-                            "name": log_name,
-                            "value": log_value
-                        }
-
-            if log_type in [0]:
-                log_name = str(str(log_name)).lower().replace(" ", "_")
-                if str(log_name) not in latest_measurements:
-                    latest_measurements[str(log_name)] = {
-                        "date": log_date,
-                        "type": log_type,
-                        "name": log_name,
-                        "value": log_value
-                    }
-                else:
-                    current_ts_string = datetime.datetime.strptime(latest_measurements[str(log_name)]["date"],
-                                                                   "%Y-%m-%dT%H:%M:%S.%fZ")
-                    incoming_ts_string = datetime.datetime.strptime(log_date, "%Y-%m-%dT%H:%M:%S.%fZ")
-                    if current_ts_string < incoming_ts_string:
-                        latest_measurements[str(log_name)] = {
-                            "date": log_date,
-                            "type": log_type,
-                            "name": log_name,
-                            "value": log_value
-                        }
+        # Merged incrementally per Apex, so a scrape only downloads the mlog when a refresh is due.
+        latest_measurements = neptune_mlog.mlog_store.latest(self.fusion_apex_id, self.max_data_age,
+                                                             lambda days: self.get_measurement_log(days=days),
+                                                             self.mlog_entry_name)
         for latest_measurement_item, latest_measurement_item_dict in latest_measurements.items():
             log_entry_labels = [
                 'data_source="measurement_log"',
-                'name="{}"'.format(latest_measurement_item_dict["name"])
+                'name="{}"'.format(latest_measurement_item)
             ]
             combined_labels = base_label_values + log_entry_labels
             latest_measurement_item_value = latest_measurement_item_dict["value"]
-            metric_lines.append(self.prom_metric_string("measurement", combined_labels, float(latest_measurement_item_value)))
+            metric_samples.append(("measurement", combined_labels, float(latest_measurement_item_value)))
         # RETURN DATA
-        return "\n".join(metric_lines)
+        return metric_samples
+
+    def prometheus_exposition(self, exposition_format="text", metric_samples=None):
+        """
+        Generates Prometheus metrics for Fusion as encoded bytes.
+
+        Samples are grouped by metric family, as both exposition formats require.
+
+        Args:
+            exposition_format (str, optional): prometheus_metrics.TEXT_FORMAT or OPENMETRICS_FORMAT.
+            metric_samples (list, optional): metric_samples() output to render. Fetched when omitted.
+
+        Returns:
+            tuple: (metrics data as bytes, ETag string)
+        """
+        if metric_samples is None:
+            metric_samples = self.metric_samples()
+        metric_samples = prometheus_metrics.group_families(metric_samples)
+        sample_keys = [(metric_name, metric_labels) for metric_name, metric_labels, _ in metric_samples]
+        structure = (exposition_format, [(metric_name, tuple(metric_labels)) for metric_name, metric_labels in sample_keys])
+        return exposition_cache.render((str(self.fusion_apex_id), exposition_format),
+                                       structure,
+                                       [metric_value for _, _, metric_value in metric_samples],
+                                       lambda: prometheus_metrics.line_prefixes(sample_keys, exposition_format),
+                                       prometheus_metrics.exposition_suffix(exposition_format), exposition_format)
+
+    def prometheus_metrics(self):
+        """
+        Generates Prometheus metrics for Fusion.
+
+        Returns:
+            str: The metrics data in Prometheus format.
+        """
+        return self.prometheus_exposition()[0].decode()
 
 if __name__ == "__main__":
     pass
@@ -0,0 +1,504 @@
+"""
+Neptune History Store Module.
+
+An append-only, on-disk store for the Apex internal log (ilog) and the Fusion
+measurement log (mlog). Every series is two fixed-width column files that are
+memory-mapped for range queries:
+
+    <history_directory>/<source>/<target>/<series_id>/timestamps.i64  (epoch milliseconds)
+    <history_directory>/<source>/<target>/<series_id>/values.f64
+    <history_directory>/<source>/<target>/<series_id>/metadata.json
+"""
+import array
+import bisect
+import datetime
+import json
+import logging
+import math
+import mmap
+import os
+import re
+import threading
+import time
+
+application_logger = logging.getLogger('neptune_exporter')
+
+history_directory = os.path.join(os.path.dirname(__file__), '..', 'history')
+
+TIMESTAMPS_FILE = "timestamps.i64"
+VALUES_FILE = "values.f64"
+METADATA_FILE = "metadata.json"
+AGGREGATES = ["mean", "min", "max", "last"]
+
+
+def safe_name(name):
+    """
+    Makes a target or series name safe to use as a directory name.
+
+    Args:
+        name (str): The name.
+
+    Returns:
+        str: The name with anything but letters, digits, '.', '_' and '-' replaced by '_'.
+    """
+    return re.sub(r'[^A-Za-z0-9._-]', '_', str(name))
+
+
+def parse_log_timestamp(log_date):
+    """
+    Converts an ilog/mlog date to epoch milliseconds.
+
+    Args:
+        log_date (int, float or str): Epoch seconds (ilog) or an ISO 8601 UTC string (mlog).
+
+    Returns:
+        int: Epoch milliseconds.
+    """
+    if isinstance(log_date, (int, float)):
+        return int(log_date * 1000)
+    parsed = datetime.datetime.strptime(str(log_date), "%Y-%m-%dT%H:%M:%S.%fZ")
+    return int(parsed.replace(tzinfo=datetime.timezone.utc).timestamp() * 1000)
+
+
+class SeriesColumns:
+    """
+    Read-only memory-mapped view of a series' timestamp and value columns.
+    """
+    def __init__(self, series_path):
+        """
+        Args:
+            series_path (str): The series directory.
+        """
+        self.files = []
+        self.maps = []
+        self.timestamps = memoryview(b"").cast('q')
+        self.values = memoryview(b"").cast('d')
+        timestamp_size = self._size(os.path.join(series_path, TIMESTAMPS_FILE)) // 8
+        value_size = self._size(os.path.join(series_path, VALUES_FILE)) // 8
+        # An append interrupted between the two columns leaves one longer; ignore the tail.
+        self.length = min(timestamp_size, value_size)
+        if self.length > 0:
+            self.timestamps = self._map(os.path.join(series_path, TIMESTAMPS_FILE), 'q')[:self.length]
+            self.values = self._map(os.path.join(series_path, VALUES_FILE), 'd')[:self.length]
+
+    def _size(self, path):
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+
+    def _map(self, path, type_code):
+        column_file = open(path, 'rb')
+        column_map = mmap.mmap(column_file.fileno(), self.length * 8, access=mmap.ACCESS_READ)
+        self.files.append(column_file)
+        self.maps.append(column_map)
+        return memoryview(column_map).cast(type_code)
+
+    def index_range(self, start, end):
+        """
+        Finds the index range of samples with start <= timestamp <= end.
+
+        Args:
+            start (int): Epoch milliseconds.
+            end (int): Epoch milliseconds.
+
+        Returns:
+            tuple: (first index, last index + 1)
+        """
+        return bisect.bisect_left(self.timestamps, start), bisect.bisect_right(self.timestamps, end)
+
+    def close(self):
+        self.timestamps.release()
+        self.values.release()
+        for column_map in self.maps:
+            column_map.close()
+        for column_file in self.files:
+            column_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class HistoryStore:
+    """
+    Append-only store of (timestamp, value) series grouped by source and target.
+    """
+    def __init__(self, directory):
+        """
+        Args:
+            directory (str): The root directory of the store.
+        """
+        self.directory = directory
+        self.append_lock = threading.Lock()
+
+    def series_path(self, source, target, series_id):
+        return os.path.join(self.directory, safe_name(source), safe_name(target), safe_name(series_id))
+
+    def list_series(self, source, target):
+        """
+        Lists the series stored for a target.
+
+        Args:
+            source (str): "apex" or "fusion".
+            target (str): The Apex IP or Fusion ID.
+
+        Returns:
+            dict: series_id -> metadata.
+        """
+        target_path = os.path.join(self.directory, safe_name(source), safe_name(target))
+        series = {}
+        if not os.path.isdir(target_path):
+            return series
+        for series_id in sorted(os.listdir(target_path)):
+            metadata = self.metadata(source, target, series_id)
+            if metadata is not None:
+                series[series_id] = metadata
+        return series
+
+    def metadata(self, source, target, series_id):
+        """
+        Reads a series' metadata (metric name and labels).
+
+        Returns:
+            dict or None: The metadata, or None if the series does not exist.
+        """
+        try:
+            with open(os.path.join(self.series_path(source, target, series_id), METADATA_FILE), 'r') as metadata_file:
+                return json.load(metadata_file)
+        except (OSError, ValueError):
+            return None
+
+    def last_timestamp(self, source, target, series_id):
+        """
+        Returns the newest timestamp of a series in epoch milliseconds, or None if it is empty.
+        """
+        with SeriesColumns(self.series_path(source, target, series_id)) as columns:
+            if columns.length == 0:
+                return None
+            return columns.timestamps[columns.length - 1]
+
+    def time_range(self, source, target):
+        """
+        Returns the oldest and newest timestamps stored for a target, across all its series.
+
+        Args:
+            source (str): "apex" or "fusion".
+            target (str): The Apex IP or Fusion ID.
+
+        Returns:
+            tuple or None: (oldest, newest) epoch milliseconds, or None if nothing is stored.
+        """
+        oldest = None
+        newest = None
+        for series_id in self.list_series(source, target):
+            with SeriesColumns(self.series_path(source, target, series_id)) as columns:
+                if columns.length == 0:
+                    continue
+                first, last = columns.timestamps[0], columns.timestamps[columns.length - 1]
+            oldest = first if oldest is None else min(oldest, first)
+            newest = last if newest is None else max(newest, last)
+        if newest is None:
+            return None
+        return oldest, newest
+
+    def truncate_columns(self, series_path):
+        """
+        Cuts both columns back to the samples present in both.
+
+        An append interrupted between the two column writes, or inside one, leaves the
+        columns at different lengths. Appending after that would pair every new value with
+        the wrong timestamp, so the tail is dropped before the next write.
+
+        Args:
+            series_path (str): The series directory.
+        """
+        timestamps_path = os.path.join(series_path, TIMESTAMPS_FILE)
+        values_path = os.path.join(series_path, VALUES_FILE)
+        timestamp_size = os.path.getsize(timestamps_path) if os.path.exists(timestamps_path) else 0
+        value_size = os.path.getsize(values_path) if os.path.exists(values_path) else 0
+        length = min(timestamp_size, value_size) // 8
+        for column_path, column_size in ((timestamps_path, timestamp_size), (values_path, value_size)):
+            if column_size != length * 8:
+                application_logger.warning('History Column Truncated: {} {} -> {} bytes'.format(
+                    column_path, column_size, length * 8))
+                os.truncate(column_path, length * 8)
+
+    def append(self, source, target, series_id, metadata, points):
+        """
+        Appends the points newer than the series' last timestamp.
+
+        Args:
+            source (str): "apex" or "fusion".
+            target (str): The Apex IP or Fusion ID.
+            series_id (str): The series name within the target.
+            metadata (dict): The metric name and labels. Rewritten when it changes.
+            points (list): (epoch milliseconds, value) tuples in any order. Values that are not numbers are skipped.
+
+        Returns:
+            int: The number of points written.
+        """
+        series_path = self.series_path(source, target, series_id)
+        with self.append_lock:
+            os.makedirs(series_path, exist_ok=True)
+            if self.metadata(source, target, series_id) != metadata:
+                with open(os.path.join(series_path, METADATA_FILE), 'w') as metadata_file:
+                    json.dump(metadata, metadata_file, sort_keys=True)
+            self.truncate_columns(series_path)
+            last_timestamp = self.last_timestamp(source, target, series_id)
+            timestamps = array.array('q')
+            values = array.array('d')
+            for timestamp, value in sorted(points, key=lambda point: point[0]):
+                if last_timestamp is not None and timestamp <= last_timestamp:
+                    continue
+                # Firmware sends empty strings and nulls for unplugged probes. Skip them, keep the series.
+                try:
+                    value = float(value)
+                except (TypeError, ValueError):
+                    continue
+                timestamps.append(timestamp)
+                values.append(value)
+                last_timestamp = timestamp
+            if len(timestamps) == 0:
+                return 0
+            # Timestamps first: a reader only sees samples present in both columns, and an
+            # interrupted append is truncated away by the next one.
+            with open(os.path.join(series_path, TIMESTAMPS_FILE), 'ab') as timestamps_file:
+                timestamps.tofile(timestamps_file)
+            with open(os.path.join(series_path, VALUES_FILE), 'ab') as values_file:
+                values.tofile(values_file)
+            return len(timestamps)
+
+    def read_points(self, source, target, series_id, start, end):
+        """
+        Yields the raw points of a series between start and end, oldest first.
+
+        Args:
+            start (int): Epoch milliseconds.
+            end (int): Epoch milliseconds.
+
+        Yields:
+            tuple: (epoch milliseconds, value)
+        """
+        with SeriesColumns(self.series_path(source, target, series_id)) as columns:
+            first, last = columns.index_range(start, end)
+            for index in range(first, last):
+                yield columns.timestamps[index], columns.values[index]
+
+    def query(self, source, target, series_id, start, end, step=None, aggregate="mean"):
+        """
+        Reads a series between start and end, optionally downsampled into step-sized buckets.
+
+        Args:
+            start (int): Epoch milliseconds.
+            end (int): Epoch milliseconds.
+            step (int, optional): Bucket width in milliseconds. None returns raw points.
+            aggregate (str, optional): One of AGGREGATES. Defaults to "mean".
+
+        Returns:
+            list: [epoch milliseconds, value] pairs. Buckets are stamped with their start.
+        """
+        if aggregate not in AGGREGATES:
+            raise ValueError("Unknown aggregate: {}. Use one of: {}".format(aggregate, ", ".join(AGGREGATES)))
+        with SeriesColumns(self.series_path(source, target, series_id)) as columns:
+            first, last = columns.index_range(start, end)
+            timestamps = columns.timestamps[first:last]
+            values = columns.values[first:last]
+            if not step:
+                points = [[timestamps[index], values[index]] for index in range(len(timestamps))]
+                timestamps.release()
+                values.release()
+                return points
+            points = []
+            bucket_start = None
+            bucket_values = []
+            for index in range(len(timestamps)):
+                timestamp_bucket = start + ((timestamps[index] - start) // step) * step
+                if timestamp_bucket != bucket_start and bucket_values:
+                    points.append([bucket_start, aggregate_values(bucket_values, aggregate)])
+                    bucket_values = []
+                bucket_start = timestamp_bucket
+                bucket_values.append(values[index])
+            if bucket_values:
+                points.append([bucket_start, aggregate_values(bucket_values, aggregate)])
+            timestamps.release()
+            values.release()
+            return points
+
+
+def aggregate_values(values, aggregate):
+    """
+    Reduces the values of one downsampling bucket.
+
+    Args:
+        values (list): The bucket values.
+        aggregate (str): One of AGGREGATES.
+
+    Returns:
+        float: The reduced value.
+    """
+    if aggregate == "min":
+        return min(values)
+    if aggregate == "max":
+        return max(values)
+    if aggregate == "last":
+        return values[-1]
+    return sum(values) / len(values)
+
+
+def apex_ilog_series(ilog_payload):
+    """
+    Splits an Apex ilog payload into series, using the labels of APEX.prometheus_metrics().
+
+    Args:
+        ilog_payload (dict): The response of APEX.internal_log().
+
+    Returns:
+        dict: series_id -> (metadata, [(epoch milliseconds, value), ...])
+    """
+    ilog = ilog_payload.get("ilog", ilog_payload)
+    base_label_values = [
+        'apex_serial="{}"'.format(ilog.get("serial", "")),
+        'apex_hostname="{}"'.format(ilog.get("hostname", ""))
+    ]
+    series = {}
+    for record in ilog.get("record", []):
+        record_timestamp = parse_log_timestamp(record["date"])
+        for apex_input in record.get("data", []):
+            series_id = safe_name(apex_input["did"])
+            if series_id not in series:
+                input_label_values = [
+                    'input_did="{}"'.format(apex_input["did"]),
+                    'input_type="{}"'.format(apex_input["type"]),
+                    'input_name="{}"'.format(apex_input["name"])
+                ]
+                metadata = {
+                    "metric_name": "sensor_{}".format(str(apex_input["name"]).lower()),
+                    "labels": base_label_values + input_label_values
+                }
+                series[series_id] = (metadata, [])
+            series[series_id][1].append((record_timestamp, apex_input["value"]))
+    return series
+
+
+def fusion_mlog_series(mlog_payload, base_label_values, log_name_function):
+    """
+    Splits a Fusion mlog payload into series, using the labels of FUSION.prometheus_metrics().
+
+    Args:
+        mlog_payload (list): The response of FUSION.get_measurement_log().
+        base_label_values (list): The apex_id/apex_serial/apex_hostname labels.
+        log_name_function (callable): Maps an mlog entry to its measurement name.
+
+    Returns:
+        dict: series_id -> (metadata, [(epoch milliseconds, value), ...])
+    """
+    series = {}
+    for log_entry in mlog_payload:
+        log_name = log_name_function(log_entry)
+        if log_name is None:
+            continue
+        series_id = safe_name(log_name)
+        if series_id not in series:
+            metadata = {
+                "metric_name": "measurement",
+                "labels": base_label_values + ['data_source="measurement_log"', 'name="{}"'.format(log_name)]
+            }
+            series[series_id] = (metadata, [])
+        series[series_id][1].append((parse_log_timestamp(log_entry["date"]), log_entry["value"]))
+    return series
+
+
+def store_series(store, source, target, series):
+    """
+    Appends split series to the store.
+
+    Args:
+        store (HistoryStore): The store.
+        source (str): "apex" or "fusion".
+        target (str): The Apex IP or Fusion ID.
+        series (dict): series_id -> (metadata, points), from apex_ilog_series() or fusion_mlog_series().
+
+    Returns:
+        int: The number of points written.
+    """
+    appended = 0
+    for series_id, (metadata, points) in series.items():
+        appended += store.append(source, target, series_id, metadata, points)
+    return appended
+
+
+def sync_days(store, source, target, cold_start_days):
+    """
+    Computes the log window a sync requests.
+
+    A target with no stored history pulls cold_start_days. Otherwise the window reaches back to
+    the newest stored record plus a day, so syncs missed during an outage or a restart are
+    caught up instead of leaving a hole.
+
+    Args:
+        store (HistoryStore): The store.
+        source (str): "apex" or "fusion".
+        target (str): The Apex IP or Fusion ID.
+        cold_start_days (int): Days to pull the first time, and the largest window requested.
+
+    Returns:
+        int: The days parameter of the ilog / mlog request.
+    """
+    stored_range = store.time_range(source, target)
+    if stored_range is None:
+        return cold_start_days
+    missed_days = int(math.ceil(max(0.0, time.time() - stored_range[1] / 1000.0) / 86400)) + 1
+    return max(1, min(missed_days, int(cold_start_days)))
+
+
+def sync_apex(store, apex, cold_start_days=365):
+    """
+    Pulls new ilog records from an Apex into the store.
+
+    A target with no stored history pulls cold_start_days of ilog, afterwards the days since its newest record.
+
+    Args:
+        store (HistoryStore): The store.
+        apex (neptune_apex.APEX): The Apex to read from.
+        cold_start_days (int, optional): Days of ilog to pull the first time, and the most a catch-up pulls.
+            Defaults to 365.
+
+    Returns:
+        int: The number of points written.
+    """
+    days = sync_days(store, "apex", apex.apex_ip, cold_start_days)
+    ilog_payload = apex.internal_log(days=days)
+    if ilog_payload is None:
+        return 0
+    return store_series(store, "apex", apex.apex_ip, apex_ilog_series(ilog_payload))
+
+
+def sync_fusion(store, fusion, cold_start_days=365):
+    """
+    Pulls new mlog entries from Fusion into the store.
+
+    Args:
+        store (HistoryStore): The store.
+        fusion (neptune_fusion.FUSION): The Fusion session to read from.
+        cold_start_days (int, optional): Days of mlog to pull the first time, and the most a catch-up pulls.
+            Defaults to 365.
+
+    Returns:
+        int: The number of points written.
+    """
+    days = sync_days(store, "fusion", fusion.fusion_apex_id, cold_start_days)
+    fusion_status = fusion.get_status()[0]
+    base_label_values = [
+        'apex_id="{}"'.format(fusion_status["_id"]),
+        'apex_serial="{}"'.format(fusion_status["serial"]),
+        'apex_hostname="{}"'.format(fusion_status["hostname"])
+    ]
+    series = fusion_mlog_series(fusion.get_measurement_log(days=days), base_label_values, fusion.mlog_entry_name)
+    return store_series(store, "fusion", fusion.fusion_apex_id, series)
+
+
+if __name__ == "__main__":
+    pass
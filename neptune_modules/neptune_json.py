@@ -0,0 +1,76 @@
+"""
+Neptune Exporter JSON Codec Module.
+
+One JSON layer for the Apex REST responses, the Fusion pages and the export files.
+orjson is used when it is installed, otherwise the standard library. Both accept
+bytes and return bytes. orjson decodes straight from the bytes; the standard library
+decodes them to a str first and encodes through a str.
+
+Export files are the same on both paths (sorted keys, 2-space indent), except for NaN
+and infinities: orjson writes null, the standard library writes NaN / Infinity.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Name of the active implementation, shown by benchmarks/bench_json.py.
+backend = "orjson" if orjson is not None else "json"
+
+
+def loads(data):
+    """
+    Decodes JSON.
+
+    Args:
+        data (bytes or str): The JSON document. Pass bytes (ex: response.content) to skip a text copy with orjson.
+
+    Returns:
+        object: The decoded document.
+
+    Raises:
+        ValueError: If the document is not valid JSON.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(data, pretty=False):
+    """
+    Encodes JSON as UTF-8 bytes with sorted keys.
+
+    Args:
+        data (object): The document.
+        pretty (bool, optional): Indent by 2 spaces for reading, the only width orjson offers. Defaults to False (compact).
+
+    Returns:
+        bytes: The encoded document.
+    """
+    if orjson is not None:
+        options = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+        if pretty:
+            options |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, option=options)
+    if pretty:
+        return json.dumps(data, indent=2, sort_keys=True).encode()
+    return json.dumps(data, separators=(",", ":"), sort_keys=True).encode()
+
+
+def dump_file(data, file_path, compact=False):
+    """
+    Writes an export file.
+
+    Args:
+        data (object): The document.
+        file_path (str): The output file.
+        compact (bool, optional): Write without indentation. Smaller and faster for large logs. Defaults to False.
+    """
+    with open(file_path, 'wb') as data_file:
+        data_file.write(dumps(data, pretty=not compact))
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,275 @@
+"""
+Neptune Exporter Log Export Module.
+"""
+import datetime
+import glob
+import logging
+import os
+import re
+import zlib
+
+log_directory = os.path.join(os.path.dirname(__file__), '..', 'logs')
+
+# Logger name -> log file written by that logger's setup_logger() call.
+LOG_FILES = {
+    "neptune_exporter": "exporter.log",
+    "neptune_apex": "apex.log",
+    "neptune_fusion": "neptune.log"
+}
+
+# Matches the '%(asctime)s %(levelname)s ' prefix written by setup_logger().
+RECORD_PATTERN = re.compile(rb'^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}),\d{3} ([A-Z]+) ')
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def parse_record_header(line):
+    """
+    Parses the timestamp and level from the start of a log line.
+
+    Args:
+        line (bytes): A raw line from a log file.
+
+    Returns:
+        tuple or None: (datetime.datetime, str) for the first line of a record,
+        None for continuation lines (tracebacks, multi-line messages).
+    """
+    match = RECORD_PATTERN.match(line)
+    if match is None:
+        return None
+    try:
+        timestamp = datetime.datetime.strptime(match.group(1).decode(), TIMESTAMP_FORMAT)
+    except ValueError:
+        return None
+    return timestamp, match.group(2).decode()
+
+
+def parse_time(value, default=None):
+    """
+    Parses a time range bound given as an ISO 8601 string or epoch seconds.
+
+    Args:
+        value (str): The value to parse. Empty or None returns the default.
+        default (datetime.datetime, optional): Value used when none is given.
+
+    Returns:
+        datetime.datetime: Naive local time, matching the log file timestamps.
+    """
+    if value is None or str(value).strip() == "":
+        return default
+    value = str(value).strip()
+    try:
+        return datetime.datetime.fromtimestamp(float(value))
+    except ValueError:
+        pass
+    parsed = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
+
+
+class LogSegment:
+    """
+    A single log file (current or rotated) with a timestamp seek index.
+    """
+    def __init__(self, path):
+        """
+        Reads the time boundaries of a log file.
+
+        Args:
+            path (str): The path to the log file.
+        """
+        self.path = path
+        self.size = os.path.getsize(path)
+        self.first_timestamp = None
+        self.last_timestamp = None
+        if self.size > 0:
+            with open(path, 'rb') as log_file:
+                first = self._record_at(log_file, 0)
+                if first is not None:
+                    self.first_timestamp = first[1]
+                self.last_timestamp = self._last_record_timestamp(log_file)
+
+    def _record_at(self, log_file, offset):
+        """
+        Finds the first record starting at or after a byte offset.
+
+        Args:
+            log_file (file): The log file opened in binary mode.
+            offset (int): The byte offset to start looking from.
+
+        Returns:
+            tuple or None: (record offset, record timestamp) or None past the last record.
+        """
+        log_file.seek(offset)
+        if offset > 0:
+            # Discard the partial line we landed in.
+            offset += len(log_file.readline())
+        while offset < self.size:
+            line = log_file.readline()
+            if not line:
+                return None
+            header = parse_record_header(line)
+            if header is not None:
+                return offset, header[0]
+            offset += len(line)
+        return None
+
+    def _last_record_timestamp(self, log_file):
+        """
+        Reads backwards from the end of the file to find the last record timestamp.
+
+        Args:
+            log_file (file): The log file opened in binary mode.
+
+        Returns:
+            datetime.datetime or None: The timestamp of the last record.
+        """
+        position = self.size
+        while position > 0:
+            position = max(0, position - READ_CHUNK_SIZE)
+            log_file.seek(position)
+            lines = log_file.read(READ_CHUNK_SIZE).split(b"\n")
+            if position > 0:
+                lines = lines[1:]
+            for line in reversed(lines):
+                header = parse_record_header(line)
+                if header is not None:
+                    return header[0]
+        return None
+
+    def overlaps(self, start, end):
+        """
+        Checks if any record in this segment can fall inside [start, end].
+
+        Args:
+            start (datetime.datetime): The start of the range.
+            end (datetime.datetime): The end of the range.
+
+        Returns:
+            bool: True if the segment needs to be read.
+        """
+        if self.first_timestamp is None or self.last_timestamp is None:
+            return False
+        return self.first_timestamp <= end and self.last_timestamp >= start
+
+    def offset_for(self, timestamp):
+        """
+        Binary searches the file for the first record at or after a timestamp.
+
+        Args:
+            timestamp (datetime.datetime): The timestamp to seek to.
+
+        Returns:
+            int: The byte offset to start reading from.
+        """
+        if self.first_timestamp is None or timestamp <= self.first_timestamp:
+            return 0
+        low = 0
+        high = self.size
+        with open(self.path, 'rb') as log_file:
+            while high - low > READ_CHUNK_SIZE:
+                middle = (low + high) // 2
+                record = self._record_at(log_file, middle)
+                if record is None or record[1] >= timestamp:
+                    high = middle
+                else:
+                    low = record[0]
+        return low
+
+    def read_records(self, start, end):
+        """
+        Yields whole records (including continuation lines) between start and end.
+
+        Args:
+            start (datetime.datetime): The start of the range.
+            end (datetime.datetime): The end of the range.
+
+        Yields:
+            tuple: (timestamp, level, record bytes)
+        """
+        record_lines = []
+        record_header = None
+        with open(self.path, 'rb') as log_file:
+            log_file.seek(self.offset_for(start))
+            for line in log_file:
+                header = parse_record_header(line)
+                if header is None:
+                    if record_header is not None:
+                        record_lines.append(line)
+                    continue
+                if record_header is not None:
+                    yield record_header[0], record_header[1], b"".join(record_lines)
+                if header[0] > end:
+                    return
+                record_lines = [line]
+                record_header = header if header[0] >= start else None
+        if record_header is not None:
+            yield record_header[0], record_header[1], b"".join(record_lines)
+
+
+def log_segments(logger_name):
+    """
+    Lists the current and rotated log files of a logger, oldest first.
+
+    Args:
+        logger_name (str): The logger name, one of LOG_FILES.
+
+    Returns:
+        list: LogSegment objects ordered by their first timestamp.
+    """
+    base_path = os.path.join(log_directory, LOG_FILES[logger_name])
+    paths = [path for path in glob.glob(glob.escape(base_path) + "*")
+             if path == base_path or path[len(base_path)] == "."]
+    segments = [LogSegment(path) for path in paths if not path.endswith(".gz")]
+    segments = [segment for segment in segments if segment.first_timestamp is not None]
+    return sorted(segments, key=lambda segment: segment.first_timestamp)
+
+
+def export_log_range(logger_name, start, end, level="DEBUG", compress=False):
+    """
+    Streams the records of a logger that fall inside a time range.
+
+    Only the segments overlapping the range are opened, and each one is entered
+    at the byte offset found by LogSegment.offset_for().
+
+    Args:
+        logger_name (str): The logger name, one of LOG_FILES.
+        start (datetime.datetime): The start of the range.
+        end (datetime.datetime): The end of the range.
+        level (str, optional): The minimum level to include. Defaults to "DEBUG".
+        compress (bool, optional): Gzip the stream. Defaults to False.
+
+    Yields:
+        bytes: Chunks of log text, or of gzip data when compress is True.
+    """
+    minimum_level = logging.getLevelName(str(level).upper())
+    if not isinstance(minimum_level, int):
+        raise ValueError("Unknown log level: {}".format(level))
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+
+    buffer = []
+    buffer_size = 0
+    for segment in log_segments(logger_name):
+        if not segment.overlaps(start, end):
+            continue
+        for record_timestamp, record_level, record in segment.read_records(start, end):
+            record_level_number = logging.getLevelName(record_level)
+            if isinstance(record_level_number, int) and record_level_number < minimum_level:
+                continue
+            buffer.append(record)
+            buffer_size += len(record)
+            if buffer_size >= READ_CHUNK_SIZE:
+                chunk = b"".join(buffer)
+                buffer = []
+                buffer_size = 0
+                yield compressor.compress(chunk) if compressor else chunk
+    chunk = b"".join(buffer)
+    if compressor:
+        yield compressor.compress(chunk) + compressor.flush()
+    elif chunk:
+        yield chunk
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,231 @@
+"""
+Neptune Fusion Measurement Log Cache Module.
+
+Test-kit entries (alkalinity, calcium, ...) reach the Fusion measurement log (mlog) a
+few times a day, so consecutive /metrics/fusion scrapes almost always download the
+same entries. Every Fusion Apex keeps its merged mlog state here instead: the latest
+entry per measurement name, plus the (date, id) keys of recent entries so a refresh
+only merges entries it has not seen.
+
+The first load of an Apex (a cold start) requests enough days to cover data_max_age.
+Later refreshes request the narrowest window Fusion offers (days=1) and at most once
+per refresh_interval. Entries deleted or edited in Fusion after they were merged are
+not picked up until the Apex's state is dropped (its browser session is closed).
+"""
+import datetime
+import math
+import threading
+import time
+
+DEFAULT_SETTINGS = {
+    "enabled": True,
+    "refresh_interval": 60
+}
+
+# Narrowest mlog window Fusion serves. Used by every refresh after the cold start.
+REFRESH_DAYS = 1
+
+
+def entry_timestamp(log_date):
+    """
+    Converts an mlog date to epoch seconds.
+
+    Args:
+        log_date (str): ISO 8601 UTC date. Ex: 2024-08-19T04:20:38.184Z
+
+    Returns:
+        float: Epoch seconds.
+    """
+    parsed = datetime.datetime.strptime(str(log_date), "%Y-%m-%dT%H:%M:%S.%fZ")
+    return parsed.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+def window_days(data_max_age):
+    """
+    Args:
+        data_max_age (int): Seconds of data a scrape exports.
+
+    Returns:
+        int: The mlog days parameter that covers data_max_age.
+    """
+    return max(REFRESH_DAYS, int(math.ceil(float(data_max_age) / 86400)))
+
+
+class MeasurementLog:
+    """
+    Merged mlog state of one Fusion Apex.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (date, id) -> epoch seconds of the entries still inside the refresh window.
+        self.seen = {}
+        # measurement name -> (epoch seconds, entry)
+        self.latest = {}
+        self.covered_days = 0
+        self.refreshed = None
+
+    def merge(self, log_entries, log_name_function):
+        """
+        Merges the entries not seen before and updates the latest entry per name.
+
+        Args:
+            log_entries (list): mlog entries, as returned by FUSION.get_measurement_log().
+            log_name_function (callable): Maps an entry to its measurement name, or None to skip it.
+
+        Returns:
+            int: The number of new entries.
+        """
+        merged = 0
+        for log_entry in log_entries:
+            key = (log_entry["date"], log_entry.get("_id"))
+            if key in self.seen:
+                continue
+            timestamp = entry_timestamp(log_entry["date"])
+            self.seen[key] = timestamp
+            merged += 1
+            log_name = log_name_function(log_entry)
+            if log_name is None:
+                continue
+            current = self.latest.get(log_name)
+            if current is None or current[0] < timestamp:
+                self.latest[log_name] = (timestamp, log_entry)
+        return merged
+
+    def prune(self, oldest):
+        """
+        Forgets the keys of entries a refresh window can no longer return.
+
+        Args:
+            oldest (float): Epoch seconds. Keys of older entries are dropped.
+        """
+        self.seen = {key: timestamp for key, timestamp in self.seen.items() if timestamp >= oldest}
+
+    def latest_since(self, oldest):
+        """
+        Args:
+            oldest (float): Epoch seconds. Older measurements are left out.
+
+        Returns:
+            dict: measurement name -> latest mlog entry newer than oldest.
+        """
+        return {log_name: log_entry for log_name, (timestamp, log_entry) in self.latest.items() if timestamp > oldest}
+
+
+class MeasurementLogStore:
+    """
+    The merged mlog state of every Fusion Apex, configured from the mlog_cache section of exporter.yml.
+    """
+    def __init__(self, settings=None):
+        """
+        Args:
+            settings (dict, optional): Overrides of DEFAULT_SETTINGS.
+        """
+        self.logs = {}
+        self.logs_lock = threading.Lock()
+        self.cold_starts = 0
+        self.refreshes = 0
+        self.merged_entries = 0
+        self.configure(settings)
+
+    def configure(self, settings):
+        """
+        Applies new settings and drops every Apex's state.
+
+        Args:
+            settings (dict): Overrides of DEFAULT_SETTINGS.
+        """
+        merged = dict(DEFAULT_SETTINGS)
+        merged.update({key: value for key, value in (settings or {}).items() if value is not None})
+        with self.logs_lock:
+            self.settings = merged
+            self.logs = {}
+
+    def log(self, fusion_apex_id):
+        with self.logs_lock:
+            measurement_log = self.logs.get(str(fusion_apex_id))
+            if measurement_log is None:
+                measurement_log = self.logs[str(fusion_apex_id)] = MeasurementLog()
+            return measurement_log
+
+    def forget(self, fusion_apex_id):
+        """
+        Drops an Apex's state. Its next load is a cold start.
+
+        Args:
+            fusion_apex_id (str): The ID of the Fusion Apex system.
+        """
+        with self.logs_lock:
+            self.logs.pop(str(fusion_apex_id), None)
+
+    def latest(self, fusion_apex_id, data_max_age, fetch_function, log_name_function):
+        """
+        Returns the latest entry per measurement name, refreshing the Apex's state when it is due.
+
+        Args:
+            fusion_apex_id (str): The ID of the Fusion Apex system.
+            data_max_age (int): Seconds. Older measurements are left out.
+            fetch_function (callable): Takes the mlog days parameter and returns the mlog entries.
+            log_name_function (callable): Maps an entry to its measurement name, or None to skip it.
+
+        Returns:
+            dict: measurement name -> latest mlog entry newer than data_max_age.
+        """
+        oldest = time.time() - float(data_max_age)
+        needed_days = window_days(data_max_age)
+        if not self.settings["enabled"]:
+            measurement_log = MeasurementLog()
+            measurement_log.merge(fetch_function(needed_days) or [], log_name_function)
+            return measurement_log.latest_since(oldest)
+        measurement_log = self.log(fusion_apex_id)
+        with measurement_log.lock:
+            now = time.monotonic()
+            cold_start = measurement_log.covered_days < needed_days
+            if cold_start:
+                # First load, or a scrape asking for more history than was loaded so far.
+                days = needed_days
+            elif measurement_log.refreshed is None or now - measurement_log.refreshed >= float(self.settings["refresh_interval"]):
+                days = REFRESH_DAYS
+            else:
+                return measurement_log.latest_since(oldest)
+            log_entries = fetch_function(days)
+            if log_entries is not None:
+                merged = measurement_log.merge(log_entries, log_name_function)
+                # days=1 never returns entries older than two days, whatever the Apex timezone.
+                measurement_log.prune(time.time() - (REFRESH_DAYS + 1) * 86400)
+                measurement_log.covered_days = max(measurement_log.covered_days, days)
+                measurement_log.refreshed = now
+                with self.logs_lock:
+                    if cold_start:
+                        self.cold_starts += 1
+                    else:
+                        self.refreshes += 1
+                    self.merged_entries += merged
+            return measurement_log.latest_since(oldest)
+
+    def exposition(self):
+        """
+        Renders the cold start / refresh counters and the number of Apex systems tracked.
+
+        Returns:
+            str: Prometheus text exposition.
+        """
+        with self.logs_lock:
+            metrics = [
+                ("neptune_exporter_mlog_cache_apex_systems", "gauge", "Fusion Apex systems with a merged mlog.", len(self.logs)),
+                ("neptune_exporter_mlog_cache_cold_starts_total", "counter", "mlog loads covering the full data_max_age window.",
+                 self.cold_starts),
+                ("neptune_exporter_mlog_cache_refreshes_total", "counter", "Incremental mlog refreshes.", self.refreshes),
+                ("neptune_exporter_mlog_cache_merged_entries_total", "counter", "New mlog entries merged.", self.merged_entries)
+            ]
+        lines = []
+        for metric_name, metric_type, metric_help, metric_value in metrics:
+            lines += ["# HELP {} {}".format(metric_name, metric_help), "# TYPE {} {}".format(metric_name, metric_type),
+                      "{} {}".format(metric_name, metric_value)]
+        return "\n".join(lines) + "\n"
+
+
+mlog_store = MeasurementLogStore()
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,145 @@
+"""
+Neptune Exporter Profiling Module.
+
+On-demand diagnosis of slow scrapes in production. Nothing here runs until a profile
+is requested: the CPU profiler is a sampling thread that only exists for the length of
+the window, and tracemalloc is started and stopped around the memory window.
+"""
+import collections
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+
+def frame_name(frame):
+    """
+    Names a stack frame for collapsed-stack output.
+
+    Args:
+        frame (frame): The frame.
+
+    Returns:
+        str: Ex: "neptune_apex.py:status"
+    """
+    code = frame.f_code
+    return "{}:{}".format(os.path.basename(code.co_filename), code.co_name)
+
+
+class SamplingProfiler:
+    """
+    Samples the Python stacks of every thread on a fixed interval and counts them.
+
+    Only samples whose stack passes through one of the watched code objects (the route
+    handlers being diagnosed) are kept, so idle threads and other routes do not dilute the profile.
+    """
+    def __init__(self, interval=0.005, watched_code=None):
+        """
+        Args:
+            interval (float, optional): Seconds between samples. Defaults to 5 ms.
+            watched_code (set, optional): Code objects a stack must contain. None keeps every stack.
+        """
+        self.interval = interval
+        self.watched_code = watched_code
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def sample(self):
+        profiler_thread_id = threading.get_ident()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == profiler_thread_id:
+                continue
+            stack = []
+            watched = self.watched_code is None
+            while frame is not None:
+                stack.append(frame_name(frame))
+                if not watched and frame.f_code in self.watched_code:
+                    watched = True
+                frame = frame.f_back
+            if watched:
+                self.stacks[";".join(reversed(stack))] += 1
+        self.samples += 1
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="profiler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def collapsed(self):
+        """
+        Returns:
+            str: One "frame;frame;frame count" line per stack, root first, as read by flamegraph.pl and speedscope.
+        """
+        return "".join("{} {}\n".format(stack, count) for stack, count in self.stacks.most_common())
+
+
+def start_memory_trace(frames=16):
+    """
+    Starts tracemalloc for a memory window.
+
+    Args:
+        frames (int, optional): Traceback depth stored per allocation. Defaults to 16.
+    """
+    tracemalloc.start(frames)
+
+
+def stop_memory_trace(top=25, window_seconds=None):
+    """
+    Takes the tracemalloc snapshot of the window, stops tracing and formats the largest allocations.
+
+    Args:
+        top (int, optional): Allocation sites listed. Defaults to 25.
+        window_seconds (float, optional): Window length, shown in the header.
+
+    Returns:
+        str: The top allocations report, grouped by line, with each site's traceback.
+    """
+    snapshot = tracemalloc.take_snapshot()
+    current_size, peak_size = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__),
+                                       tracemalloc.Filter(False, "<frozen importlib._bootstrap>")])
+    statistics = snapshot.statistics("traceback")
+    report = ["Allocations made during the {}window and still alive at its end.".format(
+                  "{:.0f}s ".format(window_seconds) if window_seconds else ""),
+              "Traced now: {:.1f} KiB  Peak: {:.1f} KiB".format(current_size / 1024, peak_size / 1024),
+              ""]
+    for rank, statistic in enumerate(statistics[:top], 1):
+        report.append("#{} {:.1f} KiB in {} blocks".format(rank, statistic.size / 1024, statistic.count))
+        report += ["    " + line for line in statistic.traceback.format(most_recent_first=True)[:12]]
+    return "\n".join(report) + "\n"
+
+
+def memory_tracing():
+    """
+    Returns:
+        bool: True if tracemalloc is already running (started by -X tracemalloc or another window).
+    """
+    return tracemalloc.is_tracing()
+
+
+def profile_filename(kind):
+    """
+    Args:
+        kind (str): "cpu" or "memory".
+
+    Returns:
+        str: The download file name.
+    """
+    extension = "collapsed" if kind == "cpu" else "txt"
+    return "neptune_exporter-{}.{}.{}".format(kind, time.strftime("%Y%m%d-%H%M%S"), extension)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,476 @@
+"""
+Neptune Prometheus Remote-Write Module.
+
+Push mode: collects samples on the exporter's own schedule and delivers them to a
+Prometheus remote-write endpoint as snappy-compressed protobuf WriteRequests.
+Every batch is written to a bounded on-disk WAL before it is sent, and is only
+removed once the endpoint accepted it (or rejected it as invalid).
+"""
+import logging
+import os
+import struct
+import threading
+import time
+import requests
+
+application_logger = logging.getLogger('neptune_exporter')
+
+wal_directory = os.path.join(os.path.dirname(__file__), '..', 'wal')
+
+try:
+    import snappy as snappy_library
+except ImportError:
+    snappy_library = None
+try:
+    import cramjam
+except ImportError:
+    cramjam = None
+
+
+def encode_varint(value):
+    """
+    Encodes an unsigned integer as a protobuf / snappy varint.
+
+    Args:
+        value (int): The value. Negative int64 values are encoded as 10-byte two's complement.
+
+    Returns:
+        bytes: The varint.
+    """
+    if value < 0:
+        value += 1 << 64
+    encoded = bytearray()
+    while value > 0x7f:
+        encoded.append((value & 0x7f) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def decode_varint(data, position):
+    """
+    Decodes a varint.
+
+    Args:
+        data (bytes): The buffer.
+        position (int): Where the varint starts.
+
+    Returns:
+        tuple: (value, position after the varint)
+    """
+    value = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+
+def length_delimited(field_number, payload):
+    return encode_varint((field_number << 3) | 2) + encode_varint(len(payload)) + payload
+
+
+def encode_write_request(series):
+    """
+    Encodes samples as a prometheus.WriteRequest protobuf message.
+
+    Args:
+        series (list): (labels dict including __name__, [(epoch milliseconds, value), ...]) tuples.
+
+    Returns:
+        bytes: The serialized WriteRequest.
+    """
+    message = bytearray()
+    for labels, samples in series:
+        time_series = bytearray()
+        for label_name in sorted(labels):
+            label = length_delimited(1, str(label_name).encode()) + length_delimited(2, str(labels[label_name]).encode())
+            time_series += length_delimited(1, label)
+        for timestamp, value in samples:
+            sample = b"\x09" + struct.pack("<d", float(value)) + b"\x10" + encode_varint(int(timestamp))
+            time_series += length_delimited(2, sample)
+        message += length_delimited(1, bytes(time_series))
+    return bytes(message)
+
+
+def decode_write_request(data):
+    """
+    Decodes a prometheus.WriteRequest. Used by the local stand-in receiver in tests.
+
+    Args:
+        data (bytes): The serialized WriteRequest.
+
+    Returns:
+        list: (labels dict, [(epoch milliseconds, value), ...]) tuples.
+    """
+    def fields(buffer):
+        position = 0
+        while position < len(buffer):
+            key, position = decode_varint(buffer, position)
+            wire_type = key & 7
+            if wire_type == 2:
+                length, position = decode_varint(buffer, position)
+                yield key >> 3, buffer[position:position + length]
+                position += length
+            elif wire_type == 1:
+                yield key >> 3, buffer[position:position + 8]
+                position += 8
+            else:
+                value, position = decode_varint(buffer, position)
+                yield key >> 3, value
+
+    series = []
+    for _, time_series in fields(data):
+        labels = {}
+        samples = []
+        for field_number, field_value in fields(time_series):
+            if field_number == 1:
+                label = dict(fields(field_value))
+                labels[label[1].decode()] = label.get(2, b"").decode()
+            elif field_number == 2:
+                sample = dict(fields(field_value))
+                timestamp = sample.get(2, 0)
+                if timestamp >= 1 << 63:
+                    timestamp -= 1 << 64
+                samples.append((timestamp, struct.unpack("<d", sample.get(1, b"\x00" * 8))[0]))
+        series.append((labels, samples))
+    return series
+
+
+def snappy_compress(data):
+    """
+    Compresses data in the snappy block format used by remote write.
+
+    Uses python-snappy or cramjam when installed. Otherwise falls back to a small
+    pure-Python encoder (hash-chained literal/copy matching), which is slower but
+    produces valid snappy blocks.
+
+    Args:
+        data (bytes): The uncompressed data.
+
+    Returns:
+        bytes: The snappy block.
+    """
+    if snappy_library is not None:
+        return snappy_library.compress(data)
+    if cramjam is not None:
+        return bytes(cramjam.snappy.compress_raw(data))
+
+    data = bytes(data)
+    output = bytearray(encode_varint(len(data)))
+
+    def emit_literal(literal):
+        for chunk_start in range(0, len(literal), 65536):
+            chunk = literal[chunk_start:chunk_start + 65536]
+            length = len(chunk) - 1
+            if length < 60:
+                output.append(length << 2)
+            elif length < 256:
+                output.append(60 << 2)
+                output.append(length)
+            else:
+                output.append(61 << 2)
+                output.extend(struct.pack("<H", length))
+            output.extend(chunk)
+
+    table = {}
+    position = 0
+    literal_start = 0
+    data_length = len(data)
+    while position + 4 <= data_length:
+        key = data[position:position + 4]
+        candidate = table.get(key)
+        table[key] = position
+        if candidate is None or position - candidate > 65535:
+            position += 1
+            continue
+        match_length = 4
+        while position + match_length < data_length and data[candidate + match_length] == data[position + match_length]:
+            match_length += 1
+        if literal_start < position:
+            emit_literal(data[literal_start:position])
+        offset = position - candidate
+        remaining = match_length
+        while remaining > 0:
+            copy_length = min(remaining, 64)
+            output.append(((copy_length - 1) << 2) | 2)
+            output += struct.pack("<H", offset)
+            remaining -= copy_length
+        position += match_length
+        literal_start = position
+    if literal_start < data_length:
+        emit_literal(data[literal_start:])
+    return bytes(output)
+
+
+def snappy_decompress(data):
+    """
+    Decompresses a snappy block. Used by the local stand-in receiver in tests.
+
+    Args:
+        data (bytes): The snappy block.
+
+    Returns:
+        bytes: The uncompressed data.
+    """
+    if snappy_library is not None:
+        return snappy_library.uncompress(data)
+    if cramjam is not None:
+        return bytes(cramjam.snappy.decompress_raw(data))
+
+    expected_length, position = decode_varint(data, 0)
+    output = bytearray()
+    while position < len(data):
+        tag = data[position]
+        position += 1
+        element_type = tag & 3
+        if element_type == 0:
+            length = tag >> 2
+            if length >= 60:
+                extra_bytes = length - 59
+                length = int.from_bytes(data[position:position + extra_bytes], "little")
+                position += extra_bytes
+            length += 1
+            output += data[position:position + length]
+            position += length
+            continue
+        if element_type == 1:
+            length = ((tag >> 2) & 7) + 4
+            offset = ((tag >> 5) << 8) | data[position]
+            position += 1
+        elif element_type == 2:
+            length = (tag >> 2) + 1
+            offset = struct.unpack("<H", data[position:position + 2])[0]
+            position += 2
+        else:
+            length = (tag >> 2) + 1
+            offset = struct.unpack("<I", data[position:position + 4])[0]
+            position += 4
+        for _ in range(length):
+            output.append(output[-offset])
+    if len(output) != expected_length:
+        raise ValueError("Corrupt snappy block")
+    return bytes(output)
+
+
+def parse_labels(metric_labels):
+    """
+    Converts exposition label strings ('name="value"') to a dict.
+
+    Args:
+        metric_labels (list): The label strings.
+
+    Returns:
+        dict: label name -> value.
+    """
+    labels = {}
+    for metric_label in metric_labels:
+        label_name, label_value = metric_label.split("=", 1)
+        labels[label_name.strip()] = label_value.strip()[1:-1]
+    return labels
+
+
+def samples_to_series(metric_samples, timestamp, extra_labels=None):
+    """
+    Converts (metric_name, metric_labels, metric_value) samples to remote-write series.
+
+    Metric names get the same apex_ prefix as the exposition output. Samples whose value
+    is not numeric are skipped.
+
+    Args:
+        metric_samples (list): (metric_name, metric_labels, metric_value) tuples.
+        timestamp (int): The collection time in epoch milliseconds.
+        extra_labels (dict, optional): Added to every series, e.g. job and instance.
+
+    Returns:
+        list: (labels dict, [(epoch milliseconds, value)]) tuples.
+    """
+    series = []
+    for metric_name, metric_labels, metric_value in metric_samples:
+        try:
+            value = float(metric_value)
+        except (TypeError, ValueError):
+            continue
+        labels = parse_labels(metric_labels)
+        labels.update(extra_labels or {})
+        labels["__name__"] = "apex_{}".format(str(metric_name).lower())
+        series.append((labels, [(timestamp, value)]))
+    return series
+
+
+class WriteAheadLog:
+    """
+    Bounded directory of pending remote-write batches, one file per batch, oldest first.
+    """
+    def __init__(self, directory, max_bytes):
+        """
+        Args:
+            directory (str): The WAL directory.
+            max_bytes (int): Oldest batches are dropped once the WAL is larger than this.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def batches(self):
+        """
+        Returns:
+            list: Paths of the pending batches, oldest first.
+        """
+        return sorted(os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                      if name.endswith(".snappy"))
+
+    def append(self, payload):
+        """
+        Durably writes a compressed batch, then trims the WAL to max_bytes.
+
+        Args:
+            payload (bytes): The snappy-compressed WriteRequest.
+        """
+        with self.lock:
+            file_path = os.path.join(self.directory, "{:020d}.snappy".format(time.time_ns()))
+            with open(file_path + ".tmp", 'wb') as batch_file:
+                batch_file.write(payload)
+                batch_file.flush()
+                os.fsync(batch_file.fileno())
+            os.replace(file_path + ".tmp", file_path)
+
+            batches = self.batches()
+            total_bytes = sum(os.path.getsize(batch) for batch in batches)
+            while total_bytes > self.max_bytes and len(batches) > 1:
+                oldest = batches.pop(0)
+                total_bytes -= os.path.getsize(oldest)
+                os.remove(oldest)
+                application_logger.warning('Remote Write WAL Full. Dropped Batch: {}'.format(os.path.basename(oldest)))
+
+
+class RemoteWriter:
+    """
+    Collects samples on a fixed interval and pushes them to a remote-write endpoint.
+    """
+    def __init__(self, url, collect_function, interval=60, wal=None, timeout=30,
+                 min_backoff=1, max_backoff=300, headers=None):
+        """
+        Args:
+            url (str): The remote-write URL. Ex: http://prometheus:9090/api/v1/write
+            collect_function (callable): Returns (labels dict, [(epoch ms, value)]) series.
+            interval (int, optional): Seconds between collections. Defaults to 60.
+            wal (WriteAheadLog, optional): Where batches wait for delivery.
+            timeout (int, optional): HTTP timeout in seconds. Defaults to 30.
+            min_backoff (float, optional): First retry delay in seconds. Defaults to 1.
+            max_backoff (float, optional): Largest retry delay in seconds. Defaults to 300.
+            headers (dict, optional): Extra HTTP headers, e.g. Authorization.
+        """
+        self.url = url
+        self.collect_function = collect_function
+        self.interval = interval
+        self.wal = wal or WriteAheadLog(wal_directory, 64 * 1024 * 1024)
+        self.timeout = timeout
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.backoff = 0
+        self.retry_at = 0
+        self.headers = {
+            "Content-Encoding": "snappy",
+            "Content-Type": "application/x-protobuf",
+            "User-Agent": "neptune-exporter",
+            "X-Prometheus-Remote-Write-Version": "0.1.0"
+        }
+        self.headers.update(headers or {})
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def collect(self):
+        """
+        Collects one round of samples and writes it to the WAL.
+
+        Returns:
+            int: The number of series collected.
+        """
+        series = self.collect_function()
+        if series:
+            self.wal.append(snappy_compress(encode_write_request(series)))
+        return len(series)
+
+    def send(self, payload):
+        """
+        Sends one compressed batch.
+
+        Args:
+            payload (bytes): The snappy-compressed WriteRequest.
+
+        Returns:
+            str: "sent", "rejected" (4xx, will never succeed) or "retry".
+        """
+        try:
+            response = requests.post(self.url, data=payload, headers=self.headers, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            application_logger.error('Remote Write Error: {}'.format(e))
+            return "retry"
+        if 200 <= response.status_code < 300:
+            return "sent"
+        if 400 <= response.status_code < 500 and response.status_code != 429:
+            application_logger.error('Remote Write Rejected: {} {}'.format(response.status_code, response.text[:200]))
+            return "rejected"
+        application_logger.error('Remote Write Error: {} {}'.format(response.status_code, response.text[:200]))
+        return "retry"
+
+    def flush(self):
+        """
+        Delivers pending WAL batches oldest first, stopping at the first failure.
+
+        Failures back off exponentially between min_backoff and max_backoff.
+
+        Returns:
+            int: The number of batches delivered.
+        """
+        if time.monotonic() < self.retry_at:
+            return 0
+        delivered = 0
+        for batch_path in self.wal.batches():
+            with open(batch_path, 'rb') as batch_file:
+                result = self.send(batch_file.read())
+            if result == "retry":
+                self.backoff = min(self.max_backoff, max(self.min_backoff, self.backoff * 2))
+                self.retry_at = time.monotonic() + self.backoff
+                return delivered
+            os.remove(batch_path)
+            if result == "sent":
+                delivered += 1
+        self.backoff = 0
+        self.retry_at = 0
+        return delivered
+
+    def run(self):
+        while not self.stop_event.is_set():
+            started = time.monotonic()
+            try:
+                self.collect()
+            except Exception as e:
+                application_logger.error('Remote Write Collection Error: {}'.format(e))
+            next_collection = started + self.interval
+            while not self.stop_event.is_set():
+                self.flush()
+                if not self.wal.batches() or time.monotonic() >= next_collection:
+                    break
+                self.stop_event.wait(max(0.0, min(self.retry_at, next_collection) - time.monotonic()))
+            self.stop_event.wait(max(0.0, next_collection - time.monotonic()))
+
+    def start(self):
+        """
+        Starts the collection and delivery loop in a daemon thread.
+        """
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="remote-write", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+
+if __name__ == "__main__":
+    pass
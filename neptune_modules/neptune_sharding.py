@@ -0,0 +1,179 @@
+"""
+Neptune Exporter Sharding Module.
+
+Splits the configured Apex and Fusion targets across several exporter instances
+with a consistent hash ring. Each instance only keeps sessions and browsers for
+the targets it owns, and adding or removing a node only moves the targets that
+hash next to it.
+
+A sharding.yml that exists but has never loaded successfully fails closed: the node
+owns no targets until the file is fixed, so one bad file can not make every node in
+the fleet collect every target.
+"""
+import bisect
+import hashlib
+import os
+import socket
+from neptune_modules import neptune_config
+
+
+def hash_key(key):
+    """
+    Hashes a ring key to a 64-bit integer.
+
+    Args:
+        key (str): The key.
+
+    Returns:
+        int: The hash.
+    """
+    return int.from_bytes(hashlib.blake2b(str(key).encode(), digest_size=8).digest(), "big")
+
+
+def target_key(kind, target):
+    """
+    Builds the ring key of a target.
+
+    Args:
+        kind (str): "apex" or "fusion".
+        target (str): The Apex IP address or Fusion Apex ID.
+
+    Returns:
+        str: Ex: "apex/192.168.1.50"
+    """
+    return "{}/{}".format(kind, target)
+
+
+class HashRing:
+    """
+    Consistent hash ring of exporter nodes with virtual nodes for an even spread.
+    """
+    def __init__(self, nodes, virtual_nodes=128):
+        """
+        Args:
+            nodes (list): The exporter addresses (host:port).
+            virtual_nodes (int, optional): Ring points per node. Defaults to 128.
+        """
+        self.nodes = list(nodes)
+        points = sorted((hash_key("{}#{}".format(node, index)), node)
+                        for node in self.nodes for index in range(virtual_nodes))
+        self.point_hashes = [point_hash for point_hash, _ in points]
+        self.point_nodes = [node for _, node in points]
+
+    def owner(self, key):
+        """
+        Returns the node that owns a key.
+
+        Args:
+            key (str): The ring key, from target_key().
+
+        Returns:
+            str: The owning node's address.
+        """
+        index = bisect.bisect(self.point_hashes, hash_key(key)) % len(self.point_hashes)
+        return self.point_nodes[index]
+
+
+def compile_sharding_configuration(raw):
+    """
+    Validates sharding.yml and builds the hash ring.
+
+    Args:
+        raw (dict): The parsed sharding.yml document.
+
+    Returns:
+        dict: {"ring": HashRing, "self_node": str}
+
+    Raises:
+        neptune_config.ConfigurationError: If the document does not match the schema.
+    """
+    sharding = raw.get("sharding") if isinstance(raw, dict) else None
+    if not isinstance(sharding, dict):
+        raise neptune_config.ConfigurationError("sharding.yml must contain a sharding mapping")
+    nodes = sharding.get("nodes")
+    if not isinstance(nodes, list) or len(nodes) == 0:
+        raise neptune_config.ConfigurationError("sharding.nodes must be a list of host:port addresses")
+    nodes = [str(node) for node in nodes]
+    self_node = str(sharding.get("self", ""))
+    if self_node not in nodes:
+        raise neptune_config.ConfigurationError("sharding.self must be one of sharding.nodes")
+    virtual_nodes = sharding.get("virtual_nodes", 128)
+    if not isinstance(virtual_nodes, int) or virtual_nodes < 1:
+        raise neptune_config.ConfigurationError("sharding.virtual_nodes must be a positive integer")
+    return {"ring": HashRing(nodes, virtual_nodes), "self_node": self_node}
+
+
+configuration_store = neptune_config.ConfigStore('sharding.yml', compile_sharding_configuration)
+
+
+def current_sharding():
+    """
+    Returns the active sharding snapshot, or None when sharding.yml does not exist or has never loaded.
+
+    Returns:
+        neptune_config.ConfigSnapshot or None: The sharding configuration.
+    """
+    if configuration_store.current is None:
+        configuration_store.reload_if_changed()
+    return configuration_store.current
+
+
+def sharding_invalid():
+    """
+    Checks if sharding.yml exists but has never loaded successfully.
+
+    Returns:
+        bool: True if this node must own no targets.
+    """
+    return current_sharding() is None and os.path.exists(configuration_store.path)
+
+
+def default_node(port=5006):
+    """
+    Returns this host's exporter address, used when sharding is disabled.
+
+    Args:
+        port (int, optional): The exporter port. Defaults to 5006.
+
+    Returns:
+        str: host:port
+    """
+    return "{}:{}".format(socket.gethostname(), port)
+
+
+def owner(kind, target):
+    """
+    Returns the node that owns a target.
+
+    Args:
+        kind (str): "apex" or "fusion".
+        target (str): The Apex IP address or Fusion Apex ID.
+
+    Returns:
+        str or None: The owning node's address. This node when sharding is disabled, None when sharding.yml is invalid.
+    """
+    sharding = current_sharding()
+    if sharding is None:
+        return None if sharding_invalid() else default_node()
+    return sharding.ring.owner(target_key(kind, target))
+
+
+def owns(kind, target):
+    """
+    Checks if this node owns a target.
+
+    Args:
+        kind (str): "apex" or "fusion".
+        target (str): The Apex IP address or Fusion Apex ID.
+
+    Returns:
+        bool: True if this node should collect the target. False for every target while sharding.yml is invalid.
+    """
+    sharding = current_sharding()
+    if sharding is None:
+        return not sharding_invalid()
+    return sharding.ring.owner(target_key(kind, target)) == sharding.self_node
+
+
+if __name__ == "__main__":
+    pass
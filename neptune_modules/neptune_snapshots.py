@@ -0,0 +1,189 @@
+"""
+Neptune Exporter Snapshot Store Module.
+
+Multi-worker mode: one collector process owns every Apex session and Fusion browser,
+renders each target's exposition and writes it here. The uvicorn workers only read,
+so adding workers adds cores without adding logins or Chrome instances.
+
+Each snapshot is one file, replaced atomically, in /dev/shm when available so reads
+never touch the disk. Readers mmap a file once and reuse the bytes until it is replaced.
+"""
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from neptune_modules import neptune_history
+
+application_logger = logging.getLogger('neptune_exporter')
+
+if os.path.isdir("/dev/shm"):
+    snapshot_directory = os.path.join("/dev/shm", "neptune_exporter")
+else:
+    snapshot_directory = os.path.join(os.path.dirname(__file__), '..', 'snapshots')
+
+SNAPSHOT_MAGIC = b"NXS1"
+# magic, collected time (epoch seconds), ETag length
+SNAPSHOT_HEADER = struct.Struct("<4sdI")
+
+
+class Snapshot:
+    """
+    One pre-rendered exposition read from the store.
+    """
+    def __init__(self, body, etag, collected_time):
+        """
+        Args:
+            body (bytes): The rendered exposition.
+            etag (str): The ETag of the exposition.
+            collected_time (float): Epoch seconds when the collector rendered it.
+        """
+        self.body = body
+        self.etag = etag
+        self.collected_time = collected_time
+
+    def age(self):
+        """
+        Returns:
+            float: Seconds since the snapshot was collected.
+        """
+        return time.time() - self.collected_time
+
+
+class SnapshotStore:
+    """
+    Directory of pre-rendered expositions keyed by (source, target, exposition format).
+    """
+    def __init__(self, directory):
+        """
+        Args:
+            directory (str): The snapshot directory. Shared by the collector and every worker.
+        """
+        self.directory = directory
+        self.read_cache = {}
+        self.read_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, source, target, exposition_format):
+        return os.path.join(self.directory, "{}_{}_{}.snapshot".format(
+            source, neptune_history.safe_name(target), exposition_format))
+
+    def write(self, source, target, exposition_format, body, etag, collected_time=None):
+        """
+        Atomically replaces a target's snapshot. Readers see the old or the new file, never a mix.
+
+        Args:
+            source (str): "apex" or "fusion".
+            target (str): The Apex IP address or Fusion Apex ID.
+            exposition_format (str): prometheus_metrics.TEXT_FORMAT or OPENMETRICS_FORMAT.
+            body (bytes): The rendered exposition.
+            etag (str): The ETag of the exposition.
+            collected_time (float, optional): Epoch seconds. Defaults to now.
+        """
+        file_path = self.path(source, target, exposition_format)
+        encoded_etag = etag.encode()
+        header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, collected_time or time.time(), len(encoded_etag))
+        temporary_path = "{}.{}.tmp".format(file_path, os.getpid())
+        with open(temporary_path, 'wb') as snapshot_file:
+            snapshot_file.write(header + encoded_etag + body)
+        os.replace(temporary_path, file_path)
+
+    def read(self, source, target, exposition_format):
+        """
+        Reads a target's snapshot. The file is only mapped again after the collector replaced it.
+
+        Args:
+            source (str): "apex" or "fusion".
+            target (str): The Apex IP address or Fusion Apex ID.
+            exposition_format (str): prometheus_metrics.TEXT_FORMAT or OPENMETRICS_FORMAT.
+
+        Returns:
+            Snapshot or None: None if the target has not been collected.
+        """
+        file_path = self.path(source, target, exposition_format)
+        try:
+            file_stat = os.stat(file_path)
+        except OSError:
+            return None
+        file_identity = (file_stat.st_ino, file_stat.st_mtime_ns, file_stat.st_size)
+        cached = self.read_cache.get(file_path)
+        if cached is not None and cached[0] == file_identity:
+            return cached[1]
+        try:
+            with open(file_path, 'rb') as snapshot_file:
+                with mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    magic, collected_time, etag_length = SNAPSHOT_HEADER.unpack_from(mapped, 0)
+                    if magic != SNAPSHOT_MAGIC:
+                        application_logger.error('Snapshot File Invalid: {}'.format(file_path))
+                        return None
+                    body_offset = SNAPSHOT_HEADER.size + etag_length
+                    etag = mapped[SNAPSHOT_HEADER.size:body_offset].decode()
+                    body = mapped[body_offset:]
+        except (OSError, ValueError, struct.error) as e:
+            application_logger.error('Snapshot Read Error: {} {}'.format(file_path, e))
+            return None
+        snapshot = Snapshot(body, etag, collected_time)
+        with self.read_lock:
+            self.read_cache[file_path] = (file_identity, snapshot)
+        return snapshot
+
+    def write_status(self, name, status):
+        """
+        Atomically replaces a JSON status document shared with the workers.
+
+        Args:
+            name (str): The status name. Ex: "warmup"
+            status (dict): The JSON-serializable status.
+        """
+        file_path = os.path.join(self.directory, "{}.json".format(name))
+        temporary_path = "{}.{}.tmp".format(file_path, os.getpid())
+        with open(temporary_path, 'w') as status_file:
+            json.dump(status, status_file)
+        os.replace(temporary_path, file_path)
+
+    def read_status(self, name):
+        """
+        Args:
+            name (str): The status name.
+
+        Returns:
+            dict or None: The status document, or None if the collector has not written it.
+        """
+        try:
+            with open(os.path.join(self.directory, "{}.json".format(name)), 'r') as status_file:
+                return json.load(status_file)
+        except (OSError, ValueError):
+            return None
+
+
+class SnapshotCollector:
+    """
+    Runs the collect function on a fixed interval. Used by the multi-worker collector process.
+    """
+    def __init__(self, collect_function, interval=60):
+        """
+        Args:
+            collect_function (callable): Collects every target and writes its snapshots.
+            interval (int, optional): Seconds between collections. Defaults to 60.
+        """
+        self.collect_function = collect_function
+        self.interval = interval
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            started = time.monotonic()
+            try:
+                self.collect_function()
+            except Exception as e:
+                application_logger.error('Snapshot Collection Error: {}'.format(e))
+            self.stop_event.wait(max(0.0, started + self.interval - time.monotonic()))
+
+    def stop(self):
+        self.stop_event.set()
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,133 @@
+"""
+Neptune Exporter Warm-Up Module.
+
+Logs into every configured Apex and Fusion system right after startup, so the first
+scrape of a target does not pay for the Apex login or the Fusion Chrome launch.
+Progress is kept per target for the /ready endpoint.
+"""
+import concurrent.futures
+import logging
+import threading
+import time
+
+application_logger = logging.getLogger('neptune_exporter')
+
+PENDING = "pending"
+RUNNING = "running"
+READY = "ready"
+FAILED = "failed"
+
+
+class WarmUp:
+    """
+    Runs one warm-up task per target with a separate concurrency limit per source.
+    """
+    def __init__(self, concurrency, on_progress=None):
+        """
+        Args:
+            concurrency (dict): source ("apex" / "fusion") -> maximum tasks running at once.
+            on_progress (callable, optional): Called with progress() after every state change.
+        """
+        self.concurrency = concurrency
+        self.on_progress = on_progress
+        self.tasks = []
+        self.states = {}
+        self.state_lock = threading.Lock()
+        self.started_time = None
+        self.finished_time = None
+        self.finished = threading.Event()
+
+    def add(self, source, target, function):
+        """
+        Adds a warm-up task.
+
+        Args:
+            source (str): "apex" or "fusion".
+            target (str): The Apex IP address or Fusion Apex ID.
+            function (callable): Logs into the target. A False return value or an exception marks it failed.
+        """
+        self.tasks.append((source, target, function))
+        self.states[(source, target)] = {"state": PENDING, "seconds": None, "error": None}
+
+    def update(self, source, target, **changes):
+        with self.state_lock:
+            self.states[(source, target)].update(changes)
+        self.report()
+
+    def report(self):
+        if self.on_progress is not None:
+            try:
+                self.on_progress(self.progress())
+            except Exception as e:
+                application_logger.error('Warm-Up Progress Error: {}'.format(e))
+
+    def run_task(self, source, target, function):
+        self.update(source, target, state=RUNNING)
+        started = time.monotonic()
+        try:
+            succeeded = function() is not False
+            error = None if succeeded else "login unsuccessful"
+        except Exception as e:
+            succeeded = False
+            error = str(e)
+        if not succeeded:
+            application_logger.error('Warm-Up Failed: {} {} {}'.format(source, target, error))
+        self.update(source, target, state=READY if succeeded else FAILED,
+                    seconds=round(time.monotonic() - started, 3), error=error)
+
+    def run(self):
+        """
+        Runs every task and blocks until all have finished.
+        """
+        self.started_time = time.time()
+        self.report()
+        executors = {source: concurrent.futures.ThreadPoolExecutor(max_workers=max(1, int(limit)),
+                                                                   thread_name_prefix="warmup-{}".format(source))
+                     for source, limit in self.concurrency.items()}
+        try:
+            futures = [executors[source].submit(self.run_task, source, target, function)
+                       for source, target, function in self.tasks]
+            concurrent.futures.wait(futures)
+        finally:
+            for executor in executors.values():
+                executor.shutdown(wait=False)
+        self.finished_time = time.time()
+        self.finished.set()
+        self.report()
+        application_logger.info('Warm-Up Finished: {} targets in {:.1f}s'.format(
+            len(self.tasks), self.finished_time - self.started_time))
+
+    def start(self):
+        """
+        Runs the warm-up in a daemon thread.
+        """
+        threading.Thread(target=self.run, name="warmup", daemon=True).start()
+
+    def ready(self):
+        """
+        Returns:
+            bool: True once every task has finished, successfully or not.
+        """
+        return self.finished.is_set()
+
+    def progress(self):
+        """
+        Returns:
+            dict: Readiness and per-target state, as served by /ready.
+        """
+        with self.state_lock:
+            targets = [dict(self.states[(source, target)], source=source, target=target)
+                       for source, target, _ in self.tasks]
+        return {
+            "ready": self.ready(),
+            "started": self.started_time,
+            "finished": self.finished_time,
+            "completed": sum(1 for target in targets if target["state"] in (READY, FAILED)),
+            "failed": sum(1 for target in targets if target["state"] == FAILED),
+            "total": len(targets),
+            "targets": targets
+        }
+
+
+if __name__ == "__main__":
+    pass
@@ -1,3 +1,14 @@
+"""
+Prometheus Exposition Format Module.
+"""
+import collections
+import gzip
+import hashlib
+import math
+import re
+import threading
+
+
 class Gauge:
     def __init__(self, metric_name, metric_type, metric_help, metric_labels, metric_value):
         self.metric_name = self.sanitize_metric_name(metric_name)
@@ -27,4 +38,289 @@ class Gauge:
     
     def metric_string(self, metric_name: str, labels: list, metric_value: float):
         """Creates Metric String for Prometheus"""
-        return "{}".format(" ".join(labels))
\ No newline at end of file
+        return "{}".format(" ".join(labels))
+
+class ExpositionCache:
+    """
+    Per-target cache of rendered exposition bytes.
+
+    Each render is fingerprinted by the parts of the upstream payload that feed the
+    exposition: a structure (everything that decides metric names and labels) and the
+    sample values. An unchanged fingerprint reuses the cached bytes, an unchanged
+    structure only re-encodes the samples whose values changed, and anything else
+    rebuilds the label strings from scratch.
+    """
+    def __init__(self, max_targets=1024):
+        """
+        Args:
+            max_targets (int, optional): Targets kept before the least recently used is dropped. Defaults to 1024.
+        """
+        self.max_targets = max_targets
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.patches = 0
+        self.rebuilds = 0
+
+    def render(self, target, structure, values, build_prefixes, suffix=b"", exposition_format=None):
+        """
+        Returns the exposition for a target, reusing as much of the previous render as possible.
+
+        Args:
+            target (str): The target the payload was collected from.
+            structure (tuple): The label-defining parts of the payload. Must have a stable repr().
+            values (list): The sample values, one per line, in line order.
+            build_prefixes (callable): Returns the line prefixes ('name{labels} ') matching values.
+                Only called when the structure changed.
+            suffix (bytes, optional): Appended after the last line. Ex: b"\\n# EOF\\n".
+            exposition_format (str, optional): OPENMETRICS_FORMAT spells NaN and infinities as OpenMetrics requires.
+
+        Returns:
+            tuple: (exposition bytes, ETag string)
+        """
+        structure_key = hashlib.blake2b(repr(structure).encode(), digest_size=16).digest()
+        if exposition_format == OPENMETRICS_FORMAT:
+            value_strings = [format_value(value).encode() for value in values]
+        else:
+            value_strings = [str(value).encode() for value in values]
+        etag = hashlib.blake2b(structure_key + b"\n".join(value_strings), digest_size=16).hexdigest()
+
+        with self.lock:
+            entry = self.entries.get(target)
+            if entry is not None:
+                self.entries.move_to_end(target)
+                if entry["etag"] == etag:
+                    self.hits += 1
+                    return entry["body"], etag
+
+        if entry is not None and entry["structure_key"] == structure_key:
+            prefixes = entry["prefixes"]
+            lines = list(entry["lines"])
+            for index, (old_value, new_value) in enumerate(zip(entry["value_strings"], value_strings)):
+                if old_value != new_value:
+                    lines[index] = prefixes[index] + new_value
+            patched = True
+        else:
+            prefixes = [prefix.encode() for prefix in build_prefixes()]
+            lines = [prefix + value for prefix, value in zip(prefixes, value_strings)]
+            patched = False
+
+        body = b"\n".join(lines) + suffix if lines else suffix.lstrip(b"\n")
+        with self.lock:
+            if patched:
+                self.patches += 1
+            else:
+                self.rebuilds += 1
+            self.entries[target] = {
+                "structure_key": structure_key,
+                "prefixes": prefixes,
+                "value_strings": value_strings,
+                "lines": lines,
+                "body": body,
+                "etag": etag,
+                "gzip_body": None
+            }
+            self.entries.move_to_end(target)
+            while len(self.entries) > self.max_targets:
+                self.entries.popitem(last=False)
+        return body, etag
+
+    def gzip_body(self, target, etag, body):
+        """
+        Returns the gzip encoding of a rendered body, compressing it once per render.
+
+        Args:
+            target (str): The target passed to render().
+            etag (str): The ETag returned by render().
+            body (bytes): The body returned by render().
+
+        Returns:
+            bytes: The gzip compressed body.
+        """
+        with self.lock:
+            entry = self.entries.get(target)
+            if entry is not None and entry["etag"] == etag and entry["gzip_body"] is not None:
+                return entry["gzip_body"]
+        compressed_body = gzip.compress(body, compresslevel=6)
+        with self.lock:
+            entry = self.entries.get(target)
+            if entry is not None and entry["etag"] == etag:
+                entry["gzip_body"] = compressed_body
+        return compressed_body
+
+
+TEXT_FORMAT = "text"
+OPENMETRICS_FORMAT = "openmetrics"
+
+CONTENT_TYPES = {
+    TEXT_FORMAT: "text/plain; version=0.0.4; charset=utf-8",
+    OPENMETRICS_FORMAT: "application/openmetrics-text; version=1.0.0; charset=utf-8"
+}
+
+# Metric name suffixes that are declared as an OpenMetrics UNIT.
+UNIT_SUFFIXES = ["pct", "seconds", "bytes", "celsius", "fahrenheit", "ratio"]
+
+
+def format_value(value):
+    """
+    Formats a sample value as OpenMetrics expects it.
+
+    Args:
+        value (float): The sample value.
+
+    Returns:
+        str: Ex: "7.9", "NaN", "+Inf" or "-Inf"
+    """
+    if isinstance(value, float):
+        if math.isnan(value):
+            return "NaN"
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+    return str(value)
+
+
+def parse_header_qualities(header_value):
+    """
+    Parses an Accept or Accept-Encoding header into {value: quality}.
+
+    Args:
+        header_value (str): The header value.
+
+    Returns:
+        dict: The lower-cased media types or codings with their q values.
+    """
+    qualities = {}
+    for item in str(header_value or "").split(","):
+        parts = [part.strip() for part in item.split(";")]
+        if parts[0] == "":
+            continue
+        quality = 1.0
+        for parameter in parts[1:]:
+            if parameter.startswith("q="):
+                try:
+                    quality = float(parameter[2:])
+                except ValueError:
+                    quality = 0.0
+        qualities[parts[0].lower()] = max(quality, qualities.get(parts[0].lower(), 0.0))
+    return qualities
+
+
+def negotiate_format(accept_header):
+    """
+    Picks the exposition format from an Accept header.
+
+    OpenMetrics is only served when the client asks for it at least as strongly as
+    the Prometheus text format, so curl and browsers keep getting text 0.0.4.
+
+    Args:
+        accept_header (str): The Accept header value.
+
+    Returns:
+        str: TEXT_FORMAT or OPENMETRICS_FORMAT.
+    """
+    qualities = parse_header_qualities(accept_header)
+    openmetrics_quality = qualities.get("application/openmetrics-text", 0.0)
+    text_quality = max(qualities.get("text/plain", 0.0), qualities.get("*/*", 0.0))
+    if openmetrics_quality > 0 and openmetrics_quality >= text_quality:
+        return OPENMETRICS_FORMAT
+    return TEXT_FORMAT
+
+
+def accepts_gzip(accept_encoding_header):
+    """
+    Checks if an Accept-Encoding header allows gzip.
+
+    Args:
+        accept_encoding_header (str): The Accept-Encoding header value.
+
+    Returns:
+        bool: True if gzip is acceptable.
+    """
+    qualities = parse_header_qualities(accept_encoding_header)
+    return qualities.get("gzip", qualities.get("*", 0.0)) > 0
+
+
+def matches_etag(if_none_match_header, etag):
+    """
+    Checks an If-None-Match header against a response's entity tag.
+
+    The header is "*" or a comma-separated list of quoted tags, each optionally weak (W/).
+    Tags are compared with the weak comparison RFC 9110 prescribes for If-None-Match:
+    the opaque tags must be equal, weak or not.
+
+    Args:
+        if_none_match_header (str): The If-None-Match header value.
+        etag (str): The response's ETag header value. Ex: '"3f2a9c"'
+
+    Returns:
+        bool: True if the client's copy is current and 304 Not Modified can be sent.
+    """
+    header_value = str(if_none_match_header or "").strip()
+    if header_value == "":
+        return False
+    if header_value == "*":
+        return True
+    opaque_tag = etag[2:] if etag.startswith("W/") else etag
+    return opaque_tag in re.findall(r'\s*(?:W/)?("[^"]*")\s*(?:,|$)', header_value)
+
+
+def group_families(samples):
+    """
+    Orders samples so every metric family is contiguous, keeping first-appearance order.
+
+    Args:
+        samples (list): (metric_name, metric_labels, metric_value) tuples.
+
+    Returns:
+        list: The same samples grouped by metric name.
+    """
+    family_order = {}
+    for metric_name, _, _ in samples:
+        family_order.setdefault(str(metric_name).lower(), len(family_order))
+    return sorted(samples, key=lambda sample: family_order[str(sample[0]).lower()])
+
+
+def line_prefixes(sample_keys, exposition_format=TEXT_FORMAT):
+    """
+    Builds the name and label part of every exposition line.
+
+    Args:
+        sample_keys (list): (metric_name, metric_labels) tuples, grouped by family.
+        exposition_format (str, optional): TEXT_FORMAT or OPENMETRICS_FORMAT. Defaults to TEXT_FORMAT.
+
+    Returns:
+        list: Line prefixes ending in a space. OpenMetrics prefixes start with the
+        TYPE/UNIT metadata of their family on its first sample.
+    """
+    prefixes = []
+    previous_family = None
+    for metric_name, metric_labels in sample_keys:
+        family = "apex_{}".format(str(metric_name).lower())
+        if exposition_format == OPENMETRICS_FORMAT:
+            prefix = "{}{{{}}} ".format(family, ",".join(metric_labels))
+            if family != previous_family:
+                metadata = "# TYPE {} gauge\n".format(family)
+                for unit in UNIT_SUFFIXES:
+                    if family.endswith("_" + unit):
+                        metadata += "# UNIT {} {}\n".format(family, unit)
+                prefix = metadata + prefix
+        else:
+            prefix = "{}{{{}}} ".format(family, ", ".join(metric_labels))
+        prefixes.append(prefix)
+        previous_family = family
+    return prefixes
+
+
+def exposition_suffix(exposition_format):
+    """
+    Returns the bytes that end an exposition of the given format.
+
+    Args:
+        exposition_format (str): TEXT_FORMAT or OPENMETRICS_FORMAT.
+
+    Returns:
+        bytes: b"\\n# EOF\\n" for OpenMetrics, otherwise nothing.
+    """
+    if exposition_format == OPENMETRICS_FORMAT:
+        return b"\n# EOF\n"
+    return b""
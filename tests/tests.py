@@ -1,2 +1,832 @@
+import datetime
+import gzip
+import os
+import logging
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from neptune_modules import neptune_logs
+
+
+@pytest.fixture(autouse=True)
+def exporter_log(tmp_path_factory, monkeypatch):
+    """
+    Sends the neptune_exporter logger to a temporary directory, so test runs never write to logs/exporter.log.
+    """
+    import neptune_exporter
+    test_handler = logging.FileHandler(str(tmp_path_factory.mktemp("logs") / "exporter.log"))
+    monkeypatch.setattr(neptune_exporter.application_logger, "handlers", [test_handler])
+    yield
+    test_handler.close()
+
+
 def test_dummy():
-    pass
\ No newline at end of file
+    pass
+
+
+def write_log(path, start, count, step_seconds=60):
+    with open(path, 'w') as log_file:
+        for index in range(count):
+            timestamp = start + datetime.timedelta(seconds=index * step_seconds)
+            level = "ERROR" if index % 10 == 0 else "INFO"
+            log_file.write("{},123 {} message {}\n".format(timestamp.strftime("%Y-%m-%d %H:%M:%S"), level, index))
+            if level == "ERROR":
+                log_file.write("Traceback line for {}\n".format(index))
+
+
+def test_log_range_export(tmp_path, monkeypatch):
+    monkeypatch.setattr(neptune_logs, "log_directory", str(tmp_path))
+    start = datetime.datetime(2024, 8, 1)
+    write_log(os.path.join(str(tmp_path), "apex.log.1"), start, 5000)
+    write_log(os.path.join(str(tmp_path), "apex.log"), start + datetime.timedelta(days=10), 5000)
+
+    range_start = start + datetime.timedelta(minutes=100)
+    range_end = start + datetime.timedelta(minutes=200)
+    records = b"".join(neptune_logs.export_log_range("neptune_apex", range_start, range_end, level="ERROR"))
+    lines = records.decode().splitlines()
+    assert lines[0].endswith("ERROR message 100")
+    assert lines[1] == "Traceback line for 100"
+    assert lines[-2].endswith("ERROR message 200")
+    assert len(lines) == 22
+
+    compressed = b"".join(neptune_logs.export_log_range("neptune_apex", range_start, range_end, level="ERROR",
+                                                        compress=True))
+    assert gzip.decompress(compressed) == records
+
+
+def test_log_range_skips_segments():
+    segment = neptune_logs.LogSegment.__new__(neptune_logs.LogSegment)
+    segment.first_timestamp = datetime.datetime(2024, 8, 1)
+    segment.last_timestamp = datetime.datetime(2024, 8, 2)
+    assert segment.overlaps(datetime.datetime(2024, 8, 1, 12), datetime.datetime(2024, 8, 3))
+    assert not segment.overlaps(datetime.datetime(2024, 8, 3), datetime.datetime(2024, 8, 4))
+
+
+def test_disabled_backend_is_not_imported(monkeypatch):
+    import pytest
+    from fastapi import HTTPException
+    import neptune_exporter
+    monkeypatch.setitem(neptune_exporter.configuration, "fusion_module", {"enabled": False})
+    monkeypatch.setattr(neptune_exporter, "backend_modules", {})
+    with pytest.raises(HTTPException) as error:
+        neptune_exporter.load_backend("fusion")
+    assert error.value.status_code == 404
+    assert "fusion" not in neptune_exporter.backend_modules
+
+
+def test_config_store_hot_reload(tmp_path, monkeypatch):
+    from neptune_modules import neptune_config
+    monkeypatch.setattr(neptune_config, "configuration_directory", str(tmp_path))
+    config_path = tmp_path / "apex.yml"
+    config_path.write_text("apex_auths:\n  default:\n    username: admin\n    password: '1234'\n"
+                           "  other:\n    username: admin\n    password: '5678'\n")
+    store = neptune_config.ConfigStore("apex.yml", neptune_config.compile_apex_configuration)
+    changes = []
+    store.on_change(lambda old, new: changes.append(
+        neptune_config.changed_credentials(old.apex_auths, new.apex_auths)))
+
+    first = store.snapshot()
+    assert first.apex_auths["default"] == ("admin", "1234")
+
+    config_path.write_text("apex_auths:\n  default:\n    username: admin\n")
+    os.utime(str(config_path), (1, 1))
+    assert store.reload_if_changed() is False
+    assert store.snapshot() is first
+
+    config_path.write_text("apex_auths:\n  default:\n    username: admin\n    password: '1234'\n"
+                           "  other:\n    username: admin\n    password: changed\n")
+    os.utime(str(config_path), (2, 2))
+    assert store.reload_if_changed() is True
+    assert store.snapshot().version == 2
+    assert changes == [{"other"}]
+    # A scrape that started on the old snapshot still sees the old credentials.
+    assert first.apex_auths["other"].password == "5678"
+
+
+def test_exposition_cache_reuses_and_patches():
+    from neptune_modules.prometheus_metrics import ExpositionCache
+    cache = ExpositionCache()
+    builds = []
+
+    def prefixes():
+        builds.append(1)
+        return ['apex_a{x="1"} ', 'apex_b{x="2"} ']
+
+    body, etag = cache.render("10.0.0.1", ("host",), [1, 2.5], prefixes)
+    assert body == b'apex_a{x="1"} 1\napex_b{x="2"} 2.5'
+    assert cache.render("10.0.0.1", ("host",), [1, 2.5], prefixes) == (body, etag)
+    patched, patched_etag = cache.render("10.0.0.1", ("host",), [1, 3.0], prefixes)
+    assert patched == b'apex_a{x="1"} 1\napex_b{x="2"} 3.0'
+    assert patched_etag != etag
+    assert len(builds) == 1
+    cache.render("10.0.0.1", ("renamed",), [1, 3.0], prefixes)
+    assert len(builds) == 2
+    assert (cache.hits, cache.patches, cache.rebuilds) == (1, 1, 2)
+
+
+def test_content_negotiation():
+    from neptune_modules import prometheus_metrics
+    prometheus_accept = ("application/openmetrics-text;version=1.0.0,application/openmetrics-text;version=0.0.1;q=0.75,"
+                         "text/plain;version=0.0.4;q=0.5,*/*;q=0.1")
+    assert prometheus_metrics.negotiate_format(prometheus_accept) == "openmetrics"
+    assert prometheus_metrics.negotiate_format("text/plain") == "text"
+    assert prometheus_metrics.negotiate_format(None) == "text"
+    assert prometheus_metrics.accepts_gzip("gzip, deflate")
+    assert not prometheus_metrics.accepts_gzip("gzip;q=0, identity")
+
+
+def test_openmetrics_line_prefixes():
+    from neptune_modules import prometheus_metrics
+    sample_keys = [("network_quality_pct", ['a="1"', 'b="2"']), ("measurement", ['name="x, y"']),
+                   ("measurement", ['name="z"'])]
+    assert prometheus_metrics.line_prefixes(sample_keys, "openmetrics") == [
+        '# TYPE apex_network_quality_pct gauge\n# UNIT apex_network_quality_pct pct\napex_network_quality_pct{a="1",b="2"} ',
+        '# TYPE apex_measurement gauge\napex_measurement{name="x, y"} ',
+        'apex_measurement{name="z"} '
+    ]
+    samples = [("a", [], 1), ("b", [], 2), ("a", [], 3)]
+    assert prometheus_metrics.group_families(samples) == [("a", [], 1), ("a", [], 3), ("b", [], 2)]
+
+
+def sample_ilog(start_seconds, count, step_seconds=600):
+    return {"ilog": {"hostname": "tank", "serial": "AC5:1", "record": [
+        {"date": start_seconds + index * step_seconds,
+         "data": [{"did": "base_Temp", "type": "Temp", "name": "Tmp", "value": 77.0 + index % 3},
+                  {"did": "base_pH", "type": "pH", "name": "pH", "value": 8.0}]}
+        for index in range(count)]}}
+
+
+def test_history_store_append_and_query(tmp_path):
+    from neptune_modules import neptune_history
+    store = neptune_history.HistoryStore(str(tmp_path))
+    series = neptune_history.apex_ilog_series(sample_ilog(1700000000, 12))
+    assert neptune_history.store_series(store, "apex", "10.0.0.1", series) == 24
+    # Re-syncing overlapping data only appends the new records.
+    series = neptune_history.apex_ilog_series(sample_ilog(1700000000, 18))
+    assert neptune_history.store_series(store, "apex", "10.0.0.1", series) == 12
+
+    listed = store.list_series("apex", "10.0.0.1")
+    assert listed["base_Temp"]["metric_name"] == "sensor_tmp"
+    assert 'input_did="base_Temp"' in listed["base_Temp"]["labels"]
+
+    start = 1700000000 * 1000
+    raw = store.query("apex", "10.0.0.1", "base_Temp", start, start + 3000 * 1000)
+    assert raw == [[start + index * 600000, 77.0 + index % 3] for index in range(6)]
+    hourly = store.query("apex", "10.0.0.1", "base_Temp", start, start + 18 * 600 * 1000, step=3600 * 1000,
+                         aggregate="max")
+    assert hourly == [[start, 79.0], [start + 3600000, 79.0], [start + 7200000, 79.0]]
+    assert list(store.read_points("apex", "10.0.0.1", "base_pH", start, start))[0] == (start, 8.0)
+
+
+def test_openmetrics_backfill(tmp_path):
+    from neptune_modules import neptune_backfill, neptune_history, prometheus_metrics
+    store = neptune_history.HistoryStore(str(tmp_path / "history"))
+    neptune_history.store_series(store, "apex", "10.0.0.1",
+                                 neptune_history.apex_ilog_series(sample_ilog(1700000000, 3)))
+    start = 1700000000 * 1000
+    document = b"".join(neptune_backfill.openmetrics_backfill(store, "apex", "10.0.0.1", start, start + 10 ** 7))
+    assert document.decode().splitlines() == [
+        '# TYPE apex_sensor_ph gauge',
+        'apex_sensor_ph{apex_serial="AC5:1",apex_hostname="tank",input_did="base_pH",input_type="pH",input_name="pH"} 8.0 1700000000.000',
+        'apex_sensor_ph{apex_serial="AC5:1",apex_hostname="tank",input_did="base_pH",input_type="pH",input_name="pH"} 8.0 1700000600.000',
+        'apex_sensor_ph{apex_serial="AC5:1",apex_hostname="tank",input_did="base_pH",input_type="pH",input_name="pH"} 8.0 1700001200.000',
+        '# TYPE apex_sensor_tmp gauge',
+        'apex_sensor_tmp{apex_serial="AC5:1",apex_hostname="tank",input_did="base_Temp",input_type="Temp",input_name="Tmp"} 77.0 1700000000.000',
+        'apex_sensor_tmp{apex_serial="AC5:1",apex_hostname="tank",input_did="base_Temp",input_type="Temp",input_name="Tmp"} 78.0 1700000600.000',
+        'apex_sensor_tmp{apex_serial="AC5:1",apex_hostname="tank",input_did="base_Temp",input_type="Temp",input_name="Tmp"} 79.0 1700001200.000',
+        '# EOF'
+    ]
+    files = neptune_backfill.write_backfill_files(store, "apex", "10.0.0.1", start - 86400 * 1000, start + 86400 * 1000,
+                                                  str(tmp_path / "out"), block_seconds=86400)
+    assert len(files) == 1
+    assert [prometheus_metrics.format_value(value) for value in (7.9, float("nan"), float("inf"), float("-inf"))] == \
+        ["7.9", "NaN", "+Inf", "-Inf"]
+
+
+def test_snappy_and_write_request_round_trip():
+    from neptune_modules import neptune_remote_write
+    series = neptune_remote_write.samples_to_series(
+        [("sensor_tmp", ['apex_serial="AC5:1"', 'input_name="Tmp"'], 77.5), ("alarm", [], "not a number")],
+        1700000000000, {"job": "neptune_apex"})
+    payload = neptune_remote_write.encode_write_request(series * 50)
+    compressed = neptune_remote_write.snappy_compress(payload)
+    assert len(compressed) < len(payload)
+    decoded = neptune_remote_write.decode_write_request(neptune_remote_write.snappy_decompress(compressed))
+    assert decoded[0] == ({"__name__": "apex_sensor_tmp", "apex_serial": "AC5:1", "input_name": "Tmp",
+                           "job": "neptune_apex"}, [(1700000000000, 77.5)])
+    assert len(decoded) == 50
+
+
+def test_remote_write_retries_from_wal(tmp_path):
+    import http.server
+    import threading
+    from neptune_modules import neptune_remote_write
+
+    received = []
+    responses = [503, 204]
+
+    class StandInReceiver(http.server.BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            status_code = responses.pop(0)
+            if status_code == 204:
+                received.append(neptune_remote_write.decode_write_request(neptune_remote_write.snappy_decompress(body)))
+            self.send_response(status_code)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.HTTPServer(("127.0.0.1", 0), StandInReceiver)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        wal = neptune_remote_write.WriteAheadLog(str(tmp_path), 1024 * 1024)
+        writer = neptune_remote_write.RemoteWriter(
+            "http://127.0.0.1:{}/api/v1/write".format(server.server_port),
+            lambda: [({"__name__": "apex_sensor_ph"}, [(1700000000000, 8.1)])], wal=wal, min_backoff=0)
+        writer.collect()
+        assert writer.flush() == 0
+        assert len(wal.batches()) == 1
+        assert writer.flush() == 1
+        assert wal.batches() == []
+        assert received == [[({"__name__": "apex_sensor_ph"}, [(1700000000000, 8.1)])]]
+    finally:
+        server.shutdown()
+
+
+def test_hash_ring_moves_few_targets():
+    from neptune_modules.neptune_sharding import HashRing, target_key
+    targets = [target_key("apex", "192.168.1.{}".format(index)) for index in range(200)]
+    three_nodes = HashRing(["node-1:5006", "node-2:5006", "node-3:5006"])
+    four_nodes = HashRing(["node-1:5006", "node-2:5006", "node-3:5006", "node-4:5006"])
+    before = {target: three_nodes.owner(target) for target in targets}
+    after = {target: four_nodes.owner(target) for target in targets}
+    assert len(set(before.values())) == 3
+    moved = [target for target in targets if before[target] != after[target]]
+    # Only targets taken over by the new node move.
+    assert all(after[target] == "node-4:5006" for target in moved)
+    assert 0 < len(moved) < len(targets) / 2
+
+
+def test_metrics_served_from_snapshot_store(tmp_path, monkeypatch):
+    from fastapi.testclient import TestClient
+    import neptune_exporter
+    from neptune_modules import neptune_snapshots, prometheus_metrics
+    store = neptune_snapshots.SnapshotStore(str(tmp_path))
+    monkeypatch.setitem(neptune_exporter.configuration, "server", {"workers": 4, "collect_interval": 60})
+    monkeypatch.setattr(neptune_exporter, "snapshot_store", store)
+    monkeypatch.setattr(neptune_exporter, "backend_modules", {})
+    client = TestClient(neptune_exporter.app)
+
+    assert client.get("/metrics/apex", params={"target": "192.168.1.50", "auth_module": "default"}).status_code == 503
+
+    store.write("apex", "192.168.1.50", prometheus_metrics.TEXT_FORMAT, b"apex_sensor_ph 8.1\n", "etag-1")
+    first = store.read("apex", "192.168.1.50", prometheus_metrics.TEXT_FORMAT)
+    assert store.read("apex", "192.168.1.50", prometheus_metrics.TEXT_FORMAT) is first
+    response = client.get("/metrics/apex", params={"target": "192.168.1.50", "auth_module": "default"})
+    assert response.status_code == 200
+    assert response.text == "apex_sensor_ph 8.1\n"
+    assert response.headers["etag"] == '"etag-1"'
+    # Workers never load a backend or log in.
+    assert neptune_exporter.backend_modules == {}
+
+    store.write("apex", "192.168.1.50", prometheus_metrics.TEXT_FORMAT, b"apex_sensor_ph 8.2\n", "etag-2",
+                collected_time=1)
+    assert store.read("apex", "192.168.1.50", prometheus_metrics.TEXT_FORMAT).body == b"apex_sensor_ph 8.2\n"
+    assert client.get("/metrics/apex", params={"target": "192.168.1.50", "auth_module": "default"}).status_code == 503
+
+
+def test_warmup_progress():
+    from neptune_modules.neptune_warmup import WarmUp
+    reports = []
+    warmup = WarmUp({"apex": 2, "fusion": 1}, on_progress=reports.append)
+    warmup.add("apex", "192.168.1.50", lambda: True)
+    warmup.add("apex", "192.168.1.13", lambda: False)
+    warmup.add("fusion", "234j5nliu2345oin2345in2345", lambda: None)
+    assert warmup.ready() is False
+    assert warmup.progress()["targets"][0]["state"] == "pending"
+    warmup.run()
+    progress = warmup.progress()
+    assert progress["ready"] is True
+    assert (progress["completed"], progress["failed"], progress["total"]) == (3, 1, 3)
+    assert [target["state"] for target in progress["targets"]] == ["ready", "failed", "ready"]
+    assert reports[0]["ready"] is False and reports[-1]["ready"] is True
+
+
+def test_json_codec_round_trip(tmp_path, monkeypatch):
+    import json
+    from neptune_modules import neptune_json
+    document = {"status": {"inputs": [{"did": "base_pH", "value": 8.1}], "serial": "AC5:1"}}
+    for implementation in (neptune_json.orjson, None):
+        monkeypatch.setattr(neptune_json, "orjson", implementation)
+        assert neptune_json.loads(neptune_json.dumps(document)) == document
+        assert neptune_json.loads(neptune_json.dumps(document, pretty=True).decode()) == document
+        assert b" " not in neptune_json.dumps(document)
+        # Export files do not depend on which implementation is installed.
+        assert neptune_json.dumps(document, pretty=True) == json.dumps(document, indent=2, sort_keys=True).encode()
+        neptune_json.dump_file(document, str(tmp_path / "status.json"), compact=True)
+        assert json.loads((tmp_path / "status.json").read_text()) == document
+
+
+def test_sampling_profiler_keeps_watched_stacks():
+    import threading
+    import time
+    from neptune_modules.neptune_profiling import SamplingProfiler
+    stop = threading.Event()
+
+    def busy_handler():
+        while not stop.is_set():
+            sum(range(1000))
+
+    def idle_thread():
+        stop.wait()
+
+    threads = [threading.Thread(target=busy_handler), threading.Thread(target=idle_thread)]
+    profiler = SamplingProfiler(0.001, {busy_handler.__code__})
+    for thread in threads:
+        thread.start()
+    profiler.start()
+    time.sleep(0.2)
+    profiler.stop()
+    stop.set()
+    for thread in threads:
+        thread.join()
+    lines = profiler.collapsed().splitlines()
+    assert profiler.samples > 0 and lines
+    assert all("tests.py:busy_handler" in line and "idle_thread" not in line for line in lines)
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+
+
+def test_profile_endpoints_require_token(monkeypatch):
+    from fastapi.testclient import TestClient
+    import neptune_exporter
+    client = TestClient(neptune_exporter.app)
+    monkeypatch.setitem(neptune_exporter.configuration, "debug_profiling", {"enabled": False, "token": "secret"})
+    assert client.get("/debug/profile/cpu", params={"seconds": 1}).status_code == 404
+    monkeypatch.setitem(neptune_exporter.configuration, "debug_profiling", {"enabled": True, "token": "secret"})
+    assert client.get("/debug/profile/cpu", params={"seconds": 1},
+                      headers={"Authorization": "Bearer wrong"}).status_code == 401
+    response = client.get("/debug/profile/memory", params={"seconds": 1},
+                          headers={"Authorization": "Bearer secret"})
+    assert response.status_code == 200
+    assert "Peak:" in response.text
+
+
+def test_admission_priority_and_shedding():
+    import threading
+    import time
+    import pytest
+    from neptune_modules.neptune_admission import AdmissionController, AdmissionRejected
+    controller = AdmissionController({"rate": 0, "concurrency": 1, "max_queue": 2,
+                                      "max_wait": {"metrics": 5, "export": 5}})
+    gate = controller.gate("192.168.1.50")
+    gate.acquire("metrics")
+    admitted = []
+
+    def waiter(priority):
+        try:
+            with gate.admit(priority):
+                admitted.append(priority)
+        except AdmissionRejected as e:
+            admitted.append(e.reason)
+
+    export_thread = threading.Thread(target=waiter, args=("export",))
+    export_thread.start()
+    while not gate.waiting:
+        time.sleep(0.001)
+    metrics_thread = threading.Thread(target=waiter, args=("metrics",))
+    metrics_thread.start()
+    while len(gate.waiting) < 2:
+        time.sleep(0.001)
+    # The queue is full of equal or higher classes, so a new export is shed.
+    with pytest.raises(AdmissionRejected):
+        gate.acquire("export")
+    gate.release()
+    export_thread.join()
+    metrics_thread.join()
+    assert admitted == ["metrics", "export"]
+    assert gate.rejected == {("export", "queue_full"): 1}
+    exposition = controller.exposition()
+    assert 'neptune_exporter_apex_admission_rejected_total{target="192.168.1.50",class="export",reason="queue_full"} 1' \
+        in exposition
+    assert 'neptune_exporter_apex_admission_wait_seconds_count{target="192.168.1.50",class="metrics"} 2' in exposition
+    assert 'neptune_exporter_apex_admission_limit{setting="concurrency"} 1.0' in exposition
+
+
+def test_payload_cache_ttl_lru_and_single_fetch():
+    import threading
+    from neptune_modules.neptune_cache import PayloadCache
+    cache = PayloadCache({"max_bytes": 100, "ttl": {"default": 60, "status": 0}})
+    calls = []
+
+    def loader(value, size):
+        def load():
+            calls.append(value)
+            return value, size
+        return load
+
+    assert cache.fetch(("10.0.0.1", "ilog", 1), loader("ilog", 60)) == "ilog"
+    assert cache.fetch(("10.0.0.1", "ilog", 1), loader("changed", 60)) == "ilog"
+    # A zero TTL is never reused.
+    cache.fetch(("10.0.0.1", "status", None), loader("status", 10))
+    cache.fetch(("10.0.0.1", "status", None), loader("status", 10))
+    assert calls == ["ilog", "status", "status"]
+    # 60 + 10 + 50 bytes is over max_bytes, so the least recently used ilog is evicted.
+    cache.fetch(("10.0.0.1", "dlog", 1), loader("dlog", 50))
+    assert ("10.0.0.1", "ilog", 1) not in cache.entries
+    assert cache.size == 60 and cache.evictions == 1
+
+    release = threading.Event()
+    slow_calls = []
+
+    def slow_loader():
+        slow_calls.append(1)
+        release.wait()
+        return "tlog", 1
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.fetch(("10.0.0.1", "tlog", 1), slow_loader)))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    while not cache.loading:
+        pass
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert results == ["tlog"] * 4 and slow_calls == [1]
+    assert "neptune_exporter_payload_cache_bytes 61" in cache.exposition()
+
+
+def test_mlog_cache_merges_new_entries():
+    from neptune_modules.neptune_mlog import MeasurementLogStore
+    store = MeasurementLogStore({"refresh_interval": 0})
+    now = datetime.datetime.now(datetime.timezone.utc)
+
+    def entry(entry_id, minutes_ago, log_type, value, name=""):
+        log_date = (now - datetime.timedelta(minutes=minutes_ago)).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+        return {"_id": entry_id, "date": log_date, "type": log_type, "name": name, "value": value}
+
+    responses = {
+        3: [entry("a", 3000, 1, 7.5), entry("b", 60, 1, 8.1), entry("c", 30, 0, 420, "Salinity Check")],
+        1: [entry("b", 60, 1, 8.1), entry("c", 30, 0, 420, "Salinity Check"), entry("d", 5, 2, 430)]
+    }
+    requested = []
+
+    def fetch(days):
+        requested.append(days)
+        return responses[days]
+
+    def log_name(log_entry):
+        return {0: log_entry["name"].lower().replace(" ", "_"), 1: "alkalinity", 2: "calcium"}.get(log_entry["type"])
+
+    latest = store.latest("apex1", 2 * 86400 + 60, fetch, log_name)
+    assert requested == [3]
+    assert {name: log_entry["value"] for name, log_entry in latest.items()} == {"alkalinity": 8.1, "salinity_check": 420}
+    latest = store.latest("apex1", 2 * 86400 + 60, fetch, log_name)
+    assert requested == [3, 1]
+    assert latest["calcium"]["value"] == 430
+    assert store.merged_entries == 4 and store.cold_starts == 1 and store.refreshes == 1
+    # Older entries are still filtered by data_max_age.
+    assert sorted(store.latest("apex1", 20 * 60, fetch, log_name)) == ["calcium"]
+    assert requested == [3, 1, 1]
+
+
+def test_rolling_aggregates_over_ring_buffers():
+    import array
+    import statistics
+    from neptune_modules.neptune_aggregates import AggregateStore, RingBuffer, window_statistics
+    ring_buffer = RingBuffer(3)
+    for index in range(5):
+        ring_buffer.append(index, index * 10)
+    assert [list(column) for column in ring_buffer.ordered()] == [[2, 3, 4], [20, 30, 40]]
+
+    # 10 minute records: 1h windows hold the last 6, 24h windows all 10.
+    values = [8.0, 8.1, 8.3, 7.9, 8.2, 8.0, 8.4, 7.8, 8.1, 8.2]
+    records = [{"date": 1700000000 + index * 600, "data": [{"did": "base_pH", "type": "pH", "name": "pH", "value": value}]}
+               for index, value in enumerate(values)]
+    ilog = {"ilog": {"serial": "AC5:1", "hostname": "tank", "record": records[:8]}}
+    store = AggregateStore({"refresh_interval": 0})
+    requested = []
+
+    def fetch(days):
+        requested.append(days)
+        return ilog
+
+    store.samples("10.0.0.1", fetch)
+    ilog["ilog"]["record"] = records[6:]
+    samples = {(metric_name, metric_labels[-1]): metric_value for metric_name, metric_labels, metric_value
+               in store.samples("10.0.0.1", fetch)}
+    assert requested == [1, 1]
+    assert samples[("input_window_samples", 'window="1h"')] == 6
+    assert samples[("input_window_min", 'window="1h"')] == 7.8
+    assert samples[("input_window_max", 'window="24h"')] == 8.4
+    assert abs(samples[("input_window_mean", 'window="24h"')] - statistics.mean(values)) < 1e-6
+    assert abs(samples[("input_window_stddev", 'window="1h"')] - statistics.pstdev(values[4:])) < 1e-6
+    assert AggregateStore({"enabled": False}).samples("10.0.0.1", fetch) == []
+
+    # Large, nearly constant readings: E[x²] - mean² would cancel to noise.
+    orp = array.array('d', [1e9 + 1, 1e9 + 2, 1e9 + 3])
+    orp_statistics = window_statistics(array.array('d', [1, 2, 3]), orp, 3, {"1h": 3600})["1h"]
+    assert abs(orp_statistics[4] - statistics.pstdev([1, 2, 3])) < 1e-9
+
+
+def test_one_shot_collection_writes_changed_files(tmp_path):
+    from neptune_modules import neptune_collect
+    output_directory = str(tmp_path)
+    bodies = {"192.168.1.50": b'apex_sensor_ph{input_did="base_pH"} 8.1\n'}
+
+    def render(target):
+        def render_target():
+            if target not in bodies:
+                raise ValueError("Apex unreachable")
+            return bodies[target]
+        return render_target
+
+    tasks = [("apex", target, render(target)) for target in ("192.168.1.50", "192.168.1.51")]
+    results, wall_seconds = neptune_collect.run_collection(tasks, {"apex": 2}, output_directory)
+    assert [result["state"] for result in results] == [neptune_collect.WRITTEN, neptune_collect.FAILED]
+    file_path = neptune_collect.output_path(output_directory, "apex", "192.168.1.50")
+    assert open(file_path, 'rb').read() == bodies["192.168.1.50"]
+    modified_time = os.stat(file_path).st_mtime_ns
+
+    results, wall_seconds = neptune_collect.run_collection(tasks, {"apex": 2}, output_directory)
+    assert results[0]["state"] == neptune_collect.UNCHANGED and os.stat(file_path).st_mtime_ns == modified_time
+    assert sorted(os.listdir(output_directory)) == ["neptune_apex_192.168.1.50.prom"]
+    assert "1 unchanged, 1 failed" in neptune_collect.report(results, wall_seconds)
+    assert b'neptune_collect_target_success{source="apex",target="192.168.1.51"} 0' in \
+        neptune_collect.summary_exposition(results, wall_seconds, 0)
+
+
+def test_workspace_lock_is_exclusive(tmp_path):
+    import neptune_exporter
+    workspace_directory = str(tmp_path / "workspace")
+    assert neptune_exporter.lock_workspace(workspace_directory)
+    # Held by this process, and the lock file keeps other workers out.
+    assert not neptune_exporter.lock_workspace(workspace_directory)
+    assert os.path.isfile(os.path.join(workspace_directory, "WORKSPACE_LOCKED"))
+    neptune_exporter.unlock_workspace(workspace_directory)
+    assert not os.path.exists(os.path.join(workspace_directory, "WORKSPACE_LOCKED"))
+    open(os.path.join(workspace_directory, "WORKSPACE_LOCKED"), "w").close()
+    assert not neptune_exporter.lock_workspace(workspace_directory)
+    # A lock file left by a crashed export expires after 5 minutes.
+    os.utime(os.path.join(workspace_directory, "WORKSPACE_LOCKED"), (1, 1))
+    assert neptune_exporter.lock_workspace(workspace_directory)
+    neptune_exporter.unlock_workspace(workspace_directory)
+
+
+def test_payload_cache_waiters_do_not_queue_behind_slow_loads():
+    import threading
+    from neptune_modules.neptune_cache import PayloadCache
+    cache = PayloadCache()
+    release = threading.Event()
+    export_thread = threading.Thread(target=lambda: cache.fetch(("10.0.0.1", "status", None),
+                                                                lambda: (release.wait(), ("export", 1))[1], rank=2))
+    export_thread.start()
+    while not cache.loading:
+        pass
+    # A metrics scrape (rank 0) does not wait for the export's fetch.
+    assert cache.fetch(("10.0.0.1", "status", None), lambda: ("metrics", 1), rank=0) == "metrics"
+    # An equally urgent caller waits for a hung fetch, but only up to its own deadline.
+    cache.loading[("10.0.0.1", "ilog", 1)] = (threading.Event(), 2)
+    assert cache.fetch(("10.0.0.1", "ilog", 1), lambda: ("ilog", 1), rank=2, max_wait=0.01) == "ilog"
+    release.set()
+    export_thread.join()
+    assert cache.bypasses == 2
+
+
+def test_retired_browser_quits_after_last_lease():
+    from neptune_modules import neptune_fusion
+
+    class FakeDriver:
+        quits = 0
+
+        def quit(self):
+            self.quits += 1
+
+    driver = FakeDriver()
+    browser_session = neptune_fusion.BrowserSession(("user", "password"), driver)
+    browser_session.lease()
+    neptune_fusion.browser_sessions["234j5nliu2345oin2345in2345"] = browser_session
+    # A fusion.yml change retires the browser while a scrape still uses it.
+    neptune_fusion.close_browser_session("234j5nliu2345oin2345in2345")
+    assert "234j5nliu2345oin2345in2345" not in neptune_fusion.browser_sessions
+    assert driver.quits == 0
+    browser_session.release()
+    assert driver.quits == 1
+    browser_session.retire()
+    assert driver.quits == 1
+
+
+def exit_immediately():
+    pass
+
+
+def test_worker_mode_refuses_upstream_routes_and_restarts_collector(monkeypatch):
+    import pytest
+    from fastapi import HTTPException
+    import neptune_exporter
+    monkeypatch.setitem(neptune_exporter.configuration, "server", {"workers": 2})
+    with pytest.raises(HTTPException) as error:
+        neptune_exporter.history_sync_apex("192.168.1.50", "default")
+    assert error.value.status_code == 501
+    monkeypatch.setattr(neptune_exporter, "snapshot_collector_process", True)
+    neptune_exporter.require_upstream_access()
+
+    delays = []
+    monkeypatch.setattr(neptune_exporter.time, "sleep", delays.append)
+    neptune_exporter.supervise_snapshot_collector(exit_immediately, restarts=2)
+    assert delays == [5, 10]
+
+
+def test_rejected_login_is_not_swallowed():
+    import pytest
+    from neptune_modules import neptune_apex
+    from neptune_modules.neptune_admission import AdmissionRejected
+    apex_direct = neptune_apex.APEX.__new__(neptune_apex.APEX)
+    apex_direct.apex_ip = "192.168.1.50"
+    apex_direct.priority = "export"
+    apex_direct.session_cookie = ""
+
+    def shed_login():
+        raise AdmissionRejected("192.168.1.50", "export", "queue_full")
+
+    apex_direct.authentication = shed_login
+    with pytest.raises(AdmissionRejected):
+        apex_direct.rest_fetch("http://192.168.1.50/rest/status", "Apex Status")
+
+
+def test_push_collection_survives_a_broken_backend(monkeypatch):
+    import types
+    from fastapi import HTTPException
+    import neptune_exporter
+
+    class FakeFusion:
+        def __init__(self, fusion_apex_id, data_max_age):
+            pass
+
+        def metric_samples(self):
+            return [("fusion_alkalinity", ['fusion_apex_id="1234"'], 8.2)]
+
+    fusion_module = types.SimpleNamespace(
+        load_configuration=lambda: types.SimpleNamespace(fusion_systems=["1234"]), FUSION=FakeFusion)
+
+    def load_backend(backend_name):
+        if backend_name == "apex":
+            raise HTTPException(status_code=503, detail="apex.yml is invalid")
+        return fusion_module
+
+    monkeypatch.setattr(neptune_exporter, "backend_enabled", lambda backend_name: True)
+    monkeypatch.setattr(neptune_exporter, "load_backend", load_backend)
+    series = neptune_exporter.collect_push_series()
+    assert [labels["instance"] for labels, _ in series] == ["1234"]
+
+
+def test_history_append_recovers_from_an_interrupted_write(tmp_path):
+    import array
+    import os
+    from neptune_modules import neptune_history
+    store = neptune_history.HistoryStore(str(tmp_path))
+    store.append("apex", "192.168.1.50", "pH", {"metric": "input"}, [(1000, 7.9), (2000, 8.0)])
+    series_path = store.series_path("apex", "192.168.1.50", "pH")
+    # Interrupted after the timestamp column was written.
+    with open(os.path.join(series_path, neptune_history.TIMESTAMPS_FILE), 'ab') as timestamps_file:
+        array.array('q', [3000]).tofile(timestamps_file)
+    assert store.append("apex", "192.168.1.50", "pH", {"metric": "input"}, [(4000, 8.1)]) == 1
+    assert list(store.read_points("apex", "192.168.1.50", "pH", 0, 5000)) == [(1000, 7.9), (2000, 8.0), (4000, 8.1)]
+
+
+def test_warmup_defers_the_fusion_import(tmp_path, monkeypatch):
+    import neptune_exporter
+    from neptune_modules import neptune_config
+    (tmp_path / "fusion.yml").write_text("fusion:\n  apex_systems:\n    abc123:\n      username: admin\n      password: '1234'\n")
+    monkeypatch.setattr(neptune_config, "configuration_directory", str(tmp_path))
+    monkeypatch.setattr(neptune_exporter, "backend_modules", {})
+    monkeypatch.setattr(neptune_exporter, "backend_enabled", lambda backend_name: backend_name == "fusion")
+    monkeypatch.setitem(neptune_exporter.configuration, "warmup", {"enabled": True})
+    warmup = neptune_exporter.build_warmup()
+    assert [(source, target) for source, target, _ in warmup.tasks] == [("fusion", "abc123")]
+    assert "fusion" not in neptune_exporter.backend_modules
+
+
+def test_if_none_match_compares_whole_entity_tags():
+    from neptune_modules import prometheus_metrics
+    assert prometheus_metrics.matches_etag('"etag-1"', '"etag-1"')
+    assert prometheus_metrics.matches_etag('"etag-0", W/"etag-1"', '"etag-1"')
+    assert prometheus_metrics.matches_etag('*', '"etag-1"')
+    assert not prometheus_metrics.matches_etag('"etag-1-gzip"', '"etag-1"')
+    assert not prometheus_metrics.matches_etag('"etag-1"', '"etag-1-gzip"')
+    assert not prometheus_metrics.matches_etag(None, '"etag-1"')
+
+
+def test_history_sync_catches_up_missed_days(tmp_path, monkeypatch):
+    import types
+    from neptune_modules import neptune_history
+    clock = [1700000000.0]
+    monkeypatch.setattr(neptune_history.time, "time", lambda: clock[0])
+    requested_days = []
+
+    def internal_log(days):
+        requested_days.append(days)
+        # One record per hour over the requested window.
+        return sample_ilog(int(clock[0]) - days * 86400 + 3600, days * 24, step_seconds=3600)
+
+    apex = types.SimpleNamespace(apex_ip="10.0.0.1", internal_log=internal_log)
+    store = neptune_history.HistoryStore(str(tmp_path))
+    neptune_history.sync_apex(store, apex, cold_start_days=2)
+    clock[0] += 3 * 86400
+    neptune_history.sync_apex(store, apex, cold_start_days=30)
+    assert requested_days == [2, 4]
+    timestamps = [timestamp for timestamp, _ in store.read_points("apex", "10.0.0.1", "base_pH", 0, 10 ** 13)]
+    assert len(timestamps) == 5 * 24
+    assert set(later - earlier for earlier, later in zip(timestamps, timestamps[1:])) == {3600 * 1000}
+
+
+def test_history_append_skips_values_that_are_not_numbers(tmp_path):
+    from neptune_modules import neptune_history
+    store = neptune_history.HistoryStore(str(tmp_path))
+    ilog = sample_ilog(1700000000, 3)
+    ilog["ilog"]["record"][1]["data"][1]["value"] = ""
+    ilog["ilog"]["record"][2]["data"][1]["value"] = None
+    assert neptune_history.store_series(store, "apex", "10.0.0.1", neptune_history.apex_ilog_series(ilog)) == 4
+    assert [value for _, value in store.read_points("apex", "10.0.0.1", "base_Temp", 0, 10 ** 13)] == [77.0, 78.0, 79.0]
+    assert [value for _, value in store.read_points("apex", "10.0.0.1", "base_pH", 0, 10 ** 13)] == [8.0]
+
+
+def test_openmetrics_export_reports_covered_range(tmp_path, monkeypatch):
+    import time
+    import neptune_exporter
+    from neptune_modules import neptune_history
+    store = neptune_history.HistoryStore(str(tmp_path))
+    monkeypatch.setattr(neptune_exporter, "history_store", store)
+    first_record = int(time.time()) - 10 * 86400
+    neptune_history.store_series(store, "apex", "10.0.0.1",
+                                 neptune_history.apex_ilog_series(sample_ilog(first_record, 3)))
+    headers = neptune_exporter.openmetrics_backfill_response("apex", "10.0.0.1", 365).headers
+    assert headers["x-history-complete"] == "false"
+    assert headers["x-history-covered-start"] == str(first_record)
+    assert neptune_exporter.openmetrics_backfill_response("apex", "10.0.0.1", 11).headers["x-history-complete"] == "true"
+
+
+def test_openmetrics_render_spells_nan_and_infinities():
+    from neptune_modules import prometheus_metrics
+    sample_keys = [("sensor_orp", ['input_name="ORP"']), ("sensor_ph", ['input_name="pH"'])]
+    cache = prometheus_metrics.ExpositionCache()
+    body, _ = cache.render("10.0.0.1", ("structure",), [float("nan"), float("-inf")],
+                           lambda: prometheus_metrics.line_prefixes(sample_keys, prometheus_metrics.OPENMETRICS_FORMAT),
+                           prometheus_metrics.exposition_suffix(prometheus_metrics.OPENMETRICS_FORMAT),
+                           prometheus_metrics.OPENMETRICS_FORMAT)
+    lines = body.decode().splitlines()
+    assert lines[-1] == "# EOF"
+    assert [line.rsplit(" ", 1)[1] for line in lines if line.startswith("apex_")] == ["NaN", "-Inf"]
+
+
+def test_push_series_include_rolling_aggregates(monkeypatch):
+    import types
+    import neptune_exporter
+    from neptune_modules import neptune_aggregates
+
+    class FakeApex:
+        def __init__(self, apex_ip, auth_module):
+            pass
+
+        def status(self):
+            return {}
+
+        def metric_sample_keys(self, apex_status):
+            return [("sensor_ph", ['input_did="base_pH"'])]
+
+        def metric_values(self, apex_status):
+            return [8.1]
+
+        def internal_log(self, days):
+            return sample_ilog(1700000000, 3)
+
+    apex_module = types.SimpleNamespace(
+        load_configuration=lambda: types.SimpleNamespace(apex_targets=[("10.0.0.1", "default")]), APEX=FakeApex)
+    monkeypatch.setattr(neptune_exporter, "backend_enabled", lambda backend_name: backend_name == "apex")
+    monkeypatch.setattr(neptune_exporter, "load_backend", lambda backend_name: apex_module)
+    monkeypatch.setattr(neptune_aggregates, "aggregate_store", neptune_aggregates.AggregateStore())
+    names = {labels["__name__"] for labels, _ in neptune_exporter.collect_push_series()}
+    assert {"apex_sensor_ph", "apex_input_window_mean", "apex_input_window_stddev"} <= names
+
+
+def test_invalid_sharding_file_owns_nothing(tmp_path, monkeypatch):
+    import os
+    from neptune_modules import neptune_config, neptune_sharding
+    monkeypatch.setattr(neptune_config, "configuration_directory", str(tmp_path))
+    monkeypatch.setattr(neptune_sharding, "configuration_store", neptune_config.ConfigStore(
+        'sharding.yml', neptune_sharding.compile_sharding_configuration))
+    # No sharding.yml: sharding is disabled and this node owns everything.
+    assert neptune_sharding.owns("apex", "192.168.1.50")
+
+    sharding_path = tmp_path / "sharding.yml"
+    sharding_path.write_text("sharding:\n  nodes: [node-1:5006]\n  self: node-9:5006\n")
+    assert not neptune_sharding.owns("apex", "192.168.1.50")
+    assert neptune_sharding.owner("apex", "192.168.1.50") is None
+
+    sharding_path.write_text("sharding:\n  nodes: [node-1:5006]\n  self: node-1:5006\n")
+    os.utime(str(sharding_path), (1700000000, 1700000000))
+    assert neptune_sharding.owns("apex", "192.168.1.50")